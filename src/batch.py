@@ -0,0 +1,217 @@
+"""
+Lenna's batch query mode
+
+Runs a file of lookups such as "doll makiatto", "weapon bittersweet caramel"
+or "define frozen" through Responder without Discord, and writes every
+rendered embed as a JSON line with its timing. Handy to validate the whole
+cache after a parser change, to diff outputs between versions, and to
+benchmark Responder on its own
+
+Usage (from src/, like main.py):
+    python batch.py queries.txt
+    python batch.py queries.txt --cache-only --workers 4 --output embeds.jsonl
+    echo "doll makiatto" | python batch.py -
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import sys
+import tempfile
+import time
+
+from cache import Cache
+from fixtures import FixtureStore, ReplaySession
+from responder import Responder
+from watcher import capitalize_roman_numerals, fix_name
+from wiki_client import WikiClient
+
+LOGFILE = "lenna_batch.log"
+CMD_PREFIX = "!"
+COMMENT_PREFIX = "#"
+
+# Lookup commands and the Responder call each of them makes, as
+# (entity, lookup arguments)
+BATCH_COMMANDS = {
+    "doll": ("doll", {}),
+    "mdoll": ("doll", {"use_cache": True}),
+    "fdoll": ("doll", {"force": True}),
+    "keys": ("doll", {"with_doll": False, "with_keys": True}),
+    "fkeys": ("doll", {"with_doll": False, "with_keys": True, "force": True}),
+    "weapon": ("weapon", {}),
+    "mweapon": ("weapon", {"use_cache": True}),
+    "fweapon": ("weapon", {"force": True, "use_cache": True}),
+    "define": ("status_effect", {}),
+}
+
+
+class BatchQueryException(Exception):
+    """
+    Exception for when a batch query line cannot be understood
+    """
+
+    def __init__(self, message):
+        self.message = f"BatchQueryException: {message}"
+        super().__init__(self.message)
+
+
+def parse_query(line):
+    """
+    Splits a query line into its command and argument
+    A leading command prefix is allowed, e.g., "!doll makiatto"
+    """
+
+    command, _, argument = line.strip().removeprefix(CMD_PREFIX).partition(" ")
+    command = command.lower()
+    argument = argument.strip()
+
+    if command not in BATCH_COMMANDS:
+        raise BatchQueryException(f"Unknown command {command}!")
+    elif not argument:
+        raise BatchQueryException(f"Command {command} needs a name!")
+
+    return command, argument
+
+
+def run_query(responder, line, cache_only=False):
+    """
+    Runs one query line through the responder, the same way Watcher would
+    Returns a dictionary ready to be written as a JSON line
+    """
+
+    result = {
+        "query": line,
+        "ok": False,
+    }
+
+    start_time = time.perf_counter()
+    try:
+        command, argument = parse_query(line)
+        entity, lookup_arguments = BATCH_COMMANDS[command]
+        if cache_only:
+            lookup_arguments = {**lookup_arguments, "use_cache": True, "force": False}
+
+        if entity == "doll":
+            embed = responder.get_doll(fix_name(argument), **lookup_arguments)
+        elif entity == "weapon":
+            embed = responder.get_weapon(argument.lower(), **lookup_arguments)
+        else:
+            status_effect_name = capitalize_roman_numerals(fix_name(argument))
+            embed = responder.get_status_effect(status_effect_name, **lookup_arguments)
+
+        result["ok"] = True
+        result["embed"] = embed.to_dict()
+    except Exception as e:
+        result["error"] = str(e)
+
+    result["elapsed_ms"] = (time.perf_counter() - start_time) * 1000
+
+    return result
+
+
+def read_queries(query_file):
+    """
+    Reads query lines, skipping blank lines and comments
+    """
+
+    queries = []
+    for line in query_file:
+        line = line.strip()
+        if not line or line.startswith(COMMENT_PREFIX):
+            continue
+
+        queries.append(line)
+
+    return queries
+
+
+def run_batch(responder, queries, workers=1, cache_only=False):
+    """
+    Runs every query, workers at a time
+    Yields the results in the order of the queries
+    """
+
+    if workers <= 1:
+        for query in queries:
+            yield run_query(responder, query, cache_only)
+        return
+
+    with ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="lenna-batch"
+    ) as executor:
+        yield from executor.map(
+            lambda query: run_query(responder, query, cache_only), queries
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Runs lookups through Lenna's Responder without Discord"
+    )
+    parser.add_argument("queries", help="File of queries, one per line, - for stdin")
+    parser.add_argument(
+        "--output", help="File to write the JSON lines to, defaults to stdout"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Queries to run in parallel"
+    )
+    parser.add_argument(
+        "--cache-only",
+        action="store_true",
+        help="Answer only from the cache, never query the wiki",
+    )
+    parser.add_argument(
+        "--fixtures",
+        help="Replay this fixtures directory over an empty cache instead of "
+        "using the wiki and the local cache",
+    )
+    args = parser.parse_args()
+
+    log = logging.getLogger(__name__)
+    logging.basicConfig(filename=LOGFILE, encoding="utf-8")
+    log.setLevel(logging.INFO)
+
+    if args.queries == "-":
+        queries = read_queries(sys.stdin)
+    else:
+        with open(args.queries, "r", encoding="utf8") as query_file:
+            queries = read_queries(query_file)
+
+    cache = None
+    wiki = None
+    cache_directory = None
+    if args.fixtures is not None:
+        cache_directory = tempfile.TemporaryDirectory(prefix="lenna_batch_")
+        cache = Cache(log, directory=cache_directory.name)
+        wiki = WikiClient(log, {}, min_request_interval=0)
+        wiki.session = ReplaySession(FixtureStore(args.fixtures))
+
+    responder = Responder(log, CMD_PREFIX, cache=cache, wiki=wiki)
+    output = sys.stdout
+    if args.output is not None:
+        output = open(args.output, "w", encoding="utf8")
+
+    failures = 0
+    start_time = time.perf_counter()
+    try:
+        for result in run_batch(responder, queries, args.workers, args.cache_only):
+            failures += not result["ok"]
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+        responder.close()
+        if cache_directory is not None:
+            cache_directory.cleanup()
+
+    print(
+        f"Ran {len(queries)} queries, {failures} failed, "
+        f"in {time.perf_counter() - start_time:.2f}s",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,519 @@
+"""
+Lenna's benchmark suite
+
+Offline benchmarks over recorded IOPWIKI responses in bench/fixtures/
+Measures parse throughput of Doll, Weapons, StatusEffects and
+parse_utils.simplify, slash command autocomplete, plus end-to-end Responder lookups against a replay
+session with a cold and a warm cache. Results are written as JSON, and two
+result files can be compared to flag regressions
+
+Usage (from src/, like main.py):
+    python benchmark.py run
+    python benchmark.py run --output ../bench/results/baseline.json
+    python benchmark.py compare ../bench/results/baseline.json ../bench/results/new.json
+    python benchmark.py record --dolls Makiatto Qiongjiu
+"""
+
+import argparse
+from datetime import datetime, timezone
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+from cache import (
+    Cache,
+    DATE_FORMAT,
+    SKILL_END_RANGE,
+    SKILL_START_RANGE,
+    STATUS_EFFECTS_CACHE_KEY,
+    WEAPONS_CACHE_KEY,
+    doll_cache_key,
+    skill_cache_key,
+)
+from crawl import Crawler
+from doll import Doll
+from fixtures import (
+    FIXTURES_DIRECTORY,
+    FixtureStore,
+    ReplaySession,
+)
+from name_index import WEAPON_NAMES, NameIndex
+from parse_pool import ParsePool
+from parse_utils import simplify
+from responder import Responder
+from status_effects import StatusEffects
+from weapons import Weapons
+from wiki_client import WikiClient, load_headers
+
+LOGFILE = "lenna_benchmark.log"
+RESULTS_DIRECTORY = "../bench/results/"
+
+RESULTS_FORMAT = "lenna-benchmark"
+RESULTS_VERSION = 1
+DEFAULT_ITERATIONS = 20
+DEFAULT_REGRESSION_THRESHOLD = 0.10
+
+WEAPONS_TABLE_END = "\n|}"
+
+# Lookups per end-to-end benchmark, picked from the fixtures
+LOOKUPS_PER_ENTITY = 3
+
+
+def _summarize(samples):
+    """
+    Internal function to summarize timing samples, in milliseconds
+    """
+
+    ordered = sorted(sample * 1000 for sample in samples)
+    p95_index = min(int(0.95 * len(ordered)), len(ordered) - 1)
+
+    return {
+        "runs": len(ordered),
+        "mean_ms": statistics.fmean(ordered),
+        "median_ms": statistics.median(ordered),
+        "p95_ms": ordered[p95_index],
+        "min_ms": ordered[0],
+    }
+
+
+def _time(func, iterations, setup=None):
+    """
+    Internal function to time func iterations times
+    setup runs before every iteration and is not timed; its result is passed
+    to func
+    """
+
+    samples = []
+    for _ in range(iterations):
+        argument = setup() if setup is not None else None
+
+        start_time = time.perf_counter()
+        func(argument)
+        samples.append(time.perf_counter() - start_time)
+
+    return samples
+
+
+class Benchmark:
+    """
+    Benchmark class definition
+    """
+
+    def __init__(self, log, store, iterations=DEFAULT_ITERATIONS):
+        self.log = log
+        self.store = store
+        self.iterations = iterations
+
+        self.doll_names = store.doll_names()
+        self.lookups = self._lookups()
+
+        # End-to-end lookups parse inline, so they stay comparable across
+        # machines; the pool benchmarks send everything to the workers
+        self.parse_pool = ParsePool(log, min_bytes=0)
+        self._temporary_directory = tempfile.TemporaryDirectory(
+            prefix="lenna_benchmark_"
+        )
+
+    def close(self):
+        self.parse_pool.close()
+        self._temporary_directory.cleanup()
+
+    def run(self):
+        """
+        Runs every benchmark
+        Returns a dictionary of benchmark name to timing summary
+        """
+
+        benchmarks = {
+            "parse.doll": self._parse_doll,
+            "parse.weapons": self._parse_weapons,
+            "parse.weapons.edit": self._parse_weapons_edit,
+            "parse.status_effects": self._parse_status_effects,
+            "parse.simplify": self._simplify,
+            "parse.pool.dolls": self._pool_parse_dolls,
+            "parse.pool.weapons": self._pool_parse_weapons,
+            "autocomplete.weapon": self._autocomplete_weapon,
+        }
+        for entity, lookup in (
+            ("doll", self._lookup_doll),
+            ("dolls", self._lookup_dolls),
+            ("weapon", self._lookup_weapon),
+            ("status_effect", self._lookup_status_effect),
+        ):
+            benchmarks[f"responder.get_{entity}.cold"] = self._cold(lookup)
+            benchmarks[f"responder.get_{entity}.warm"] = self._warm(lookup)
+
+        results = {}
+        for name, benchmark in benchmarks.items():
+            samples = benchmark()
+            results[name] = _summarize(samples)
+            print(
+                f"{name}: median {results[name]['median_ms']:.2f}ms, "
+                f"p95 {results[name]['p95_ms']:.2f}ms over {len(samples)} runs"
+            )
+
+        return results
+
+    def _doll_wikitext(self, doll_name):
+        """
+        Internal function to get the wikitext of a doll and its skills
+        """
+
+        doll_data = self.store.wikitext(doll_cache_key(doll_name))
+        doll_skills = [
+            self.store.wikitext(skill_cache_key(doll_name, i))
+            for i in range(SKILL_START_RANGE, SKILL_END_RANGE)
+        ]
+
+        return doll_data, doll_skills
+
+    def _parse_doll(self):
+        dolls = [self._doll_wikitext(doll_name) for doll_name in self.doll_names]
+
+        def parse(_):
+            for doll_data, doll_skills in dolls:
+                Doll(doll_data, doll_skills)
+
+        # One run parses every recorded doll, report per doll
+        samples = _time(parse, self.iterations)
+
+        return [sample / len(dolls) for sample in samples]
+
+    def _parse_weapons(self):
+        wikitext = self.store.wikitext(WEAPONS_CACHE_KEY)
+
+        return _time(lambda _: Weapons(wikitext), self.iterations)
+
+    def _parse_weapons_edit(self):
+        wikitext = self.store.wikitext(WEAPONS_CACHE_KEY)
+        previous = Weapons(wikitext)
+
+        # A one-line edit to the last table, only that table is re-parsed
+        table_end = wikitext.rindex(WEAPONS_TABLE_END)
+        edited_wikitext = f"{wikitext[:table_end]}|-\n{wikitext[table_end:]}"
+
+        return _time(
+            lambda _: Weapons(edited_wikitext, previous=previous), self.iterations
+        )
+
+    def _parse_status_effects(self):
+        wikitext = self.store.wikitext(STATUS_EFFECTS_CACHE_KEY)
+
+        return _time(lambda _: StatusEffects(wikitext), self.iterations)
+
+    def _pool_parse_dolls(self):
+        dolls = [self._doll_wikitext(doll_name) for doll_name in self.doll_names]
+
+        # Workers start outside the timed runs
+        self.parse_pool.dolls(dolls)
+        samples = _time(lambda _: self.parse_pool.dolls(dolls), self.iterations)
+
+        return [sample / len(dolls) for sample in samples]
+
+    def _pool_parse_weapons(self):
+        wikitext = self.store.wikitext(WEAPONS_CACHE_KEY)
+
+        self.parse_pool.weapons(wikitext)
+
+        return _time(lambda _: self.parse_pool.weapons(wikitext), self.iterations)
+
+    def _autocomplete_weapon(self):
+        weapons = Weapons(self.store.wikitext(WEAPONS_CACHE_KEY))
+        names = NameIndex()
+        names.replace(
+            WEAPON_NAMES, (weapon.name for weapon in weapons.weapons.values())
+        )
+
+        # Every prefix of every weapon name, as typed one letter at a time
+        prefixes = [
+            weapon.name[:length]
+            for weapon in weapons.weapons.values()
+            for length in range(len(weapon.name) + 1)
+        ]
+
+        def complete_all(_):
+            for prefix in prefixes:
+                names.complete(WEAPON_NAMES, prefix)
+
+        # Report per keystroke
+        samples = _time(complete_all, self.iterations)
+
+        return [sample / len(prefixes) for sample in samples]
+
+    def _simplify(self):
+        # Status effect descriptions are a realistic mix of links and templates,
+        # each of them follows its "== Name ==" header
+        wikitext = self.store.wikitext(STATUS_EFFECTS_CACHE_KEY)
+        paragraphs = wikitext.split(StatusEffects._SEPARATOR_STRING)
+        paragraphs = [
+            paragraph
+            for header, paragraph in zip(paragraphs, paragraphs[1:])
+            if header.startswith(StatusEffects._STATUS_HEADER_STRING)
+        ]
+
+        def simplify_all(_):
+            for paragraph in paragraphs:
+                simplify(paragraph)
+
+        # Report per call
+        samples = _time(simplify_all, self.iterations)
+
+        return [sample / len(paragraphs) for sample in samples]
+
+    def _responder(self):
+        """
+        Internal function to create a Responder over an empty cache that
+        queries the fixtures
+        """
+
+        wiki = WikiClient(self.log, {}, min_request_interval=0)
+        wiki.session = ReplaySession(self.store)
+        cache = Cache(
+            self.log, directory=tempfile.mkdtemp(dir=self._temporary_directory.name)
+        )
+
+        return Responder(
+            self.log,
+            "!",
+            cache=cache,
+            wiki=wiki,
+            parse_pool=ParsePool(self.log, workers=0),
+        )
+
+    def _lookups(self):
+        """
+        Internal function to pick what the end-to-end benchmarks look up
+        Signature weapons of the recorded dolls and the first status effects
+        """
+
+        doll_names = self.doll_names[:LOOKUPS_PER_ENTITY]
+
+        weapon_names = []
+        for doll_name in doll_names:
+            doll = Doll(*self._doll_wikitext(doll_name))
+            weapon_names.append(doll.signature_weapon.strip().lower())
+
+        status_effects = StatusEffects(self.store.wikitext(STATUS_EFFECTS_CACHE_KEY))
+        status_effect_names = list(status_effects.status_effects)[:LOOKUPS_PER_ENTITY]
+
+        return doll_names, weapon_names, status_effect_names
+
+    def _lookup_doll(self, responder):
+        for doll_name in self.lookups[0]:
+            responder.get_doll(doll_name)
+
+    def _lookup_dolls(self, responder):
+        responder.get_dolls(self.lookups[0])
+
+    def _lookup_weapon(self, responder):
+        for weapon_name in self.lookups[1]:
+            responder.get_weapon(weapon_name)
+
+    def _lookup_status_effect(self, responder):
+        for status_effect_name in self.lookups[2]:
+            responder.get_status_effect(status_effect_name)
+
+    def _cold(self, lookup):
+        """
+        Internal function to benchmark a lookup with nothing cached
+        """
+
+        return lambda: _time(lookup, self.iterations, setup=self._responder)
+
+    def _warm(self, lookup):
+        """
+        Internal function to benchmark a lookup served from the cache
+        """
+
+        def warm():
+            responder = self._responder()
+            lookup(responder)
+
+            return _time(lookup, self.iterations, setup=lambda: responder)
+
+        return warm
+
+
+def run_benchmarks(log, store, iterations=DEFAULT_ITERATIONS):
+    """
+    Runs the benchmark suite over the fixtures
+    Returns the results, ready to be written as JSON
+    """
+
+    benchmark = Benchmark(log, store, iterations)
+    try:
+        benchmarks = benchmark.run()
+    finally:
+        benchmark.close()
+
+    return {
+        "format": RESULTS_FORMAT,
+        "version": RESULTS_VERSION,
+        "created": datetime.now(timezone.utc).strftime(DATE_FORMAT),
+        "python": platform.python_version(),
+        "fixtures": len(store.keys()),
+        "iterations": iterations,
+        "benchmarks": benchmarks,
+    }
+
+
+def compare_results(baseline, current, threshold=DEFAULT_REGRESSION_THRESHOLD):
+    """
+    Compares the medians of two benchmark results
+    A benchmark regressed when its median grew by more than threshold
+
+    Returns a list of (name, baseline ms, current ms, relative change, regressed)
+    """
+
+    comparisons = []
+    for name, result in current["benchmarks"].items():
+        baseline_result = baseline["benchmarks"].get(name)
+        if baseline_result is None:
+            continue
+
+        baseline_median = baseline_result["median_ms"]
+        current_median = result["median_ms"]
+        change = (current_median - baseline_median) / baseline_median
+
+        comparisons.append(
+            (name, baseline_median, current_median, change, change > threshold)
+        )
+
+    return comparisons
+
+
+def record_fixtures(log, store, doll_names, delay=WikiClient.MIN_REQUEST_INTERVAL):
+    """
+    Records the pages of doll_names, the weapons page and the status effects
+    page from the real wiki into the fixtures
+    Returns the titles that do not exist on the wiki
+    """
+
+    wiki = WikiClient(log, load_headers(), min_request_interval=delay)
+    try:
+        pages = Crawler(log, wiki, None).plan(doll_names)
+
+        missing = []
+        payloads = wiki.fetch_pages([page_title for page_title, _ in pages])
+        for page_title, cache_key in pages:
+            payload = payloads.get(page_title)
+            if payload is None:
+                missing.append(page_title)
+                continue
+
+            store.record(cache_key, payload)
+    finally:
+        wiki.close()
+
+    return missing
+
+
+def _load_results(path):
+    """
+    Internal function to read a results file
+    """
+
+    with open(path, "r", encoding="utf8") as results_file:
+        results = json.load(results_file)
+
+    if results.get("format") != RESULTS_FORMAT:
+        raise ValueError(f"{path} is not a Lenna benchmark result!")
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks Lenna offline")
+    parser.add_argument(
+        "--fixtures",
+        default=FIXTURES_DIRECTORY,
+        help="Directory of recorded API responses",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the benchmarks")
+    run_parser.add_argument(
+        "--iterations",
+        type=int,
+        default=DEFAULT_ITERATIONS,
+        help="Timed runs per benchmark",
+    )
+    run_parser.add_argument(
+        "--output", help="Results file, defaults to a timestamped file"
+    )
+
+    compare_parser = subparsers.add_parser(
+        "compare", help="Compare two results and flag regressions"
+    )
+    compare_parser.add_argument("baseline", help="Results to compare against")
+    compare_parser.add_argument("current", help="Results to check")
+    compare_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_REGRESSION_THRESHOLD,
+        help="Relative slowdown of the median counted as a regression",
+    )
+
+    record_parser = subparsers.add_parser("record", help="Record fixtures from IOPWIKI")
+    record_parser.add_argument(
+        "--dolls", nargs="+", required=True, help="Dolls to record"
+    )
+    record_parser.add_argument(
+        "--delay",
+        type=float,
+        default=WikiClient.MIN_REQUEST_INTERVAL,
+        help="Minimum seconds between two requests to the wiki",
+    )
+    args = parser.parse_args()
+
+    log = logging.getLogger(__name__)
+    logging.basicConfig(filename=LOGFILE, encoding="utf-8")
+    log.setLevel(logging.INFO)
+
+    if args.command == "run":
+        results = run_benchmarks(log, FixtureStore(args.fixtures), args.iterations)
+
+        output = args.output
+        if output is None:
+            os.makedirs(RESULTS_DIRECTORY, exist_ok=True)
+            timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+            output = os.path.join(RESULTS_DIRECTORY, f"{timestamp}.json")
+
+        with open(output, "w", encoding="utf8") as results_file:
+            json.dump(results, results_file, indent=4)
+
+        print(f"Wrote results to {output}")
+    elif args.command == "compare":
+        comparisons = compare_results(
+            _load_results(args.baseline), _load_results(args.current), args.threshold
+        )
+
+        regressions = 0
+        for name, baseline_median, current_median, change, regressed in comparisons:
+            flag = "REGRESSION" if regressed else "ok"
+            print(
+                f"{name}: {baseline_median:.2f}ms -> {current_median:.2f}ms "
+                f"({change:+.1%}) {flag}"
+            )
+            regressions += regressed
+
+        print(f"{regressions} regressions over {args.threshold:.0%}")
+        if regressions:
+            sys.exit(1)
+    else:
+        missing = record_fixtures(
+            log, FixtureStore(args.fixtures), args.dolls, args.delay
+        )
+        for page_title in missing:
+            print(f"Missing: {page_title}")
+
+        print(f"Recorded fixtures into {args.fixtures}")
+
+
+if __name__ == "__main__":
+    main()
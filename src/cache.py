@@ -0,0 +1,645 @@
+"""
+Cache class
+
+Local, on-disk cache of IOPWIKI API responses
+Every entry is a JSON file under data/cache/ named after its cache key
+"""
+
+import argparse
+from datetime import datetime, timezone
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+from log_pipeline import SAMPLED
+from special_names import (
+    SPECIAL_DOLL_NAMES,
+)
+
+LOGFILE = "lenna_cache.log"
+
+CACHE_DIRECTORY = "../data/cache/"
+CACHE_FILE_EXTENSION = ".json"
+TEMPORARY_FILE_EXTENSION = ".tmp"
+
+# Temporary files older than this are leftovers of interrupted writes, newer
+# ones may belong to a write still in progress, e.g., of a running bot
+TEMPORARY_FILE_MAX_AGE = 10 * 60
+WEAPONS_CACHE_KEY = "weapons"
+STATUS_EFFECTS_CACHE_KEY = "status_effects"
+
+# Shared pages every lookup of their kind needs, these are never evicted
+PINNED_CACHE_KEYS = {WEAPONS_CACHE_KEY, STATUS_EFFECTS_CACHE_KEY}
+
+# Byte budget, overridable through the environment
+CACHE_MAX_BYTES_ENV = "LENNA_CACHE_MAX_BYTES"
+DEFAULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Access index
+INDEX_PREFIX = "_"
+INDEX_FILE = f"{INDEX_PREFIX}index.json"
+INDEX_VERSION = 1
+INDEX_FLUSH_INTERVAL = 60
+VERSION_STRING = "version"
+ENTRIES_STRING = "entries"
+SIZE_STRING = "size"
+ACCESSED_STRING = "accessed"
+STALE_STRING = "stale"
+
+# Updateable entries have their revision checked against the wiki once they
+# were fetched this long ago
+REVISION_CHECK_SECONDS = 24 * 60 * 60
+
+# Entry fields
+FETCHED_STRING = "fetched"
+UPDATEABLE_STRING = "updateable"
+PARSE_STRING = "parse"
+REVID_STRING = "revid"
+WIKITEXT_STRING = "wikitext"
+STAR_STRING = "*"
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+# Wiki pages
+IOPWIKI_WEAPONS_PAGE = "GFL2_Weapons"
+IOPWIKI_STATUS_EFFECTS_PAGE = "GFL2_Status_Effects"
+
+# Skill pages
+SKILL_START_RANGE = 1
+SKILL_END_RANGE = 6
+SKILL_PAGE_REGEX = re.compile(r"^(?P<doll>.+)/skill(?P<index>\d*)data$")
+SKILL_KEY_REGEX = re.compile(r"^(?P<doll>.+)_skill\d*$")
+
+
+def skill_index_string(skill_number):
+    """
+    Returns the suffix the wiki uses for a skill page
+    The first skill page has no number, e.g., "Makiatto/skilldata"
+    """
+
+    return "" if skill_number == SKILL_START_RANGE else f"{skill_number}"
+
+
+def doll_cache_key(doll_name):
+    """
+    Returns the cache key of a doll page
+    """
+
+    return doll_name.lower()
+
+
+def skill_cache_key(doll_name, skill_number):
+    """
+    Returns the cache key of a doll skill page
+    """
+
+    return f"{doll_name.lower()}_skill{skill_index_string(skill_number)}"
+
+
+def doll_page_title(doll_name):
+    """
+    Returns the wiki page title of a doll
+    """
+
+    return SPECIAL_DOLL_NAMES.get(doll_name, doll_name)
+
+
+def skill_page_title(doll_name, skill_number):
+    """
+    Returns the wiki page title of a doll skill page
+    """
+
+    return f"{doll_page_title(doll_name)}/skill{skill_index_string(skill_number)}data"
+
+
+def doll_name_from_title(page_title):
+    """
+    Returns the doll name Lenna uses for a wiki page title
+
+    E.g., "Mosin-Nagant (GFL2)" -> "Mosin-Nagant"
+    """
+
+    normalized_title = page_title.replace(" ", "_")
+    for doll_name, special_title in SPECIAL_DOLL_NAMES.items():
+        if special_title == normalized_title:
+            return doll_name
+
+    return page_title
+
+
+def cache_key_for_title(page_title):
+    """
+    Maps a wiki page title to the cache key Lenna stores it under
+    Returns None for pages Lenna does not cache
+
+    E.g., "Makiatto/skill2data" -> "makiatto_skill2"
+    """
+
+    normalized_title = page_title.replace(" ", "_")
+    if normalized_title == IOPWIKI_WEAPONS_PAGE:
+        return WEAPONS_CACHE_KEY
+    elif normalized_title == IOPWIKI_STATUS_EFFECTS_PAGE:
+        return STATUS_EFFECTS_CACHE_KEY
+
+    skill_match = SKILL_PAGE_REGEX.match(page_title)
+    if skill_match is not None:
+        doll_name = doll_name_from_title(skill_match.group("doll"))
+        skill_number = int(skill_match.group("index") or SKILL_START_RANGE)
+
+        if not SKILL_START_RANGE <= skill_number < SKILL_END_RANGE:
+            return None
+
+        return skill_cache_key(doll_name, skill_number)
+
+    # Any other subpage is not something Lenna looks up
+    if "/" in page_title:
+        return None
+
+    return doll_cache_key(doll_name_from_title(page_title))
+
+
+class Cache:
+    """
+    Cache class definition
+
+    The cache is bounded by max_bytes. Access times are tracked in an index
+    file next to the entries and the least recently used entries are evicted
+    once the cache grows past its budget
+    """
+
+    def __init__(self, log, directory=CACHE_DIRECTORY, max_bytes=None):
+        self.log = log
+        self.directory = directory
+
+        if max_bytes is None:
+            max_bytes = int(os.getenv(CACHE_MAX_BYTES_ENV, DEFAULT_CACHE_MAX_BYTES))
+        self.max_bytes = max_bytes
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._lock = threading.RLock()
+
+        # Key to the lock its writers take, so stores of one key land in
+        # the order they were made and the index matches the file
+        self._write_locks = {}
+        self._index = self._load_index()
+        self._index_dirty = False
+        self._last_flush_time = time.monotonic()
+
+    def keys(self):
+        """
+        Lists the keys of every entry in the cache
+        """
+
+        keys = []
+        for filename in sorted(os.listdir(self.directory)):
+            if filename.startswith(INDEX_PREFIX):
+                continue
+
+            if filename.endswith(CACHE_FILE_EXTENSION):
+                keys.append(filename[: -len(CACHE_FILE_EXTENSION)])
+
+        return keys
+
+    def path(self, key):
+        """
+        Returns the file location of a cache entry
+        """
+
+        return os.path.join(self.directory, f"{key}{CACHE_FILE_EXTENSION}")
+
+    def size(self):
+        """
+        Returns the total size of the cache entries in bytes
+        """
+
+        with self._lock:
+            return sum(entry[SIZE_STRING] for entry in self._index.values())
+
+    def load(self, key):
+        """
+        Loads a cache entry
+        Raises FileNotFoundError if there is no entry for the key
+        """
+
+        with open(self.path(key), "r", encoding="utf8") as cache_file:
+            payload = json.load(cache_file)
+
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is not None:
+                entry[ACCESSED_STRING] = time.time()
+                self._index_dirty = True
+
+            self._flush_if_due()
+
+        return payload
+
+    def revid(self, key):
+        """
+        Returns the wiki revision ID a cache entry was fetched at
+        or None if it is unknown
+        """
+
+        return self.load(key).get(PARSE_STRING, {}).get(REVID_STRING)
+
+    def store(self, key, payload, updateable, fetched=None):
+        """
+        Stamps the payload with its fetch time and writes it into the cache
+        fetched defaults to now, pass the revision time for data that is older
+        """
+
+        self.log.info("CACHE: Updating %s.", key, extra=SAMPLED)
+
+        if fetched is None:
+            fetched = datetime.now(timezone.utc).strftime(DATE_FORMAT)
+
+        payload[FETCHED_STRING] = fetched
+        payload[UPDATEABLE_STRING] = updateable
+
+        # Only updateable entries are ever checked against the wiki again
+        fetched_time = None
+        if updateable:
+            fetched_time = (
+                datetime.strptime(fetched, DATE_FORMAT)
+                .replace(tzinfo=timezone.utc)
+                .timestamp()
+            )
+
+        data = json.dumps(payload, ensure_ascii=False, indent=4).encode("utf8")
+        self.store_raw(key, data, fetched_time=fetched_time)
+
+    def store_raw(self, key, data, fetched_time=None):
+        """
+        Writes an already serialized entry into the cache
+        fetched_time is when an updateable entry was fetched, as a timestamp
+        """
+
+        with self._lock:
+            write_lock = self._write_locks.setdefault(key, threading.Lock())
+
+        with write_lock:
+            self._write(data, self.path(key))
+
+            with self._lock:
+                self._index[key] = {
+                    SIZE_STRING: len(data),
+                    ACCESSED_STRING: time.time(),
+                }
+                if fetched_time is not None:
+                    self._index[key][FETCHED_STRING] = fetched_time
+                self._index_dirty = True
+
+                self._evict(protected=self.group(key))
+                self._flush_if_due()
+
+    def doll_keys(self):
+        """
+        Lists the keys of every doll entry, leaving out skills and shared pages
+        """
+
+        return [
+            key
+            for key in self.keys()
+            if key not in PINNED_CACHE_KEYS and self._parent(key) is None
+        ]
+
+    def group(self, key):
+        """
+        Returns the keys of a doll entry and its skill entries together
+        """
+
+        parent = self._parent(key)
+        if parent is None:
+            parent = key
+
+        group = [parent]
+        for i in range(SKILL_START_RANGE, SKILL_END_RANGE):
+            group.append(skill_cache_key(parent, i))
+
+        return group
+
+    def mark_stale(self, keys):
+        """
+        Marks entries as stale so their next lookup re-downloads them
+        Entries are kept, so they are still served if the wiki is unreachable
+
+        Returns the keys that were marked
+        """
+
+        marked = []
+        with self._lock:
+            for key in keys:
+                entry = self._index.get(key)
+                if entry is None:
+                    continue
+
+                entry[STALE_STRING] = True
+                marked.append(key)
+
+            if marked:
+                self._index_dirty = True
+                self.flush()
+
+        return marked
+
+    def is_stale(self, key):
+        """
+        Checks whether an entry was marked stale since it was last stored
+        """
+
+        with self._lock:
+            return self._index.get(key, {}).get(STALE_STRING, False)
+
+    def is_fresh(self, key):
+        """
+        Checks whether an entry is cached, not stale and not due for a
+        revision check, from the index alone
+        Entries whose fetch time the index does not know count as fresh
+        """
+
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None or entry.get(STALE_STRING, False):
+                return False
+
+            fetched_time = entry.get(FETCHED_STRING)
+
+            return (
+                fetched_time is None
+                or time.time() - fetched_time < REVISION_CHECK_SECONDS
+            )
+
+    def remove(self, key):
+        """
+        Removes an entry from the cache
+        """
+
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+        with self._lock:
+            if self._index.pop(key, None) is not None:
+                self._index_dirty = True
+
+    def flush(self):
+        """
+        Writes the access index to disk
+        """
+
+        with self._lock:
+            if not self._index_dirty:
+                return
+
+            index = {
+                VERSION_STRING: INDEX_VERSION,
+                ENTRIES_STRING: self._index,
+            }
+            data = json.dumps(index).encode("utf8")
+            self._write(data, os.path.join(self.directory, INDEX_FILE))
+
+            self._index_dirty = False
+            self._last_flush_time = time.monotonic()
+
+    def compact(self):
+        """
+        Verifies every entry, drops corrupt and orphaned ones, then evicts
+        down to the byte budget
+
+        Returns a dictionary of compaction statistics
+        """
+
+        stats = {
+            "entries": 0,
+            "corrupt": [],
+            "orphaned": [],
+            "evicted": [],
+        }
+
+        with self._lock:
+            # Leftovers of interrupted writes
+            now = time.time()
+            for filename in os.listdir(self.directory):
+                if not filename.endswith(TEMPORARY_FILE_EXTENSION):
+                    continue
+
+                path = os.path.join(self.directory, filename)
+                try:
+                    if now - os.path.getmtime(path) >= TEMPORARY_FILE_MAX_AGE:
+                        os.remove(path)
+                except FileNotFoundError:
+                    # Its write finished in the meantime
+                    pass
+
+            keys = self.keys()
+            for key in keys:
+                if not self._verify(key):
+                    self.log.warning(f"CACHE: Dropping corrupt entry {key}")
+                    self.remove(key)
+                    stats["corrupt"].append(key)
+
+            keys = set(self.keys())
+            for key in keys:
+                parent = self._parent(key)
+                if parent is not None and parent not in keys:
+                    self.log.warning(f"CACHE: Dropping orphaned entry {key}")
+                    self.remove(key)
+                    stats["orphaned"].append(key)
+
+            # Start over from what is actually on disk
+            self._index = self._reconcile_index(self._index)
+            self._index_dirty = True
+
+            stats["evicted"] = self._evict()
+            stats["entries"] = len(self._index)
+
+            self.flush()
+
+        return stats
+
+    def _verify(self, key):
+        """
+        Internal function to check that an entry is a readable API response
+        """
+
+        try:
+            with open(self.path(key), "r", encoding="utf8") as cache_file:
+                payload = json.load(cache_file)
+
+            wikitext = payload[PARSE_STRING][WIKITEXT_STRING][STAR_STRING]
+
+            return (
+                isinstance(wikitext, str)
+                and FETCHED_STRING in payload
+                and UPDATEABLE_STRING in payload
+            )
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+
+    def _parent(self, key):
+        """
+        Internal function to get the doll entry a skill entry belongs to
+        Returns None for entries that stand on their own
+        """
+
+        skill_match = SKILL_KEY_REGEX.match(key)
+        if skill_match is None:
+            return None
+
+        return skill_match.group("doll")
+
+    def _evict(self, protected=()):
+        """
+        Internal function to evict least recently used entries until the cache
+        fits in max_bytes
+        A doll is evicted together with its skills, shared pages are never evicted
+
+        Returns the evicted keys
+        """
+
+        total_size = sum(entry[SIZE_STRING] for entry in self._index.values())
+        if total_size <= self.max_bytes:
+            return []
+
+        protected = set(protected) | PINNED_CACHE_KEYS
+
+        # A doll is as recently used as the most recently used of its entries
+        last_accessed = {}
+        for key, entry in self._index.items():
+            if key in protected:
+                continue
+
+            group = self.group(key)[0]
+            last_accessed[group] = max(
+                last_accessed.get(group, 0), entry[ACCESSED_STRING]
+            )
+
+        evicted = []
+        for group in sorted(last_accessed, key=last_accessed.get):
+            if total_size <= self.max_bytes:
+                break
+
+            for group_key in self.group(group):
+                if group_key in self._index and group_key not in protected:
+                    total_size -= self._index[group_key][SIZE_STRING]
+                    self.remove(group_key)
+                    evicted.append(group_key)
+
+        if evicted:
+            self.log.info(f"CACHE: Evicted {len(evicted)} entries to fit budget")
+
+        return evicted
+
+    def _load_index(self):
+        """
+        Internal function to load the access index, reconciled with the disk
+        """
+
+        index = {}
+        try:
+            with open(
+                os.path.join(self.directory, INDEX_FILE), "r", encoding="utf8"
+            ) as f:
+                index_json = json.load(f)
+
+            if index_json.get(VERSION_STRING) == INDEX_VERSION:
+                index = index_json[ENTRIES_STRING]
+        except (OSError, ValueError, KeyError, AttributeError):
+            self.log.info("CACHE: No usable index, rebuilding it from disk")
+
+        return self._reconcile_index(index)
+
+    def _reconcile_index(self, index):
+        """
+        Internal function to match the index with the entries on disk
+        Entries written by other tools are picked up with their modification time
+        """
+
+        reconciled = {}
+        for key in self.keys():
+            try:
+                stat = os.stat(self.path(key))
+            except FileNotFoundError:
+                continue
+
+            entry = index.get(key, {})
+            reconciled[key] = {
+                SIZE_STRING: stat.st_size,
+                ACCESSED_STRING: entry.get(ACCESSED_STRING, stat.st_mtime),
+            }
+
+            if entry.get(STALE_STRING):
+                reconciled[key][STALE_STRING] = True
+
+            if entry.get(FETCHED_STRING) is not None:
+                reconciled[key][FETCHED_STRING] = entry[FETCHED_STRING]
+
+        return reconciled
+
+    def _flush_if_due(self):
+        """
+        Internal function to persist the index at most every INDEX_FLUSH_INTERVAL
+        """
+
+        if time.monotonic() - self._last_flush_time >= INDEX_FLUSH_INTERVAL:
+            self.flush()
+
+    def _write(self, data, filename):
+        """
+        Internal function to write serialized data into a file
+
+        Writes to a temporary file first so a crash never leaves half an entry
+        Each write gets its own temporary file, so writers of the same file
+        never write into or move away each other's
+        """
+
+        file_descriptor, temporary_filename = tempfile.mkstemp(
+            dir=self.directory,
+            prefix=f"{os.path.basename(filename)}.",
+            suffix=TEMPORARY_FILE_EXTENSION,
+        )
+        try:
+            with os.fdopen(file_descriptor, "wb") as f:
+                f.write(data)
+
+            os.replace(temporary_filename, filename)
+        except BaseException:
+            os.remove(temporary_filename)
+            raise
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintains Lenna's local cache")
+    parser.add_argument(
+        "command",
+        choices=["compact", "stats"],
+        help="compact verifies and shrinks the cache, stats prints its size",
+    )
+    args = parser.parse_args()
+
+    log = logging.getLogger(__name__)
+    logging.basicConfig(filename=LOGFILE, encoding="utf-8")
+    log.setLevel(logging.INFO)
+
+    cache = Cache(log)
+
+    if args.command == "compact":
+        stats = cache.compact()
+        print(
+            f"Kept {stats['entries']} entries, dropped {len(stats['corrupt'])} "
+            f"corrupt and {len(stats['orphaned'])} orphaned, "
+            f"evicted {len(stats['evicted'])}"
+        )
+
+    print(
+        f"{len(cache.keys())} entries, {cache.size()} of {cache.max_bytes} bytes used"
+    )
+
+
+if __name__ == "__main__":
+    main()
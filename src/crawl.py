@@ -0,0 +1,198 @@
+"""
+Lenna's offline crawler
+
+Headless entry point that fills data/cache/ with every GFL2 doll, their skill
+pages, the weapons page and the status effects page, so a new node starts with
+a complete cache instead of learning it one Discord command at a time
+
+Usage (from src/, like main.py):
+    python crawl.py
+    python crawl.py --dolls Makiatto Qiongjiu
+"""
+
+import argparse
+import logging
+import time
+
+from cache import (
+    Cache,
+    IOPWIKI_STATUS_EFFECTS_PAGE,
+    IOPWIKI_WEAPONS_PAGE,
+    SKILL_END_RANGE,
+    SKILL_START_RANGE,
+    STATUS_EFFECTS_CACHE_KEY,
+    WEAPONS_CACHE_KEY,
+    doll_cache_key,
+    doll_name_from_title,
+    doll_page_title,
+    skill_cache_key,
+    skill_page_title,
+)
+from wiki_client import (
+    WikiClient,
+    load_headers,
+)
+
+LOGFILE = "lenna_crawl.log"
+IOPWIKI_DOLLS_CATEGORY = "Category:GFL2 Dolls"
+
+
+class Crawler:
+    """
+    Crawler class definition
+    """
+
+    def __init__(self, log, wiki, cache):
+        self.log = log
+        self.wiki = wiki
+        self.cache = cache
+
+    def enumerate_dolls(self, category=IOPWIKI_DOLLS_CATEGORY):
+        """
+        Lists the names of every doll in the GFL2 doll category
+        """
+
+        doll_names = []
+        for page_title in self.wiki.category_members(category):
+            # Skip subpages such as "Makiatto/skilldata"
+            if "/" in page_title:
+                continue
+
+            doll_names.append(doll_name_from_title(page_title))
+
+        return doll_names
+
+    def plan(self, doll_names, with_weapons=True, with_status_effects=True):
+        """
+        Builds the list of (page title, cache key) pairs to crawl
+        """
+
+        pages = []
+        for doll_name in doll_names:
+            pages.append((doll_page_title(doll_name), doll_cache_key(doll_name)))
+
+            for i in range(SKILL_START_RANGE, SKILL_END_RANGE):
+                pages.append(
+                    (skill_page_title(doll_name, i), skill_cache_key(doll_name, i))
+                )
+
+        if with_weapons:
+            pages.append((IOPWIKI_WEAPONS_PAGE, WEAPONS_CACHE_KEY))
+
+        if with_status_effects:
+            pages.append((IOPWIKI_STATUS_EFFECTS_PAGE, STATUS_EFFECTS_CACHE_KEY))
+
+        return pages
+
+    def crawl(self, pages):
+        """
+        Fetches every planned page in batches and writes them into the cache
+
+        Returns a dictionary of crawl statistics
+        """
+
+        stats = {
+            "pages": len(pages),
+            "stored": 0,
+            "missing": [],
+            "batches": 0,
+        }
+
+        start_time = time.monotonic()
+        batch_size = self.wiki.BATCH_SIZE
+        for i in range(0, len(pages), batch_size):
+            batch = pages[i : i + batch_size]
+            batch_start_time = time.monotonic()
+
+            payloads = self.wiki.fetch_pages([page_title for page_title, _ in batch])
+
+            for page_title, cache_key in batch:
+                payload = payloads.get(page_title)
+                if payload is None:
+                    self.log.warning(f"CRAWLER: {page_title} does not exist, skipping")
+                    stats["missing"].append(page_title)
+                    continue
+
+                self.cache.store(cache_key, payload, True)
+                stats["stored"] += 1
+
+            stats["batches"] += 1
+            done = min(i + batch_size, len(pages))
+            elapsed = time.monotonic() - start_time
+            print(
+                f"[{done}/{len(pages)}] batch {stats['batches']} "
+                f"took {time.monotonic() - batch_start_time:.2f}s, "
+                f"total {elapsed:.2f}s"
+            )
+
+        stats["elapsed"] = time.monotonic() - start_time
+
+        return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Crawls IOPWIKI and populates Lenna's local cache"
+    )
+    parser.add_argument(
+        "--dolls",
+        nargs="+",
+        help="Crawl only these dolls instead of the whole doll category",
+    )
+    parser.add_argument(
+        "--category",
+        default=IOPWIKI_DOLLS_CATEGORY,
+        help="Wiki category that lists every GFL2 doll",
+    )
+    parser.add_argument(
+        "--delay",
+        type=float,
+        default=WikiClient.CRAWL_REQUEST_INTERVAL,
+        help="Minimum seconds between two requests to the wiki",
+    )
+    parser.add_argument(
+        "--skip-weapons", action="store_true", help="Do not crawl the weapons page"
+    )
+    parser.add_argument(
+        "--skip-status-effects",
+        action="store_true",
+        help="Do not crawl the status effects page",
+    )
+    args = parser.parse_args()
+
+    log = logging.getLogger(__name__)
+    logging.basicConfig(filename=LOGFILE, encoding="utf-8")
+    log.setLevel(logging.INFO)
+
+    wiki = WikiClient(log, load_headers(), min_request_interval=args.delay)
+    cache = Cache(log)
+    crawler = Crawler(log, wiki, cache)
+
+    try:
+        start_time = time.monotonic()
+        doll_names = args.dolls
+        if doll_names is None:
+            doll_names = crawler.enumerate_dolls(args.category)
+
+        print(f"Found {len(doll_names)} dolls in {time.monotonic() - start_time:.2f}s")
+
+        pages = crawler.plan(
+            doll_names,
+            with_weapons=not args.skip_weapons,
+            with_status_effects=not args.skip_status_effects,
+        )
+        stats = crawler.crawl(pages)
+
+        print(
+            f"Stored {stats['stored']}/{stats['pages']} pages "
+            f"in {stats['batches']} batches, {stats['elapsed']:.2f}s"
+        )
+        for page_title in stats["missing"]:
+            print(f"Missing: {page_title}")
+    finally:
+        wiki.close()
+        cache.flush()
+
+
+if __name__ == "__main__":
+    main()
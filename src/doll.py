@@ -25,6 +25,7 @@ import wikitextparser as wtp
 from parse_utils import (
     get_base_template,
     get_template_param_value,
+    intern_string,
     simplify,
     table_data_to_dict,
 )
@@ -43,6 +44,8 @@ class Node:
     Class representation of a doll's neural node
     """
 
+    __slots__ = ("name", "desc", "position")
+
     def __init__(self, name, desc, position):
         self.name = name
         self.desc = desc
@@ -57,6 +60,8 @@ class Skill:
     Internal representation of a doll's skill
     """
 
+    __slots__ = ("name", "desc", "extra_effects")
+
     def __init__(self, name, desc, extra_effects):
         self.name = name
         self.desc = desc
@@ -71,6 +76,30 @@ class Doll:
     Doll class definition
     """
 
+    __slots__ = (
+        "full_name",
+        "role",
+        "rarity",
+        "affiliation",
+        "weapon_name",
+        "weapon_weakness",
+        "phase_weakness",
+        "gfl_name",
+        "signature_weapon",
+        "nodes",
+        "skills",
+    )
+
+    # Fields whose values repeat across dolls, these share one interned copy
+    _INTERNED_FIELDS = (
+        "role",
+        "rarity",
+        "affiliation",
+        "weapon_name",
+        "weapon_weakness",
+        "phase_weakness",
+    )
+
     # Internal variables to parse wikitext
     _BASE_TEMPLATE_INDEX = 0
     _IGNORED_KEYS = [
@@ -109,6 +138,24 @@ class Doll:
         self.nodes = self._get_nodes(template)
         self.skills = self._get_skills(doll_skills)
 
+        self._intern_fields()
+
+    def __setstate__(self, state):
+        # Unpickled strings, e.g., from a parse worker, are no longer interned
+        _, slots = state
+        for field, value in slots.items():
+            setattr(self, field, value)
+
+        self._intern_fields()
+
+    def _intern_fields(self):
+        """
+        Internal function to intern the fields that repeat across dolls
+        """
+
+        for field in self._INTERNED_FIELDS:
+            setattr(self, field, intern_string(getattr(self, field)))
+
     def _get_node(self, template, node_position, is_key=False, key_position=0):
         """
         Internal function to get node from wikitext template
@@ -0,0 +1,209 @@
+"""
+MediaWiki dump importer
+
+Seeds Lenna's cache from a Special:Export XML dump of the GFL2 pages instead of
+thousands of API calls. The dump is streamed, so memory stays constant no
+matter how large it is
+
+Usage (from src/, like main.py):
+    python dump_import.py IOPWIKI-GFL2.xml
+    python dump_import.py IOPWIKI-GFL2.xml.bz2
+"""
+
+import argparse
+import bz2
+import gzip
+import logging
+import time
+import xml.etree.ElementTree as ET
+
+from cache import (
+    Cache,
+    FETCHED_STRING,
+    cache_key_for_title,
+)
+
+LOGFILE = "lenna_dump_import.log"
+
+# Only articles are looked up by Lenna
+MAIN_NAMESPACE = "0"
+
+
+def _local_name(tag):
+    """
+    Internal function to strip the export schema namespace off a tag
+    E.g., "{http://www.mediawiki.org/xml/export-0.11/}page" -> "page"
+    """
+
+    return tag.rsplit("}", 1)[-1]
+
+
+def _open_dump(dump_path):
+    """
+    Internal function to open a plain, bzip2 or gzip compressed dump
+    """
+
+    if dump_path.endswith(".bz2"):
+        return bz2.open(dump_path, "rb")
+    elif dump_path.endswith(".gz"):
+        return gzip.open(dump_path, "rb")
+
+    return open(dump_path, "rb")
+
+
+def iter_dump_pages(dump_file):
+    """
+    Streams the pages of a MediaWiki XML export
+    Yields one dictionary per page holding its title, namespace, page ID,
+    redirect target and latest revision
+    """
+
+    context = ET.iterparse(dump_file, events=("start", "end"))
+    _, root = next(context)
+
+    page = None
+    revision = None
+    for event, element in context:
+        tag = _local_name(element.tag)
+
+        if event == "start":
+            if tag == "page":
+                page = {"redirect": None, "revision": None}
+            elif tag == "revision" and page is not None:
+                revision = {}
+
+            continue
+
+        if page is None:
+            continue
+
+        if revision is not None:
+            match tag:
+                case "id":
+                    # The first <id> in a revision is its own, later ones belong
+                    # to <contributor>
+                    revision.setdefault("revid", int(element.text))
+                case "timestamp":
+                    revision["timestamp"] = element.text
+                case "text":
+                    revision["text"] = element.text or ""
+                case "revision":
+                    # Dumps with full history list revisions oldest first
+                    page["revision"] = revision
+                    revision = None
+        else:
+            match tag:
+                case "title":
+                    page["title"] = element.text
+                case "ns":
+                    page["ns"] = element.text
+                case "id":
+                    page["pageid"] = int(element.text)
+                case "redirect":
+                    page["redirect"] = element.get("title")
+                case "page":
+                    yield page
+                    page = None
+
+                    # Drop everything parsed so far to keep memory constant
+                    root.clear()
+
+
+def import_dump(cache, dump_path):
+    """
+    Writes every GFL2 page of the dump into the cache
+
+    Returns a dictionary of import statistics
+    """
+
+    stats = {
+        "pages": 0,
+        "stored": 0,
+        "redirects": 0,
+        "skipped": 0,
+    }
+
+    # Only titles are remembered, content is written as soon as it is read
+    redirects = {}
+    stored_titles = {}
+
+    with _open_dump(dump_path) as dump_file:
+        for page in iter_dump_pages(dump_file):
+            stats["pages"] += 1
+
+            cache_key = cache_key_for_title(page["title"])
+            if page.get("ns") != MAIN_NAMESPACE or cache_key is None:
+                stats["skipped"] += 1
+                continue
+
+            if page["redirect"] is not None:
+                redirects[page["title"]] = page["redirect"]
+                continue
+
+            revision = page["revision"]
+            if revision is None:
+                stats["skipped"] += 1
+                continue
+
+            payload = {
+                "parse": {
+                    "title": page["title"],
+                    "pageid": page["pageid"],
+                    "revid": revision["revid"],
+                    "wikitext": {
+                        "*": revision["text"],
+                    },
+                }
+            }
+
+            # Stamp the entry with its revision time, not now, so pages edited
+            # after the dump was taken are still revalidated against the wiki
+            cache.store(cache_key, payload, True, fetched=revision["timestamp"])
+            stored_titles[page["title"]] = cache_key
+            stats["stored"] += 1
+
+    # Responder follows redirects, so a redirect title gets its target's page
+    for title, target in redirects.items():
+        target_key = stored_titles.get(target)
+        if target_key is None:
+            cache.log.warning(f"DUMP: Redirect {title} -> {target} has no target")
+            stats["skipped"] += 1
+            continue
+
+        payload = cache.load(target_key)
+        cache.store(
+            cache_key_for_title(title),
+            payload,
+            True,
+            fetched=payload[FETCHED_STRING],
+        )
+        stats["redirects"] += 1
+
+    cache.flush()
+
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Seeds Lenna's cache from a MediaWiki XML export"
+    )
+    parser.add_argument("dump", help="Special:Export XML dump, optionally .bz2/.gz")
+    args = parser.parse_args()
+
+    log = logging.getLogger(__name__)
+    logging.basicConfig(filename=LOGFILE, encoding="utf-8")
+    log.setLevel(logging.INFO)
+
+    start_time = time.monotonic()
+    stats = import_dump(Cache(log), args.dump)
+
+    print(
+        f"Read {stats['pages']} pages: stored {stats['stored']}, "
+        f"{stats['redirects']} redirects, skipped {stats['skipped']} "
+        f"in {time.monotonic() - start_time:.2f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+EmbedCache class
+
+Rendered weapon and status effect embeds, so a repeated lookup, or one the
+prefetcher warmed, skips simplifying fields and building the embed. Each
+embed remembers the parsed page it was rendered from and is only served
+while that page is still the one loaded
+"""
+
+from collections import OrderedDict
+import os
+import threading
+import weakref
+
+# Embeds kept, the least recently used are dropped first
+EMBED_CACHE_SIZE_ENV = "LENNA_EMBED_CACHE_SIZE"
+DEFAULT_EMBED_CACHE_SIZE = 512
+
+
+class EmbedCache:
+    """
+    EmbedCache class definition
+    """
+
+    def __init__(self, max_entries=None):
+        self.max_entries = (
+            max_entries
+            if max_entries is not None
+            else int(os.getenv(EMBED_CACHE_SIZE_ENV, DEFAULT_EMBED_CACHE_SIZE))
+        )
+
+        # Key to (weak reference to the source, updateable, embed)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, source, updateable):
+        """
+        Returns the embed rendered for key from source, or None when there is
+        none or it was rendered from another page or with another footer
+        """
+
+        # The reference of a dropped page is None, it must not match no page
+        if source is None:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            entry_source, entry_updateable, embed = entry
+            if entry_source() is not source or entry_updateable != updateable:
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+
+            return embed
+
+    def put(self, key, source, updateable, embed):
+        """
+        Remembers the embed rendered for key from source
+        Embeds are shared between lookups, they must not be changed after
+        """
+
+        if self.max_entries <= 0:
+            return
+
+        with self._lock:
+            # Pages are only weakly held, a replaced page is not kept alive
+            self._entries[key] = (weakref.ref(source), updateable, embed)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -0,0 +1,258 @@
+"""
+FixtureStore class
+
+Recorded IOPWIKI API responses, one action=parse response per page stored
+under the page's cache key. Answers the subset of api.php Lenna uses from
+them, so Lenna can be benchmarked and load-tested without touching the wiki
+"""
+
+from datetime import datetime, timezone
+import json
+import os
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+from cache import (
+    CACHE_FILE_EXTENSION,
+    DATE_FORMAT,
+    PARSE_STRING,
+    REVID_STRING,
+    SKILL_KEY_REGEX,
+    STATUS_EFFECTS_CACHE_KEY,
+    STAR_STRING,
+    WEAPONS_CACHE_KEY,
+    WIKITEXT_STRING,
+    cache_key_for_title,
+    doll_name_from_title,
+)
+
+FIXTURES_DIRECTORY = "../bench/fixtures/"
+
+TITLE_STRING = "title"
+PAGEID_STRING = "pageid"
+TITLE_SEPARATOR = "|"
+
+
+class FixtureStore:
+    """
+    FixtureStore class definition
+    """
+
+    def __init__(self, directory=FIXTURES_DIRECTORY):
+        self.directory = directory
+        self.pages = {}
+        self.touched = {}
+
+        os.makedirs(self.directory, exist_ok=True)
+        for filename in sorted(os.listdir(self.directory)):
+            if not filename.endswith(CACHE_FILE_EXTENSION):
+                continue
+
+            key = filename[: -len(CACHE_FILE_EXTENSION)]
+            path = os.path.join(self.directory, filename)
+            with open(path, "r", encoding="utf8") as fixture_file:
+                self.pages[key] = json.load(fixture_file)
+
+            # Fixtures do not carry a touched time, the recording time stands in
+            self.touched[key] = datetime.fromtimestamp(
+                os.path.getmtime(path), timezone.utc
+            ).strftime(DATE_FORMAT)
+
+    def keys(self):
+        return list(self.pages)
+
+    def get(self, page_title):
+        """
+        Returns the recorded action=parse response of a page, or None
+        """
+
+        cache_key = cache_key_for_title(page_title)
+        if cache_key is None:
+            return None
+
+        return self.pages.get(cache_key)
+
+    def wikitext(self, cache_key):
+        """
+        Returns the recorded wikitext stored under cache_key
+        """
+
+        return self.pages[cache_key][PARSE_STRING][WIKITEXT_STRING][STAR_STRING]
+
+    def record(self, cache_key, payload):
+        """
+        Writes an action=parse response as the fixture of cache_key
+        """
+
+        path = os.path.join(self.directory, f"{cache_key}{CACHE_FILE_EXTENSION}")
+        with open(path, "w", encoding="utf8") as fixture_file:
+            json.dump(payload, fixture_file, indent=4)
+
+        self.pages[cache_key] = payload
+        self.touched[cache_key] = datetime.now(timezone.utc).strftime(DATE_FORMAT)
+
+    def doll_names(self):
+        """
+        Lists the dolls that have a recorded page
+        """
+
+        doll_names = []
+        for key, payload in self.pages.items():
+            if key in (WEAPONS_CACHE_KEY, STATUS_EFFECTS_CACHE_KEY):
+                continue
+            elif SKILL_KEY_REGEX.match(key) is not None:
+                continue
+
+            doll_names.append(doll_name_from_title(payload[PARSE_STRING][TITLE_STRING]))
+
+        return doll_names
+
+    def respond(self, params):
+        """
+        Answers an api.php query from the fixtures
+        params maps parameter names to values, as sent by WikiClient
+
+        Returns a (status code, response JSON) pair
+        """
+
+        action = params.get("action")
+        if action == "parse":
+            return 200, self._parse_response(params.get("page", ""))
+        elif action == "query" and params.get("prop") == "info":
+            return 200, self._info_response(self._titles(params))
+        elif action == "query" and params.get("prop") == "revisions":
+            return 200, self._revisions_response(self._titles(params))
+
+        return 200, self._error_response(
+            "badvalue", f"Unsupported query {params} for the fixtures"
+        )
+
+    def _titles(self, params):
+        """
+        Internal function to split the titles parameter
+        """
+
+        return params.get("titles", "").split(TITLE_SEPARATOR)
+
+    def _error_response(self, code, info):
+        """
+        Internal function to build an api.php error body
+        """
+
+        return {
+            "error": {
+                "code": code,
+                "info": info,
+            }
+        }
+
+    def _parse_response(self, page_title):
+        """
+        Internal function to answer action=parse
+        """
+
+        payload = self.get(page_title)
+        if payload is None:
+            return self._error_response(
+                "missingtitle", "The page you specified doesn't exist."
+            )
+
+        return payload
+
+    def _info_response(self, page_titles):
+        """
+        Internal function to answer action=query&prop=info
+        """
+
+        pages = {}
+        for i, page_title in enumerate(page_titles):
+            payload = self.get(page_title)
+            if payload is None:
+                pages[str(-1 - i)] = {
+                    "ns": 0,
+                    TITLE_STRING: page_title,
+                    "missing": "",
+                }
+                continue
+
+            parse = payload[PARSE_STRING]
+            pages[str(parse[PAGEID_STRING])] = {
+                PAGEID_STRING: parse[PAGEID_STRING],
+                "ns": 0,
+                TITLE_STRING: parse[TITLE_STRING],
+                "touched": self.touched[cache_key_for_title(page_title)],
+                "lastrevid": parse[REVID_STRING],
+            }
+
+        return {"batchcomplete": "", "query": {"pages": pages}}
+
+    def _revisions_response(self, page_titles):
+        """
+        Internal function to answer a batched action=query&prop=revisions
+        with formatversion=2
+        """
+
+        normalized = []
+        pages = []
+        for page_title in page_titles:
+            payload = self.get(page_title)
+            if payload is None:
+                pages.append({"ns": 0, TITLE_STRING: page_title, "missing": True})
+                continue
+
+            parse = payload[PARSE_STRING]
+            if parse[TITLE_STRING] != page_title:
+                normalized.append({"from": page_title, "to": parse[TITLE_STRING]})
+
+            pages.append(
+                {
+                    PAGEID_STRING: parse[PAGEID_STRING],
+                    "ns": 0,
+                    TITLE_STRING: parse[TITLE_STRING],
+                    "revisions": [
+                        {
+                            REVID_STRING: parse[REVID_STRING],
+                            "slots": {
+                                "main": {
+                                    "contentmodel": "wikitext",
+                                    "content": parse[WIKITEXT_STRING][STAR_STRING],
+                                }
+                            },
+                        }
+                    ],
+                }
+            )
+
+        query = {"pages": pages}
+        if normalized:
+            query["normalized"] = normalized
+
+        return {"batchcomplete": True, "query": query}
+
+
+class ReplaySession(requests.Session):
+    """
+    requests session that answers from a FixtureStore instead of the network
+    """
+
+    def __init__(self, store):
+        super().__init__()
+        self.store = store
+
+    def send(self, request, **kwargs):
+        params = {
+            name: values[0]
+            for name, values in parse_qs(urlsplit(request.url).query).items()
+        }
+        status_code, body = self.store.respond(params)
+
+        response = requests.Response()
+        response.status_code = status_code
+        response.reason = "OK" if status_code == 200 else "Error"
+        response.url = request.url
+        response.request = request
+        response.headers["Content-Type"] = "application/json"
+        response._content = json.dumps(body).encode("utf8")
+
+        return response
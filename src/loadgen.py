@@ -0,0 +1,550 @@
+"""
+Lenna's load generator
+
+Drives Watcher's registered commands with fake Discord contexts at a given
+rate and command mix, e.g., mostly !doll over a Zipf-distributed roster with
+some !weapon, !define and the occasional force command. The wiki is replayed
+from the benchmark fixtures, or served by wiki_server.py through --api-url.
+Reports throughput, tail latency per command and event loop lag
+
+Usage (from src/, like main.py):
+    python loadgen.py --rate 20 --duration 30
+    python loadgen.py --rate 50 --mix doll=70,keys=10,weapon=10,define=8,fdoll=2
+    python loadgen.py --api-url http://127.0.0.1:8089/api.php --warm
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import statistics
+import tempfile
+import time
+
+from cache import (
+    Cache,
+    STATUS_EFFECTS_CACHE_KEY,
+    WEAPONS_CACHE_KEY,
+)
+from fixtures import (
+    FIXTURES_DIRECTORY,
+    FixtureStore,
+    ReplaySession,
+)
+from loop_monitor import LoopMonitor
+from metrics import (
+    LOOKUP_REJECTIONS,
+    LOOKUPS_COLLAPSED,
+    LOOKUPS_THROTTLED,
+    LOOP_LAG_SECONDS,
+    LOOP_STALLS,
+)
+from status_effects import StatusEffects
+from throttle import Throttle
+from watcher import Watcher
+from weapons import Weapons
+from wiki_client import WikiClient
+
+LOGFILE = "lenna_loadgen.log"
+
+DEFAULT_MIX = "doll=80,weapon=10,define=8,fdoll=2"
+DEFAULT_RATE = 10.0
+DEFAULT_DURATION = 30.0
+DEFAULT_ZIPF_EXPONENT = 1.1
+
+# Traffic comes from this many users and channels of one guild, a tenth of
+# the users are admins who send the force commands
+DEFAULT_USERS = 200
+DEFAULT_CHANNELS = 10
+ADMIN_SHARE = 0.1
+FAKE_GUILD_ID = 1
+
+# Commands the generator knows how to build arguments for
+DOLL_COMMANDS = ("doll", "mdoll", "fdoll", "keys", "fkeys")
+WEAPON_COMMANDS = ("weapon", "mweapon", "fweapon")
+STATUS_EFFECT_COMMANDS = ("define",)
+FORCE_COMMANDS = ("fdoll", "fkeys", "fweapon")
+
+FAILURE_TITLE_SUFFIX = "Failure"
+
+
+class FakeRole:
+    """
+    Stand-in for a discord.Role
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeAuthor:
+    """
+    Stand-in for the discord.Member who sent a command
+    """
+
+    def __init__(self, name, roles, id=0):
+        self.name = name
+        self.roles = roles
+        self.id = id
+
+    def __str__(self):
+        return self.name
+
+
+class FakeMessage:
+    """
+    Stand-in for a discord.Message Lenna sent
+    """
+
+    def __init__(self, channel_id, id):
+        self.id = id
+        self.jump_url = (
+            f"https://discord.com/channels/{FAKE_GUILD_ID}/{channel_id}/{id}"
+        )
+
+
+class FakeGuild:
+    """
+    Stand-in for a discord.Guild
+    """
+
+    def __init__(self, id):
+        self.id = id
+
+
+class FakeChannel:
+    """
+    Stand-in for a discord.TextChannel, remembers everything sent to it
+    """
+
+    def __init__(self, id=0):
+        self.id = id
+        self.messages = []
+
+    async def send(self, content=None, embed=None, embeds=None, **kwargs):
+        self.messages.append((content, embed or embeds))
+
+        return FakeMessage(self.id, len(self.messages))
+
+
+class FakeContext:
+    """
+    Stand-in for a discord.ext.commands.Context
+    """
+
+    def __init__(self, author, channel, guild=None):
+        self.author = author
+        self.channel = channel
+        self.guild = guild
+
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+
+def parse_mix(mix):
+    """
+    Parses a command mix such as "doll=80,weapon=20" into a dictionary of
+    command to weight
+    """
+
+    weights = {}
+    for entry in mix.split(","):
+        command, _, weight = entry.partition("=")
+        command = command.strip()
+        if command not in DOLL_COMMANDS + WEAPON_COMMANDS + STATUS_EFFECT_COMMANDS:
+            raise ValueError(f"Unsupported command {command} in mix {mix}")
+
+        weights[command] = float(weight or 1)
+
+    return weights
+
+
+class LoadGenerator:
+    """
+    LoadGenerator class definition
+
+    Arrivals are open-loop: commands are started on a Poisson schedule no
+    matter how far behind Lenna is, and latency is measured from when a
+    command was due, so a stalled loop shows up in the tail instead of
+    silently slowing the generator down
+    """
+
+    def __init__(
+        self,
+        log,
+        watcher,
+        doll_names,
+        weapon_names,
+        status_effect_names,
+        mix,
+        zipf_exponent=DEFAULT_ZIPF_EXPONENT,
+        users=DEFAULT_USERS,
+        channels=DEFAULT_CHANNELS,
+        seed=None,
+    ):
+        self.log = log
+        self.watcher = watcher
+        self.doll_names = doll_names
+        self.weapon_names = weapon_names
+        self.status_effect_names = status_effect_names
+        self.mix = mix
+
+        self._random = random.Random(seed)
+
+        # A few dolls get most lookups, like on a real server
+        self._doll_weights = [
+            1 / rank**zipf_exponent for rank in range(1, len(doll_names) + 1)
+        ]
+
+        admin_roles = [FakeRole(role) for role in watcher.admin_roles[:1]]
+        admins = max(int(users * ADMIN_SHARE), 1)
+        self._users = [
+            FakeAuthor(f"loadgen-{i}", [], id=i) for i in range(admins, users)
+        ]
+        self._admins = [
+            FakeAuthor(f"loadgen-admin-{i}", admin_roles, id=i) for i in range(admins)
+        ]
+        self._channel_ids = list(range(1, channels + 1))
+        self._guild = FakeGuild(FAKE_GUILD_ID)
+
+        self.latencies = {command: [] for command in mix}
+        self.failures = {command: 0 for command in mix}
+        self.errors = {command: 0 for command in mix}
+
+    def pick(self):
+        """
+        Picks the next command and its arguments
+        """
+
+        commands = list(self.mix)
+        command = self._random.choices(commands, weights=list(self.mix.values()))[0]
+
+        if command in DOLL_COMMANDS:
+            doll_name = self._random.choices(
+                self.doll_names, weights=self._doll_weights
+            )[0]
+            args = [doll_name]
+        elif command in WEAPON_COMMANDS:
+            args = self._random.choice(self.weapon_names).split()
+        else:
+            args = self._random.choice(self.status_effect_names).split()
+
+        return command, args
+
+    async def invoke(self, command, args):
+        """
+        Runs a command through the callback Watcher registered with the bot
+        Returns whether Lenna answered with a failure embed
+        """
+
+        authors = self._admins if command in FORCE_COMMANDS else self._users
+        author = self._random.choice(authors or self._admins)
+        channel = FakeChannel(self._random.choice(self._channel_ids))
+        ctx = FakeContext(author, channel, self._guild)
+
+        await self.watcher.bot.get_command(command).callback(ctx, *args)
+
+        failed = False
+        for _, embed in channel.messages:
+            title = getattr(embed, "title", None) or ""
+            failed = failed or title.endswith(FAILURE_TITLE_SUFFIX)
+
+        return failed
+
+    async def warm(self):
+        """
+        Looks up every doll, weapon and status effect once so the run starts
+        with a filled cache
+        """
+
+        for doll_name in self.doll_names:
+            await self.invoke("doll", [doll_name])
+        for weapon_name in self.weapon_names[:1]:
+            await self.invoke("weapon", weapon_name.split())
+        for status_effect_name in self.status_effect_names[:1]:
+            await self.invoke("define", status_effect_name.split())
+
+    async def run(self, rate, duration):
+        """
+        Fires commands at rate per second for duration seconds
+        Returns the elapsed time, including draining the last commands
+        """
+
+        tasks = []
+        start_time = time.perf_counter()
+        due_time = start_time
+        while True:
+            due_time += self._random.expovariate(rate)
+            if due_time - start_time >= duration:
+                break
+
+            delay = due_time - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            command, args = self.pick()
+            tasks.append(asyncio.create_task(self._fire(command, args, due_time)))
+
+        await asyncio.gather(*tasks)
+
+        return time.perf_counter() - start_time
+
+    async def _fire(self, command, args, due_time):
+        """
+        Internal function to run one command and record its latency
+        """
+
+        try:
+            if await self.invoke(command, args):
+                self.failures[command] += 1
+        except Exception as e:
+            self.log.error(f"LOADGEN: {command} {args} raised {e}")
+            self.errors[command] += 1
+
+        self.latencies[command].append(time.perf_counter() - due_time)
+
+
+def _quantiles(samples):
+    """
+    Internal function to summarize latencies in milliseconds
+    """
+
+    if not samples:
+        return {}
+
+    ordered = sorted(sample * 1000 for sample in samples)
+
+    def quantile(q):
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    return {
+        "p50_ms": quantile(0.5),
+        "p95_ms": quantile(0.95),
+        "p99_ms": quantile(0.99),
+        "max_ms": ordered[-1],
+        "mean_ms": statistics.fmean(ordered),
+    }
+
+
+def build_report(generator, metrics, elapsed):
+    """
+    Builds the load test report from a finished run
+    """
+
+    completed = sum(len(samples) for samples in generator.latencies.values())
+    every_latency = [
+        sample for samples in generator.latencies.values() for sample in samples
+    ]
+
+    commands = {}
+    for command, samples in generator.latencies.items():
+        commands[command] = {
+            "count": len(samples),
+            "failures": generator.failures[command],
+            "errors": generator.errors[command],
+            **_quantiles(samples),
+        }
+
+    loop_lag = {}
+    histogram = metrics.histograms(LOOP_LAG_SECONDS).get(())
+    if histogram is not None:
+        _, _, p50, p95, p99 = histogram
+        loop_lag = {
+            "p50_ms": p50 * 1000,
+            "p95_ms": p95 * 1000,
+            "p99_ms": p99 * 1000,
+            "stalls": sum(metrics.counters(LOOP_STALLS).values()),
+        }
+
+    return {
+        "elapsed_s": elapsed,
+        "completed": completed,
+        "throughput_per_s": completed / elapsed if elapsed else 0.0,
+        "latency": _quantiles(every_latency),
+        "commands": commands,
+        "rejected": sum(metrics.counters(LOOKUP_REJECTIONS).values()),
+        "throttled": sum(metrics.counters(LOOKUPS_THROTTLED).values()),
+        "collapsed": sum(metrics.counters(LOOKUPS_COLLAPSED).values()),
+        "loop_lag": loop_lag,
+    }
+
+
+def print_report(report):
+    """
+    Prints a load test report for humans
+    """
+
+    print(
+        f"Completed {report['completed']} commands in {report['elapsed_s']:.1f}s, "
+        f"{report['throughput_per_s']:.1f}/s"
+    )
+
+    latency = report["latency"]
+    if latency:
+        print(
+            f"Latency p50 {latency['p50_ms']:.1f}ms, p95 {latency['p95_ms']:.1f}ms, "
+            f"p99 {latency['p99_ms']:.1f}ms, max {latency['max_ms']:.1f}ms"
+        )
+
+    if report["rejected"]:
+        print(f"Turned away {report['rejected']} lookups as busy")
+    if report["throttled"] or report["collapsed"]:
+        print(
+            f"Cooldowns throttled {report['throttled']} times, "
+            f"{report['collapsed']} repeated lookups collapsed"
+        )
+
+    for command, stats in sorted(report["commands"].items()):
+        if not stats["count"]:
+            continue
+
+        print(
+            f"  !{command} x{stats['count']}: p50 {stats['p50_ms']:.1f}ms, "
+            f"p99 {stats['p99_ms']:.1f}ms, {stats['failures']} failures, "
+            f"{stats['errors']} errors"
+        )
+
+    loop_lag = report["loop_lag"]
+    if loop_lag:
+        print(
+            f"Event loop lag p50 {loop_lag['p50_ms']:.1f}ms, "
+            f"p95 {loop_lag['p95_ms']:.1f}ms, p99 {loop_lag['p99_ms']:.1f}ms, "
+            f"{loop_lag['stalls']} stalls"
+        )
+
+
+async def run_load(log, watcher, generator, rate, duration, warm=False):
+    """
+    Runs a load test while monitoring the event loop
+    Returns the report
+    """
+
+    if warm:
+        await generator.warm()
+
+    loop_monitor = LoopMonitor(log, watcher.metrics)
+    loop_monitor.start()
+    try:
+        elapsed = await generator.run(rate, duration)
+    finally:
+        loop_monitor.stop()
+
+    return build_report(generator, watcher.metrics, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Drives Lenna's commands with synthetic Discord traffic"
+    )
+    parser.add_argument(
+        "--rate", type=float, default=DEFAULT_RATE, help="Commands per second"
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=DEFAULT_DURATION,
+        help="Seconds to generate load for",
+    )
+    parser.add_argument(
+        "--mix",
+        default=DEFAULT_MIX,
+        help="Weighted command mix, e.g., doll=80,weapon=10,define=8,fdoll=2",
+    )
+    parser.add_argument(
+        "--zipf",
+        type=float,
+        default=DEFAULT_ZIPF_EXPONENT,
+        help="Zipf exponent of doll popularity",
+    )
+    parser.add_argument(
+        "--users",
+        type=int,
+        default=DEFAULT_USERS,
+        help="Users sending commands, each with their own cooldowns",
+    )
+    parser.add_argument(
+        "--channels",
+        type=int,
+        default=DEFAULT_CHANNELS,
+        help="Channels the commands are sent in",
+    )
+    parser.add_argument(
+        "--fixtures",
+        default=FIXTURES_DIRECTORY,
+        help="Directory of recorded API responses",
+    )
+    parser.add_argument(
+        "--api-url",
+        help="Query this API, e.g., wiki_server.py, instead of replaying fixtures",
+    )
+    parser.add_argument(
+        "--wiki-interval",
+        type=float,
+        default=0.0,
+        help="Minimum seconds between two requests to the wiki",
+    )
+    parser.add_argument(
+        "--warm", action="store_true", help="Fill the cache before measuring"
+    )
+    parser.add_argument(
+        "--no-cooldowns",
+        action="store_true",
+        help="Turn the cooldowns off to measure Lenna's raw capacity",
+    )
+    parser.add_argument("--seed", type=int, help="Seed for a reproducible run")
+    parser.add_argument("--output", help="Also write the report as JSON")
+    args = parser.parse_args()
+
+    log = logging.getLogger(__name__)
+    logging.basicConfig(filename=LOGFILE, encoding="utf-8")
+    log.setLevel(logging.INFO)
+
+    store = FixtureStore(args.fixtures)
+    wiki = WikiClient(
+        log, {}, api_url=args.api_url, min_request_interval=args.wiki_interval
+    )
+    if args.api_url is None:
+        wiki.session = ReplaySession(store)
+
+    with tempfile.TemporaryDirectory(prefix="lenna_loadgen_") as cache_directory:
+        watcher = Watcher(
+            log, None, "!", cache=Cache(log, directory=cache_directory), wiki=wiki
+        )
+        if args.no_cooldowns:
+            watcher.throttle = Throttle(
+                log, metrics=watcher.metrics, cooldowns={}, force_cooldowns={}
+            )
+
+        weapons = Weapons(store.wikitext(WEAPONS_CACHE_KEY))
+        status_effects = StatusEffects(store.wikitext(STATUS_EFFECTS_CACHE_KEY))
+        generator = LoadGenerator(
+            log,
+            watcher,
+            store.doll_names(),
+            [weapon.name for weapon in weapons.weapons.values()],
+            list(status_effects.status_effects),
+            parse_mix(args.mix),
+            zipf_exponent=args.zipf,
+            users=args.users,
+            channels=args.channels,
+            seed=args.seed,
+        )
+
+        try:
+            report = asyncio.run(
+                run_load(
+                    log, watcher, generator, args.rate, args.duration, warm=args.warm
+                )
+            )
+        finally:
+            watcher.close()
+
+    print_report(report)
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf8") as report_file:
+            json.dump(report, report_file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
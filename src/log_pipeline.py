@@ -0,0 +1,126 @@
+"""
+Logging pipeline
+
+Lenna's log records are put on an in-memory queue by whoever logs them and
+formatted and written to a rotating lenna.log by a listener thread, so a log
+call never does file I/O, or even string formatting, on the event loop.
+High-volume messages can be sampled so only a share of them is kept
+"""
+
+from itertools import count
+import logging
+from logging.handlers import (
+    QueueHandler,
+    QueueListener,
+    RotatingFileHandler,
+    TimedRotatingFileHandler,
+)
+import os
+import queue
+import threading
+
+LOG_FORMAT = "%(asctime)s %(levelname)s:%(name)s:%(message)s"
+
+# Rotation, size based unless a time based interval is given, e.g., "midnight"
+LOG_MAX_BYTES_ENV = "LENNA_LOG_MAX_BYTES"
+DEFAULT_LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT_ENV = "LENNA_LOG_BACKUPS"
+DEFAULT_LOG_BACKUP_COUNT = 5
+LOG_ROTATE_WHEN_ENV = "LENNA_LOG_ROTATE_WHEN"
+
+# Share of sampled records that are kept
+LOG_SAMPLE_RATE_ENV = "LENNA_LOG_SAMPLE_RATE"
+DEFAULT_LOG_SAMPLE_RATE = 0.1
+
+# Pass as extra= to mark a high-volume record for sampling, e.g.,
+# log.info("CACHE: Hit for %s", key, extra=SAMPLED)
+SAMPLED_STRING = "sampled"
+SAMPLED = {SAMPLED_STRING: True}
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler that leaves formatting to the listener thread
+
+    The stock QueueHandler formats every record before queueing it so it can
+    be pickled, which Lenna's in-process queue does not need
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps one in every 1/rate records marked as sampled, per call site
+    Records that are not marked always pass
+    """
+
+    def __init__(self, rate):
+        super().__init__()
+        self.interval = max(round(1 / rate), 1) if rate > 0 else None
+
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def filter(self, record):
+        if not getattr(record, SAMPLED_STRING, False):
+            return True
+        elif self.interval is None:
+            return False
+
+        call_site = (record.pathname, record.lineno)
+        with self._lock:
+            counter = self._counters.get(call_site)
+            if counter is None:
+                counter = count()
+                self._counters[call_site] = counter
+
+            return next(counter) % self.interval == 0
+
+
+def _file_handler(logfile):
+    """
+    Internal function to create the rotating handler that writes logfile
+    """
+
+    backup_count = int(os.getenv(LOG_BACKUP_COUNT_ENV, DEFAULT_LOG_BACKUP_COUNT))
+
+    rotate_when = os.getenv(LOG_ROTATE_WHEN_ENV)
+    if rotate_when:
+        return TimedRotatingFileHandler(
+            logfile, when=rotate_when, backupCount=backup_count, encoding="utf-8"
+        )
+
+    return RotatingFileHandler(
+        logfile,
+        maxBytes=int(os.getenv(LOG_MAX_BYTES_ENV, DEFAULT_LOG_MAX_BYTES)),
+        backupCount=backup_count,
+        encoding="utf-8",
+    )
+
+
+def setup_logging(logfile, sample_rate=None):
+    """
+    Routes every log record through a queue to a rotating logfile
+
+    Returns the started QueueListener, stop() it on shutdown to flush the queue
+    """
+
+    if sample_rate is None:
+        sample_rate = float(os.getenv(LOG_SAMPLE_RATE_ENV, DEFAULT_LOG_SAMPLE_RATE))
+
+    file_handler = _file_handler(logfile)
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(sample_rate))
+
+    root = logging.getLogger()
+    root.addHandler(queue_handler)
+
+    listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+
+    return listener
@@ -0,0 +1,118 @@
+"""
+LoopMonitor class
+
+Watchdog for the event loop Lenna runs on
+A task on the loop measures how late it gets scheduled and exports it as a
+metric, while a thread outside the loop notices when the loop stops ticking
+and logs the stack of whatever is blocking it
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+
+from metrics import LOOP_LAG_SECONDS, LOOP_STALLS
+
+LOOP_LAG_THRESHOLD_MS_ENV = "LENNA_LOOP_LAG_THRESHOLD_MS"
+DEFAULT_LOOP_LAG_THRESHOLD_MS = 250
+
+
+class LoopMonitor:
+    """
+    LoopMonitor class definition
+    """
+
+    # Seconds between two lag probes on the loop
+    PROBE_INTERVAL = 0.1
+
+    def __init__(self, log, metrics, threshold_ms=None):
+        self.log = log
+        self.metrics = metrics
+
+        if threshold_ms is None:
+            threshold_ms = float(
+                os.getenv(LOOP_LAG_THRESHOLD_MS_ENV, DEFAULT_LOOP_LAG_THRESHOLD_MS)
+            )
+        self.threshold = threshold_ms / 1000
+
+        self.task = None
+        self.watchdog = None
+        self._loop_thread_id = None
+        self._last_tick = time.monotonic()
+        self._stopped = threading.Event()
+
+    @property
+    def running(self):
+        return self.task is not None and not self.task.done()
+
+    def start(self):
+        """
+        Starts probing the running loop, does nothing if already started
+        Must be called from a coroutine on the loop being monitored
+        """
+
+        if self.running:
+            return
+
+        self._loop_thread_id = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._stopped.clear()
+
+        self.task = asyncio.get_running_loop().create_task(self._probe())
+        self.watchdog = threading.Thread(
+            target=self._watch, name="lenna-loop-watchdog", daemon=True
+        )
+        self.watchdog.start()
+
+        self.log.info(
+            f"WATCHER: Monitoring event loop lag, threshold {self.threshold * 1000:.0f}ms"
+        )
+
+    def stop(self):
+        self._stopped.set()
+        if self.task is not None:
+            self.task.cancel()
+
+    async def _probe(self):
+        """
+        Internal function that sleeps on the loop and records how late it wakes up
+        """
+
+        while True:
+            start_time = time.monotonic()
+            await asyncio.sleep(self.PROBE_INTERVAL)
+            now = time.monotonic()
+
+            lag = max(now - start_time - self.PROBE_INTERVAL, 0.0)
+            self.metrics.observe(LOOP_LAG_SECONDS, lag)
+            self._last_tick = now
+
+            if lag >= self.threshold:
+                self.log.warning(f"WATCHER: Event loop lagged {lag * 1000:.1f}ms")
+
+    def _watch(self):
+        """
+        Internal function run on the watchdog thread
+        Logs the stack of the loop thread once per stall
+        """
+
+        reported_tick = None
+        while not self._stopped.wait(self.PROBE_INTERVAL):
+            last_tick = self._last_tick
+            blocked_for = time.monotonic() - last_tick - self.PROBE_INTERVAL
+            if blocked_for < self.threshold or reported_tick == last_tick:
+                continue
+
+            # Only report the stall once, the loop will tick again when it is over
+            reported_tick = last_tick
+            self.metrics.inc(LOOP_STALLS)
+
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else ""
+            self.log.warning(
+                f"WATCHER: Event loop blocked for {blocked_for * 1000:.1f}ms, "
+                f"loop thread is at:\n{stack}"
+            )
@@ -3,6 +3,9 @@ import logging
 
 from dotenv import load_dotenv
 
+from cache import Cache
+from log_pipeline import setup_logging
+from snapshot import import_snapshot
 from watcher import Watcher
 
 LOGFILE = "lenna.log"
@@ -10,20 +13,32 @@ CMD_PREFIX = "!"
 
 
 def main():
+    # Log records are written by a listener thread, never on the event loop
+    log = logging.getLogger(__name__)
+    log_listener = setup_logging(LOGFILE)
+    log.setLevel(logging.INFO)
+
     try:
         # Environment Setup
         load_dotenv()
         token = os.getenv("DISCORD_TOKEN")
 
-        log = logging.getLogger(__name__)
-        logging.basicConfig(filename=LOGFILE, encoding="utf-8")
-        log.setLevel(logging.INFO)
+        # Seed the cache from a snapshot so Lenna can answer from local data right away
+        cache = Cache(log)
+        snapshot = os.getenv("LENNA_SNAPSHOT")
+        if snapshot:
+            import_snapshot(cache, snapshot)
+
+        # Drop corrupt or orphaned entries and fit the cache in its budget
+        cache.compact()
 
-        lenna_bot = Watcher(log, token, CMD_PREFIX)
+        lenna_bot = Watcher(log, token, CMD_PREFIX, cache=cache)
         lenna_bot.run()
     except KeyboardInterrupt:
         # Gracefully handle a keyboard interrupt
         lenna_bot.close()
+    finally:
+        log_listener.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,170 @@
+"""
+Lenna's memory report
+
+Parses every doll, the weapons page and the status effects page from the
+local cache (or the benchmark fixtures) and reports how many bytes they take
+in memory once loaded, to size containers for a bot that holds everything in
+memory. Weapons are reported as loaded and with every field simplified, as
+their fields are only simplified once looked at
+
+Usage (from src/, like main.py):
+    python memory.py
+    python memory.py --fixtures ../bench/fixtures
+"""
+
+import argparse
+from enum import Enum
+import logging
+import sys
+
+from cache import (
+    Cache,
+    SKILL_END_RANGE,
+    SKILL_START_RANGE,
+    STATUS_EFFECTS_CACHE_KEY,
+    WEAPONS_CACHE_KEY,
+    doll_cache_key,
+    skill_cache_key,
+)
+from doll import Doll
+from fixtures import FixtureStore
+from parse_utils import get_wikitext
+from status_effects import StatusEffects
+from weapons import Weapons
+
+LOGFILE = "lenna_memory.log"
+
+
+def deep_sizeof(obj, seen=None):
+    """
+    Returns the bytes obj takes in memory together with everything it holds
+    Objects in seen are not counted again, pass the same set across calls to
+    count shared objects, like interned strings, only once
+    """
+
+    if seen is None:
+        seen = set()
+
+    size = 0
+    pending = [obj]
+    while pending:
+        current = pending.pop()
+        if id(current) in seen or isinstance(current, (type, Enum)):
+            continue
+
+        seen.add(id(current))
+        size += sys.getsizeof(current)
+
+        if isinstance(current, dict):
+            pending.extend(current.keys())
+            pending.extend(current.values())
+        elif isinstance(current, (list, tuple, set, frozenset)):
+            pending.extend(current)
+        elif not isinstance(current, (str, bytes, int, float, bool)):
+            if hasattr(current, "__dict__"):
+                pending.append(current.__dict__)
+
+            for cls in type(current).__mro__:
+                for slot in getattr(cls, "__slots__", ()):
+                    if hasattr(current, slot):
+                        pending.append(getattr(current, slot))
+
+    return size
+
+
+def load_dolls(wikitext, doll_keys, log):
+    """
+    Parses every doll under doll_keys, wikitext returns the wikitext of a key
+    Dolls that fail to parse are logged and skipped
+    """
+
+    dolls = []
+    for doll_key in doll_keys:
+        try:
+            doll_skills = [
+                wikitext(skill_cache_key(doll_key, i))
+                for i in range(SKILL_START_RANGE, SKILL_END_RANGE)
+            ]
+            dolls.append(Doll(wikitext(doll_key), doll_skills))
+        except Exception as e:
+            log.error(f"MEMORY: Failed to parse {doll_key}, skipping")
+            log.error(f"MEMORY: Exception:\n{e}")
+
+    return dolls
+
+
+def memory_report(wikitext, doll_keys, log):
+    """
+    Loads everything Lenna can hold in memory and measures it
+    Returns a list of (name, item count, bytes), shared strings are only
+    counted in the first entry that holds them
+    """
+
+    dolls = load_dolls(wikitext, doll_keys, log)
+    weapons = Weapons(wikitext(WEAPONS_CACHE_KEY))
+    status_effects = StatusEffects(wikitext(STATUS_EFFECTS_CACHE_KEY))
+
+    seen = set()
+    report = [
+        ("Dolls", len(dolls), deep_sizeof(dolls, seen)),
+        ("Weapons", len(weapons.weapons), deep_sizeof(weapons, seen)),
+        (
+            "Status Effects",
+            len(status_effects.status_effects),
+            deep_sizeof(status_effects, seen),
+        ),
+    ]
+
+    # Simplify every weapon field, as if every weapon had been looked up
+    for weapon in weapons.weapons.values():
+        str(weapon)
+    report.append(
+        ("Weapons (all viewed)", len(weapons.weapons), deep_sizeof(weapons, set()))
+    )
+
+    return report
+
+
+def print_report(report):
+    """
+    Prints the memory report as a table
+    """
+
+    print(f"{'':22}{'items':>8}{'KiB':>12}{'bytes/item':>12}")
+    for name, count, size in report:
+        per_item = size / count if count else 0
+        print(f"{name:22}{count:>8}{size / 1024:>12.1f}{per_item:>12.0f}")
+
+    # The fully viewed weapons are the same weapons, only count them once
+    total = sum(size for name, _, size in report[:-1])
+    print(f"{'Total (as loaded)':22}{'':>8}{total / 1024:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Reports the memory Lenna's parsed data takes"
+    )
+    parser.add_argument(
+        "--fixtures",
+        help="Measure this fixtures directory instead of the local cache",
+    )
+    args = parser.parse_args()
+
+    log = logging.getLogger(__name__)
+    logging.basicConfig(filename=LOGFILE, encoding="utf-8")
+    log.setLevel(logging.INFO)
+
+    if args.fixtures is not None:
+        store = FixtureStore(args.fixtures)
+        wikitext = store.wikitext
+        doll_keys = [doll_cache_key(doll_name) for doll_name in store.doll_names()]
+    else:
+        cache = Cache(log)
+        wikitext = lambda key: get_wikitext(cache.load(key))
+        doll_keys = cache.doll_keys()
+
+    print_report(memory_report(wikitext, doll_keys, log))
+
+
+if __name__ == "__main__":
+    main()
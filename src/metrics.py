@@ -0,0 +1,290 @@
+"""
+Metrics class
+
+In-process counters and latency histograms for Lenna, exposed in the
+Prometheus text format over a local HTTP endpoint and through !stats
+"""
+
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT_ENV = "LENNA_METRICS_PORT"
+DEFAULT_METRICS_PORT = 9108
+METRICS_PATH = "/metrics"
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Metric names
+COMMAND_SECONDS = "lenna_command_seconds"
+CACHE_REQUESTS = "lenna_cache_requests_total"
+WIKI_REQUESTS = "lenna_wiki_requests_total"
+WIKI_RESPONSE_BYTES = "lenna_wiki_response_bytes_total"
+WIKI_REQUEST_SECONDS = "lenna_wiki_request_seconds"
+PARSE_SECONDS = "lenna_parse_seconds"
+LOOP_LAG_SECONDS = "lenna_event_loop_lag_seconds"
+LOOP_STALLS = "lenna_event_loop_stalls_total"
+LANE_WAIT_SECONDS = "lenna_lane_wait_seconds"
+LANE_IN_FLIGHT = "lenna_lane_in_flight"
+LOOKUPS_IN_FLIGHT = "lenna_lookups_in_flight"
+LOOKUP_QUEUE_DEPTH = "lenna_lookup_queue_depth"
+LOOKUP_REJECTIONS = "lenna_lookup_rejections_total"
+LOOKUPS_THROTTLED = "lenna_lookups_throttled_total"
+LOOKUPS_COLLAPSED = "lenna_lookups_collapsed_total"
+AUTOCOMPLETE_SECONDS = "lenna_autocomplete_seconds"
+PREFETCHES = "lenna_prefetches_total"
+
+# Cache results and tiers
+CACHE_HIT = "hit"
+CACHE_MISS = "miss"
+CACHE_STALE = "stale"
+CACHE_BYPASS = "bypass"
+MEMORY_TIER = "memory"
+DISK_TIER = "disk"
+EMBED_TIER = "embed"
+
+
+class Histogram:
+    """
+    Latency histogram over a sliding window of the most recent samples
+    Count and sum cover every sample ever observed
+    """
+
+    QUANTILES = (0.5, 0.95, 0.99)
+    WINDOW_SIZE = 1024
+
+    def __init__(self):
+        self.samples = deque(maxlen=self.WINDOW_SIZE)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """
+        Returns the q-quantile of the window, or 0 if nothing was observed
+        """
+
+        if not self.samples:
+            return 0.0
+
+        ordered = sorted(self.samples)
+        index = min(int(q * len(ordered)), len(ordered) - 1)
+
+        return ordered[index]
+
+
+class Metrics:
+    """
+    Metrics class definition
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+
+    def inc(self, name, amount=1, **labels):
+        """
+        Increments a counter
+        """
+
+        key = (name, self._label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        """
+        Sets a gauge to value
+        """
+
+        key = (name, self._label_key(labels))
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        """
+        Records a sample in a histogram
+        """
+
+        key = (name, self._label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = Histogram()
+                self._histograms[key] = histogram
+
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Observes how long the enclosed block took, in seconds
+        """
+
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start_time, **labels)
+
+    def counters(self, name):
+        """
+        Returns a dictionary of label tuples to counter values
+        """
+
+        with self._lock:
+            return {
+                labels: value
+                for (counter_name, labels), value in self._counters.items()
+                if counter_name == name
+            }
+
+    def gauge(self, name, **labels):
+        """
+        Returns the value of a gauge, or None if it was never set
+        """
+
+        with self._lock:
+            return self._gauges.get((name, self._label_key(labels)))
+
+    def histograms(self, name):
+        """
+        Returns a dictionary of label tuples to (count, sum, p50, p95, p99)
+        """
+
+        with self._lock:
+            return {
+                labels: (
+                    histogram.count,
+                    histogram.sum,
+                    *(histogram.quantile(q) for q in Histogram.QUANTILES),
+                )
+                for (histogram_name, labels), histogram in self._histograms.items()
+                if histogram_name == name
+            }
+
+    def render_prometheus(self):
+        """
+        Renders every metric in the Prometheus text exposition format
+        """
+
+        lines = []
+        with self._lock:
+            for metric_type, metrics in (
+                ("counter", self._counters),
+                ("gauge", self._gauges),
+            ):
+                for name in sorted({name for name, _ in metrics}):
+                    lines.append(f"# TYPE {name} {metric_type}")
+                    for (metric_name, labels), value in metrics.items():
+                        if metric_name == name:
+                            lines.append(f"{name}{self._format_labels(labels)} {value}")
+
+            for name in sorted({name for name, _ in self._histograms}):
+                lines.append(f"# TYPE {name} summary")
+                for (metric_name, labels), histogram in self._histograms.items():
+                    if metric_name != name:
+                        continue
+
+                    for q in Histogram.QUANTILES:
+                        quantile_labels = labels + (("quantile", str(q)),)
+                        lines.append(
+                            f"{name}{self._format_labels(quantile_labels)} "
+                            f"{histogram.quantile(q)}"
+                        )
+
+                    lines.append(
+                        f"{name}_count{self._format_labels(labels)} {histogram.count}"
+                    )
+                    lines.append(
+                        f"{name}_sum{self._format_labels(labels)} {histogram.sum}"
+                    )
+
+        return "\n".join(lines) + "\n"
+
+    def _label_key(self, labels):
+        """
+        Internal function to turn labels into a hashable, ordered key
+        """
+
+        return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+    def _format_labels(self, labels):
+        """
+        Internal function to format labels the Prometheus way
+        """
+
+        if not labels:
+            return ""
+
+        formatted = ",".join(
+            f'{name}="{self._escape_label_value(value)}"' for name, value in labels
+        )
+
+        return f"{{{formatted}}}"
+
+    def _escape_label_value(self, value):
+        """
+        Internal function to escape backslashes, quotes and newlines
+        """
+
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsServer:
+    """
+    Local HTTP endpoint serving metrics for Prometheus to scrape
+    """
+
+    def __init__(self, log, metrics, port=DEFAULT_METRICS_PORT, host=METRICS_HOST):
+        self.log = log
+        self.metrics = metrics
+
+        handler = self._make_handler()
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, name="lenna-metrics", daemon=True
+        )
+
+    def start(self):
+        self.log.info(
+            f"METRICS: Serving metrics on {self.server.server_address}{METRICS_PATH}"
+        )
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _make_handler(self):
+        """
+        Internal function to build a request handler bound to these metrics
+        """
+
+        metrics = self.metrics
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != METRICS_PATH:
+                    self.send_error(404)
+                    return
+
+                body = metrics.render_prometheus().encode("utf8")
+                self.send_response(200)
+                self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Scrapes are too frequent to be worth logging
+                pass
+
+        return MetricsHandler
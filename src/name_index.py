@@ -0,0 +1,135 @@
+"""
+NameIndex class
+
+In-memory prefix index of the doll, weapon and status effect names Lenna
+knows, to autocomplete slash commands without touching the cache or the wiki.
+Every name is indexed under each of its words, so "cara" finds
+"Bittersweet Caramel", and a lookup is a binary search over a sorted list
+"""
+
+from bisect import bisect_left
+import re
+import threading
+
+# Kinds of names
+DOLL_NAMES = "doll"
+WEAPON_NAMES = "weapon"
+STATUS_EFFECT_NAMES = "status_effect"
+
+# Discord shows at most 25 choices of at most 100 characters
+MAX_CHOICES = 25
+MAX_CHOICE_LENGTH = 100
+
+# Where a name's words start, e.g., "Acid Corrosion II" -> "acid", "corrosion", "ii"
+WORD_START_PATTERN = re.compile(r"(?:^|(?<=[\s\-_(]))\w")
+
+
+def index_keys(name):
+    """
+    Returns the keys a name is indexed under, the folded name from each of
+    its word starts
+
+    E.g., "Bittersweet Caramel" -> ["bittersweet caramel", "caramel"]
+    """
+
+    folded_name = name.casefold()
+
+    return [
+        folded_name[word_start.start() :]
+        for word_start in WORD_START_PATTERN.finditer(folded_name)
+    ]
+
+
+class NameIndex:
+    """
+    NameIndex class definition
+
+    Lookups come from the event loop while lookup threads add names, writers
+    build a new list under the lock and swap it in, so readers never lock
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+        # Kind to its sorted (key, word number, name) entries and the names
+        # in them
+        self._entries = {}
+        self._names = {}
+
+        # Kind to the object its names were last taken from
+        self._sources = {}
+
+    def complete(self, kind, prefix, limit=MAX_CHOICES):
+        """
+        Returns up to limit known names with a word starting with prefix,
+        names starting with it first
+        """
+
+        entries = self._entries.get(kind, [])
+        folded_prefix = prefix.strip().casefold()
+
+        starts = []
+        contains = []
+        seen = set()
+        index = bisect_left(entries, (folded_prefix,))
+        while index < len(entries) and len(starts) < limit:
+            key, word, name = entries[index]
+            if not key.startswith(folded_prefix):
+                break
+
+            index += 1
+            if name in seen:
+                continue
+
+            seen.add(name)
+            if word == 0:
+                starts.append(name)
+            else:
+                contains.append(name)
+
+        return (starts + contains)[:limit]
+
+    def add(self, kind, name):
+        """
+        Adds a name, e.g., of a doll that was just looked up
+        """
+
+        with self._lock:
+            names = self._names.get(kind, frozenset())
+            if name not in names:
+                self._swap(kind, names | {name}, self._sources.get(kind))
+
+    def replace(self, kind, names, source=None):
+        """
+        Replaces every name of a kind
+        Passing the object the names come from, like a parsed Weapons, skips
+        the rebuild when the names were already taken from it
+        """
+
+        with self._lock:
+            if source is not None and self._sources.get(kind) is source:
+                return
+
+            self._swap(kind, frozenset(names), source)
+
+    def _swap(self, kind, names, source):
+        """
+        Internal function to build the entries of a kind and swap them in,
+        called with the lock held
+        """
+
+        names = frozenset(name for name in names if len(name) <= MAX_CHOICE_LENGTH)
+        self._entries[kind] = sorted(
+            (key, word, name)
+            for name in names
+            for word, key in enumerate(index_keys(name))
+        )
+        self._names[kind] = names
+        self._sources[kind] = source
+
+    def size(self, kind):
+        """
+        Returns how many names of a kind are known
+        """
+
+        return len(self._names.get(kind, ()))
@@ -0,0 +1,208 @@
+"""
+ParsePool class
+
+Parses wikitext in worker processes so pure-Python parsing of large pages,
+like the weapons and status effects pages, never holds the GIL the event loop
+and the lookup threads need. Workers send back the parsed Weapons,
+StatusEffects and Doll objects, which only hold plain strings and lists and
+so pickle compactly. Small pages are parsed inline, where sending them to a
+worker would cost more than parsing them
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import os
+import threading
+
+from doll import Doll
+from profiler import current_profiler
+from status_effects import StatusEffects
+from weapons import (
+    Weapons,
+    changed_weapons_tables,
+    parse_weapons_tables,
+    split_weapons_tables,
+)
+
+# Worker processes, 0 parses everything inline
+PARSE_WORKERS_ENV = "LENNA_PARSE_WORKERS"
+DEFAULT_PARSE_WORKERS = 2
+
+# Pages smaller than this are parsed inline
+PARSE_POOL_MIN_BYTES_ENV = "LENNA_PARSE_POOL_MIN_BYTES"
+DEFAULT_PARSE_POOL_MIN_BYTES = 64 * 1024
+
+# Workers are spawned, forking a process that runs the bot's threads is unsafe
+START_METHOD = "spawn"
+
+
+def parse_status_effects(wikitext):
+    """
+    Parses the status effects page, runs in a worker process
+    """
+
+    return StatusEffects(wikitext)
+
+
+def parse_doll(doll_data, doll_skills):
+    """
+    Parses a doll page and its skill pages, runs in a worker process
+    """
+
+    return Doll(doll_data, doll_skills)
+
+
+class ParsePool:
+    """
+    ParsePool class definition
+    """
+
+    def __init__(self, log, workers=None, min_bytes=None):
+        self.log = log
+        self.workers = (
+            workers
+            if workers is not None
+            else int(os.getenv(PARSE_WORKERS_ENV, DEFAULT_PARSE_WORKERS))
+        )
+        self.min_bytes = (
+            min_bytes
+            if min_bytes is not None
+            else int(os.getenv(PARSE_POOL_MIN_BYTES_ENV, DEFAULT_PARSE_POOL_MIN_BYTES))
+        )
+
+        # Started on the first parse that needs it
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(cancel_futures=True)
+                self._executor = None
+
+    def weapons(self, wikitext, previous=None):
+        """
+        Parses the weapons page into Weapons
+        Only the tables that changed since previous are sent to a worker
+        """
+
+        tables = split_weapons_tables(wikitext)
+        changed_tables = changed_weapons_tables(tables, previous)
+        size = sum(len(table) for _, _, table in changed_tables)
+        parsed_tables = self._run(parse_weapons_tables, size, changed_tables)
+
+        return Weapons.from_tables(tables, parsed_tables, previous)
+
+    def status_effects(self, wikitext):
+        """
+        Parses the status effects page into StatusEffects
+        """
+
+        return self._run(parse_status_effects, len(wikitext), wikitext)
+
+    def doll(self, doll_data, doll_skills):
+        """
+        Parses a doll page and its skill pages into a Doll
+        """
+
+        size = len(doll_data) + sum(len(doll_skill) for doll_skill in doll_skills)
+
+        return self._run(parse_doll, size, doll_data, doll_skills)
+
+    def dolls(self, doll_pages):
+        """
+        Parses many (doll page, skill pages) pairs at once, spread over the
+        workers
+        Returns the Dolls in the order of doll_pages, or the exception that
+        a doll failed to parse with in its place
+        """
+
+        executor = self._pool() if len(doll_pages) > 1 else None
+        if executor is None:
+            return [self._parse_inline(parse_doll, *pages) for pages in doll_pages]
+
+        try:
+            futures = [
+                executor.submit(parse_doll, doll_data, doll_skills)
+                for doll_data, doll_skills in doll_pages
+            ]
+        except BrokenProcessPool as e:
+            self._reset(executor, e)
+            return [self._parse_inline(parse_doll, *pages) for pages in doll_pages]
+
+        dolls = []
+        for future, pages in zip(futures, doll_pages):
+            try:
+                dolls.append(future.result())
+            except BrokenProcessPool as e:
+                self._reset(executor, e)
+                dolls.append(self._parse_inline(parse_doll, *pages))
+            except Exception as e:
+                dolls.append(e)
+
+        return dolls
+
+    def _run(self, parse, size, *args):
+        """
+        Internal function to parse in a worker, or inline for small pages
+        """
+
+        executor = self._pool() if size >= self.min_bytes else None
+        if executor is None:
+            return parse(*args)
+
+        try:
+            return executor.submit(parse, *args).result()
+        except BrokenProcessPool as e:
+            # A worker died, e.g., killed for memory, parse this one inline
+            self._reset(executor, e)
+            return parse(*args)
+
+    def _parse_inline(self, parse, *args):
+        """
+        Internal function to parse in this process, returning the exception
+        on failure like a worker would
+        """
+
+        try:
+            return parse(*args)
+        except Exception as e:
+            return e
+
+    def _pool(self):
+        """
+        Internal function to start the worker processes on first use
+        Returns None when parsing is inline only, or while a command is being
+        profiled, the profiler cannot see into the workers
+        """
+
+        if self.workers <= 0 or current_profiler() is not None:
+            return None
+
+        with self._lock:
+            if self._executor is None:
+                self.log.info(f"PARSE POOL: Starting {self.workers} parse workers")
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(START_METHOD),
+                )
+
+            return self._executor
+
+    def _reset(self, executor, exception):
+        """
+        Internal function to drop a broken pool, the next parse starts a new one
+        """
+
+        with self._lock:
+            # Every pending future of a broken pool fails, only reset it once
+            if self._executor is not executor:
+                return
+
+            self.log.error("PARSE POOL: Worker pool broke, restarting it")
+            self.log.error(f"PARSE POOL: Exception:\n{exception}")
+
+            self._executor = None
+
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -3,6 +3,7 @@ Internal library to help with common parsing functions
 """
 
 import json
+import sys
 import wikitextparser as wtp
 
 # Template parsing variables
@@ -108,6 +109,15 @@ def simplify(wikitext):
     return wikitext
 
 
+def intern_string(string):
+    """
+    Internal function to intern a string that repeats across entities, e.g.,
+    a role, so they all share one copy
+    """
+
+    return sys.intern(string) if string is not None else None
+
+
 def cleanup_string(string):
     clean_string = string.replace(BREAK_STR, SPACE_STR)
     clean_string = clean_string.replace(SINGLE_QUOTES_STR, EMPTY_STR)
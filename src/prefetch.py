@@ -0,0 +1,120 @@
+"""
+Prefetcher class
+
+Warms what users are likely to ask about next in the background, like the
+signature weapon and the status effects of a doll that was just looked up.
+Jobs run one at a time on their own thread, at most one per interval and
+only while no lookups are waiting, so they never hold up the lookups users
+are waiting on. Once the queue is full, new jobs are dropped
+"""
+
+import os
+import queue
+import threading
+
+from metrics import PREFETCHES, Metrics
+
+# Jobs waiting to run, 0 turns prefetching off
+PREFETCH_QUEUE_SIZE_ENV = "LENNA_PREFETCH_QUEUE_SIZE"
+DEFAULT_PREFETCH_QUEUE_SIZE = 16
+
+# Milliseconds between two jobs, and between two checks for waiting lookups
+PREFETCH_INTERVAL_MS_ENV = "LENNA_PREFETCH_INTERVAL_MS"
+DEFAULT_PREFETCH_INTERVAL_MS = 500
+
+# Job results
+PREFETCH_DONE = "done"
+PREFETCH_FAILED = "failed"
+PREFETCH_DROPPED = "dropped"
+
+
+class Prefetcher:
+    """
+    Prefetcher class definition
+    """
+
+    def __init__(self, log, metrics=None, busy=None, queue_size=None, interval_ms=None):
+        self.log = log
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.busy = busy if busy is not None else (lambda: False)
+        self.queue_size = (
+            queue_size
+            if queue_size is not None
+            else int(os.getenv(PREFETCH_QUEUE_SIZE_ENV, DEFAULT_PREFETCH_QUEUE_SIZE))
+        )
+        if interval_ms is None:
+            interval_ms = float(
+                os.getenv(PREFETCH_INTERVAL_MS_ENV, DEFAULT_PREFETCH_INTERVAL_MS)
+            )
+        self.interval = interval_ms / 1000
+
+        self._queue = queue.Queue(maxsize=max(self.queue_size, 1))
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+        # Started on the first job
+        self._thread = None
+
+    def submit(self, key, func, *args, **kwargs):
+        """
+        Queues func to run in the background, unless a job with the same key
+        is already queued
+        Safe to call from any thread
+        Returns whether the job was queued
+        """
+
+        if self.queue_size <= 0 or self._stopped.is_set():
+            return False
+
+        with self._lock:
+            if key in self._pending:
+                return False
+
+            try:
+                self._queue.put_nowait((key, func, args, kwargs))
+            except queue.Full:
+                self.metrics.inc(PREFETCHES, result=PREFETCH_DROPPED)
+                return False
+
+            self._pending.add(key)
+
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._work, name="lenna-prefetch", daemon=True
+                )
+                self._thread.start()
+
+        return True
+
+    def close(self):
+        self._stopped.set()
+
+    def _work(self):
+        """
+        Internal function run on the prefetch thread
+        """
+
+        while not self._stopped.is_set():
+            try:
+                key, func, args, kwargs = self._queue.get(timeout=self.interval)
+            except queue.Empty:
+                continue
+
+            # Lookups users are waiting on go first
+            while self.busy():
+                if self._stopped.wait(self.interval):
+                    return
+
+            with self._lock:
+                self._pending.discard(key)
+
+            try:
+                func(*args, **kwargs)
+                self.metrics.inc(PREFETCHES, result=PREFETCH_DONE)
+            except Exception as e:
+                self.metrics.inc(PREFETCHES, result=PREFETCH_FAILED)
+                self.log.warning(f"PREFETCH: Failed to prefetch {key}")
+                self.log.warning(f"PREFETCH: Exception:\n{e}")
+
+            self._stopped.wait(self.interval)
@@ -0,0 +1,268 @@
+"""
+CommandProfiler class
+
+On-demand profiling of the next few commands Lenna handles
+Runs cProfile and tracemalloc around each command, accumulates the results and
+summarizes the top functions and allocation sites once enough were profiled,
+so hot spots can be found in production without restarting under a profiler
+
+Lookups run in lane threads, and cProfile only records the thread it was
+enabled in, so a profiled command hands its profiling over to the lane thread
+that runs its lookup, and parses inline rather than in the parse workers
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+import cProfile
+import io
+import os
+import pstats
+import threading
+import tracemalloc
+
+# Functions Lenna spends most of her lookup time in, as (file, function)
+PROFILE_TARGETS = (
+    ("responder.py", "get_doll"),
+    ("responder.py", "get_weapon"),
+    ("responder.py", "get_status_effect"),
+    ("weapons.py", "_parse_weapons_wikitable"),
+    ("weapons.py", "_field"),
+    ("status_effects.py", "__init__"),
+    ("parse_utils.py", "simplify"),
+)
+
+# Profiler of the command being run, carried into the lane threads it uses
+_current_profiler = ContextVar("lenna_current_profiler", default=None)
+
+
+def current_profiler():
+    """
+    Returns the CommandProfiler profiling the running command, or None
+    """
+
+    return _current_profiler.get()
+
+
+class CommandProfiler:
+    """
+    CommandProfiler class definition
+    """
+
+    MAX_COMMANDS = 50
+    TOP_FUNCTIONS = 10
+    TOP_ALLOCATIONS = 10
+    TRACEMALLOC_FRAMES = 1
+
+    def __init__(self, log):
+        self.log = log
+        self.remaining = 0
+        self.profiled = 0
+        self.channel = None
+
+        self._stats = None
+        self._stats_lock = threading.Lock()
+        self._active = False
+        self._profile = None
+        self._started_tracemalloc = False
+        self._baseline = None
+
+    @property
+    def armed(self):
+        return self.remaining > 0
+
+    @property
+    def finished(self):
+        return self.profiled > 0 and self.remaining == 0 and not self._active
+
+    def arm(self, count, channel=None):
+        """
+        Profiles the next count commands
+        channel is remembered so the summary can be posted where it was asked for
+        """
+
+        if count < 1 or count > self.MAX_COMMANDS:
+            raise ValueError(
+                f"Can only profile between 1 and {self.MAX_COMMANDS} commands"
+            )
+
+        self.remaining = count
+        self.profiled = 0
+        self.channel = channel
+        self._stats = None
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.TRACEMALLOC_FRAMES)
+            self._started_tracemalloc = True
+        self._baseline = tracemalloc.take_snapshot()
+
+        self.log.info(f"PROFILER: Profiling the next {count} commands")
+
+    @contextmanager
+    def profile(self):
+        """
+        Profiles the enclosed command if profiling is armed
+        Commands overlapping a profiled one are not profiled, since cProfile
+        can only run one profiler at a time
+        Yields whether the command is being profiled
+        """
+
+        if not self.armed or self._active:
+            yield False
+            return
+
+        self._active = True
+        self._profile = cProfile.Profile()
+        token = _current_profiler.set(self)
+        self._profile.enable()
+        try:
+            yield True
+        finally:
+            self._profile.disable()
+            _current_profiler.reset(token)
+            self._active = False
+
+            self._add_stats(self._profile)
+            self._profile = None
+
+            self.remaining -= 1
+            self.profiled += 1
+
+    @contextmanager
+    def paused(self):
+        """
+        Pauses profiling the event loop thread while the profiled command
+        runs in a lane thread, only one profiler can run at a time
+        """
+
+        self._profile.disable()
+        try:
+            yield
+        finally:
+            self._profile.enable()
+
+    def run(self, func, *args, **kwargs):
+        """
+        Runs func profiled, in the lane thread running the profiled command
+        """
+
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+            self._add_stats(profile)
+
+    def summary(self):
+        """
+        Summarizes everything profiled since arm() and stops tracemalloc
+        Returns a dictionary of section name to list of lines
+        """
+
+        summary = {
+            "Top Functions": self._top_functions(),
+            "Targets": self._targets(),
+            "Top Allocations": self._top_allocations(),
+        }
+
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+        self._baseline = None
+        self._stats = None
+        self.profiled = 0
+
+        for section, lines in summary.items():
+            text = "\n".join(lines)
+            self.log.info(f"PROFILER: {section}:\n{text}")
+
+        return summary
+
+    def _add_stats(self, profile):
+        """
+        Internal function to add a profile to the accumulated stats
+        """
+
+        with self._stats_lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profile, stream=io.StringIO())
+            else:
+                self._stats.add(profile)
+
+    def _top_functions(self):
+        """
+        Internal function to list the functions with the most cumulative time
+        """
+
+        if self._stats is None:
+            return []
+
+        entries = sorted(
+            self._stats.stats.items(),
+            key=lambda item: item[1][3],
+            reverse=True,
+        )
+
+        return [
+            self._format_function(function, stat)
+            for function, stat in entries[: self.TOP_FUNCTIONS]
+        ]
+
+    def _targets(self):
+        """
+        Internal function to report the time spent in Lenna's known hot paths
+        """
+
+        if self._stats is None:
+            return []
+
+        lines = []
+        for function, stat in self._stats.stats.items():
+            filename, _, function_name = function
+            if (os.path.basename(filename), function_name) in PROFILE_TARGETS:
+                lines.append(self._format_function(function, stat))
+
+        return lines
+
+    def _top_allocations(self):
+        """
+        Internal function to list the lines that allocated the most memory
+        since profiling was armed
+        """
+
+        if self._baseline is None or not tracemalloc.is_tracing():
+            return []
+
+        # Leave out what the profilers themselves allocated
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            (
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, cProfile.__file__),
+                tracemalloc.Filter(False, pstats.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            )
+        )
+        differences = snapshot.compare_to(self._baseline, "lineno")
+
+        lines = []
+        for difference in differences[: self.TOP_ALLOCATIONS]:
+            frame = difference.traceback[0]
+            lines.append(
+                f"{os.path.basename(frame.filename)}:{frame.lineno} "
+                f"{difference.size_diff / 1024:+.1f} KiB ({difference.count_diff:+} blocks)"
+            )
+
+        return lines
+
+    def _format_function(self, function, stat):
+        """
+        Internal function to format one pstats entry
+        """
+
+        filename, lineno, function_name = function
+        _, calls, total_time, cumulative_time, _ = stat
+
+        return (
+            f"{os.path.basename(filename)}:{lineno}({function_name}) "
+            f"x{calls} {cumulative_time * 1000:.1f}ms cum, {total_time * 1000:.1f}ms own"
+        )
@@ -4,33 +4,82 @@ Lenna's Response Handler
 Takes user message and prepares the appropriate response
 """
 
+from contextlib import contextmanager
 from datetime import datetime, timezone
+from fnmatch import fnmatch, filter as fnmatch_filter
 import json
+import threading
 from textwrap import dedent
 
 from discord import (
     Embed,
     Color,
 )
-import requests
 from typing import TypedDict
 
+from cache import (
+    Cache,
+    IOPWIKI_STATUS_EFFECTS_PAGE,
+    IOPWIKI_WEAPONS_PAGE,
+    PARSE_STRING,
+    REVID_STRING,
+    STATUS_EFFECTS_CACHE_KEY,
+    WEAPONS_CACHE_KEY,
+    SKILL_END_RANGE,
+    SKILL_START_RANGE,
+    doll_cache_key,
+    doll_page_title,
+    skill_cache_key,
+    skill_page_title,
+)
 from doll import Doll
-from weapons import Weapons
+from embed_cache import EmbedCache
+from log_pipeline import SAMPLED
+from metrics import (
+    CACHE_BYPASS,
+    CACHE_HIT,
+    CACHE_MISS,
+    CACHE_REQUESTS,
+    CACHE_STALE,
+    COMMAND_SECONDS,
+    DISK_TIER,
+    EMBED_TIER,
+    LANE_IN_FLIGHT,
+    LANE_WAIT_SECONDS,
+    LOOKUP_QUEUE_DEPTH,
+    LOOKUP_REJECTIONS,
+    LOOKUPS_COLLAPSED,
+    LOOKUPS_IN_FLIGHT,
+    LOOKUPS_THROTTLED,
+    LOOP_LAG_SECONDS,
+    LOOP_STALLS,
+    MEMORY_TIER,
+    Metrics,
+    PARSE_SECONDS,
+    PREFETCHES,
+    WIKI_REQUEST_SECONDS,
+    WIKI_REQUESTS,
+    WIKI_RESPONSE_BYTES,
+)
+from parse_pool import ParsePool
+from signature_index import SignatureIndex
+from prefetch import (
+    PREFETCH_DONE,
+    PREFETCH_DROPPED,
+    PREFETCH_FAILED,
+)
 from special_names import (
-    SPECIAL_DOLL_NAMES,
     SPECIAL_WEAPON_NAMES,
 )
-from status_effects import StatusEffects
+from tracing import Tracer
 from parse_utils import (
     get_wikitext,
 )
-
-IOPWIKI_API_URL = "https://iopwiki.com/api.php"
-IOPWIKI_DATA_FETCH_PARAM = "?action=parse&prop=wikitext&format=json&redirects=1&page="
-IOPWIKI_INFO_FETCH_PARAM = "?action=query&format=json&prop=info&titles="
-IOPWIKI_WEAPONS_PAGE = "GFL2_Weapons"
-IOPWIKI_STATUS_EFFECTS_PAGE = "GFL2_Status_Effects"
+from wiki_client import (
+    QueryFailedException,
+    WikiClient,
+    load_headers,
+)
 
 
 class InvalidMediaException(Exception):
@@ -103,23 +152,23 @@ class CacheNotFoundException(Exception):
         super().__init__(self.message)
 
 
-class QueryFailedException(Exception):
+class ForceQueryFailedException(QueryFailedException):
     """
-    Exception for when a query fails
+    Exception for when a force query fails
     """
 
     def __init__(self, message):
-        self.message = f"QueryFailedException: {message}"
+        self.message = f"ForceQueryFailedException: {message}"
         super().__init__(self.message)
 
 
-class ForceQueryFailedException(QueryFailedException):
+class InvalidEntityException(Exception):
     """
-    Exception for when a force query fails
+    Exception for when an unknown entity type is given
     """
 
     def __init__(self, message):
-        self.message = f"ForceQueryFailedException: {message}"
+        self.message = f"InvalidEntityException: {message}"
         super().__init__(self.message)
 
 
@@ -139,12 +188,9 @@ class Responder:
 
     # Media-related variables
     _DATA_DIRECTORY = "../data"
-    _CACHE_DIRECTORY = f"{_DATA_DIRECTORY}/cache/"
     _HEADERS_FILE = "headers.json"
     _MEDIA_FILE = "media.json"
     _COMMANDS_FILE = "commands.json"
-    _WEAPONS_CACHE_FILE = "weapons.json"
-    _STATUS_EFFECTS_CACHE_FILE = "status_effects.json"
     _FETCHED_STRING = "fetched"
     _UPDATEABLE_STRING = "updateable"
     _COMMAND_HELPSTRING = "helpstring"
@@ -154,38 +200,87 @@ class Responder:
     # Parsing variables
     _DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
     _TOUCHED_STRING = "touched"
-    _QUERY_STRING = "query"
-    _PAGES_STRING = "pages"
+    _LAST_REVID_STRING = "lastrevid"
 
     # Query variables
-    _SKILL_START_RANGE = 1
-    _SKILL_END_RANGE = 6
-    _GOOD_RESPONSE_CODE = 200
     _HEADERS = {
         "User-agent": "LennaBot/1.0 (sentientfishsentient@gmail.com)",
         "From": "sentientfishsentient@gmail.com",
     }
-    _ERR_STRING = "error"
+
+    # Entity variables
+    _DOLL_ENTITY = "doll"
+    _DOLL_SKILL_ENTITY = "doll_skill"
+    _WEAPON_ENTITY = "weapon"
+    _STATUS_EFFECT_ENTITY = "status_effect"
+
+    # Invalidation variables
+    _INVALIDATE_ENTITIES = {
+        "doll": _DOLL_ENTITY,
+        "dolls": _DOLL_ENTITY,
+        "weapon": _WEAPON_ENTITY,
+        "weapons": _WEAPON_ENTITY,
+        "effect": _STATUS_EFFECT_ENTITY,
+        "effects": _STATUS_EFFECT_ENTITY,
+        "define": _STATUS_EFFECT_ENTITY,
+    }
+    _INVALIDATE_LIST_LIMIT = 25
 
     # Embed process variables
     _BREAK_TAG = "<br>"
     _NEWLINE_STRING = "\n"
     _STAR_EMOJI_STRING = ":star:"
     _ARROW_EMOJI_STRING = ":arrow_up_small:"
-
-    def __init__(self, log, cmd_prefix):
+    _EMBED_FIELD_LIMIT = 1024
+
+    def __init__(
+        self,
+        log,
+        cmd_prefix,
+        metrics=None,
+        tracer=None,
+        cache=None,
+        wiki=None,
+        parse_pool=None,
+    ):
         self.media_dict = self._load_media()
         self.log = log
         self.cmd_prefix = cmd_prefix
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.tracer = tracer if tracer is not None else Tracer(log)
         self.weapons = None
         self.status_effects = None
-        self.session = requests.Session()
 
-        self.session.headers.update(self._get_headers())
+        # Set when the weapons or status effects page was refreshed, the next
+        # lookup re-parses it, only the weapons tables that changed
+        self._weapons_outdated = False
+        self._status_effects_outdated = False
+
+        # Lookup threads and the prefetch thread load these pages at once,
+        # checking and swapping the parsed pages is done under these locks
+        self._weapons_lock = threading.Lock()
+        self._status_effects_lock = threading.Lock()
+        self.cache = cache if cache is not None else Cache(self.log)
+        self.wiki = (
+            wiki
+            if wiki is not None
+            else WikiClient(self.log, self._get_headers(), metrics=self.metrics)
+        )
+        self.parse_pool = parse_pool if parse_pool is not None else ParsePool(log)
+        self.embeds = EmbedCache()
+
+        # Doll key to the signature weapon and skill text of the doll as it
+        # was last parsed, what users likely ask about after looking it up
+        self._related = {}
+
+        # Dolls joined to their signature weapons, shown in doll embeds
+        self.signatures = SignatureIndex()
 
     def close(self):
         self.log.info("RESPONDER: Shutting down")
-        self.session.close()
+        self.wiki.close()
+        self.parse_pool.close()
+        self.cache.flush()
 
     def get_media(self, media_name):
         """
@@ -256,68 +351,663 @@ class Responder:
         Returns a discord embed
         """
 
+        # Pages missing from the cache, stale or due for a revision check are
+        # downloaded in one batched request, not one request per page
+        if not force and not use_cache:
+            with self.tracer.span("prefetch", dolls=1):
+                payloads = self._fetch_pages(
+                    [
+                        (page_title, cache_key)
+                        for page_title, cache_key in self._doll_pages(doll_name)
+                        if self._needs_fetch(cache_key)
+                    ]
+                )
+
+            # The wiki just said the doll does not exist, do not ask it again
+            doll_page = doll_page_title(doll_name)
+            if doll_page in payloads and payloads[doll_page] is None:
+                raise DollNotFoundException(f"Doll {doll_page} was not found!")
+
+        try:
+            loaded = self._load_doll(doll_name, use_cache=use_cache, force=force)
+            with self._parse_phase(self._DOLL_ENTITY):
+                doll = self.parse_pool.doll(*loaded[0])
+
+        except Exception as e:
+            if isinstance(e, CacheNotFoundException):
+                raise
+            elif force:
+                self.log.error(
+                    f"RESPONDER: Forced doll query failed! Stopping lookup..."
+                )
+                raise
+
+            # Doll was not parseable, use cache
+            self.log.error(
+                f"RESPONDER: Ran into an error when looking up doll information for {doll_name}"
+            )
+            self.log.error(f"RESPONDER: Exception:\n{e}")
+            self.log.info("RESPONDER: Attempting to use cache...")
+
+            # If we reach here, that definitely means something went wrong
+            # we want to update our cache if we can so we do not query it in the future
+            parse_args, raw_pages, _, _ = self._load_doll(
+                doll_name, use_cache=True, force=force
+            )
+            # Written back to the cache, marked as not updateable
+            loaded = (parse_args, raw_pages, True, False)
+
+            with self._parse_phase(self._DOLL_ENTITY):
+                doll = self.parse_pool.doll(*parse_args)
+
+        return self._finish_doll(doll_name, doll, loaded, with_doll, with_keys)
+
+    def get_dolls(self, doll_names, with_doll=True, with_keys=False, use_cache=False):
+        """
+        Function to fetch the information of several dolls at once
+        Every page of theirs that is missing from the cache, stale or due for
+        a revision check is downloaded in one batched request first, so each
+        doll is then answered from the cache, and the dolls are parsed
+        together, spread over the parse workers
+        Returns a list of discord embeds, or the exception a doll failed with
+        in its place
+        """
+
+        payloads = {}
+        if not use_cache:
+            with self.tracer.span("prefetch", dolls=len(doll_names)):
+                pages = [
+                    page
+                    for doll_name in doll_names
+                    for page in self._doll_pages(doll_name)
+                ]
+                payloads = self._fetch_pages(
+                    [
+                        (page_title, cache_key)
+                        for page_title, cache_key in pages
+                        if self._needs_fetch(cache_key)
+                    ]
+                )
+
+        results = [None] * len(doll_names)
+        loaded_dolls = []
+        for index, doll_name in enumerate(doll_names):
+            # The wiki just said the doll does not exist, do not ask it again
+            doll_page = doll_page_title(doll_name)
+            if doll_page in payloads and payloads[doll_page] is None:
+                results[index] = DollNotFoundException(
+                    f"Doll {doll_page} was not found!"
+                )
+                continue
+
+            loaded = self._batch_result(self._load_doll, doll_name, use_cache=use_cache)
+            if isinstance(loaded, Exception):
+                # Looked up on its own, which falls back to the cache
+                results[index] = self._batch_result(
+                    self.get_doll,
+                    doll_name,
+                    with_doll=with_doll,
+                    with_keys=with_keys,
+                    use_cache=use_cache,
+                )
+                continue
+
+            loaded_dolls.append((index, doll_name, loaded))
+
+        with self._parse_phase(self._DOLL_ENTITY):
+            dolls = self.parse_pool.dolls([loaded[0] for _, _, loaded in loaded_dolls])
+
+        for (index, doll_name, loaded), doll in zip(loaded_dolls, dolls):
+            if isinstance(doll, Exception):
+                results[index] = self._batch_result(
+                    self.get_doll,
+                    doll_name,
+                    with_doll=with_doll,
+                    with_keys=with_keys,
+                    use_cache=use_cache,
+                )
+            else:
+                results[index] = self._batch_result(
+                    self._finish_doll, doll_name, doll, loaded, with_doll, with_keys
+                )
+
+        return results
+
+    def get_weapon(self, weapon_name, use_cache=False, force=False):
+        """
+        Function to fetch weapon information
+        Returns a discord embed
+        """
+
+        weapons, updateable = self._load_weapons(
+            weapon_name, use_cache=use_cache, force=force
+        )
+
+        return self._find_weapon(weapon_name, weapons, updateable)
+
+    def get_weapons(self, weapon_names, use_cache=False):
+        """
+        Function to fetch the information of several weapons at once
+        The weapons page is only loaded once for all of them
+        Returns a list of discord embeds, or the exception a weapon failed
+        with in its place
+        """
+
+        weapons, updateable = self._load_weapons(
+            ", ".join(weapon_names), use_cache=use_cache
+        )
+
+        return [
+            self._batch_result(self._find_weapon, weapon_name, weapons, updateable)
+            for weapon_name in weapon_names
+        ]
+
+    def _load_weapons(self, weapon_name, use_cache=False, force=False):
+        """
+        Internal function to load the weapons page and parse it if it changed
+        Returns the loaded Weapons and whether the page is updateable
+        """
+
         updateable = True
-        update_cache = False
+        if not force and not use_cache:
+            with self.tracer.span("refresh_stale"):
+                self._refresh_stale([(IOPWIKI_WEAPONS_PAGE, WEAPONS_CACHE_KEY)])
+
         try:
-            raw_doll_data, update, doll_file_directory, doll_data_updateable = (
-                self._get_doll_data(doll_name, use_cache=use_cache, force=force)
+            raw_weapons_data, update, updateable = self._query_wiki(
+                IOPWIKI_WEAPONS_PAGE,
+                WEAPONS_CACHE_KEY,
+                self._WEAPON_ENTITY,
+                use_cache=use_cache,
+                force=force,
             )
-            raw_doll_skills, update_list, skill_directories, skill_data_updateable = (
-                self._get_doll_skills(doll_name, use_cache=use_cache, force=force)
+
+            weapons_data = get_wikitext(raw_weapons_data)
+            with self._weapons_lock:
+                weapons = self.weapons
+                if update or weapons == None or self._weapons_outdated:
+                    self._record_cache(MEMORY_TIER, self._WEAPON_ENTITY, CACHE_MISS)
+                    with self._parse_phase(self._WEAPON_ENTITY):
+                        weapons = self.parse_pool.weapons(
+                            weapons_data, previous=self.weapons
+                        )
+                    self.signatures.update_weapons(weapons, previous=self.weapons)
+                    self.weapons = weapons
+                    self._weapons_outdated = False
+
+                    self.log.info(
+                        f"RESPONDER: Re-parsed {len(weapons.reparsed_tables)} "
+                        f"of {len(weapons.tables)} weapons tables"
+                    )
+                else:
+                    self._record_cache(MEMORY_TIER, self._WEAPON_ENTITY, CACHE_HIT)
+
+        except Exception as e:
+            if isinstance(e, CacheNotFoundException):
+                raise
+            elif force:
+                self.log.error(
+                    f"RESPONDER: Forced weapon query failed! Stopping lookup..."
+                )
+                raise
+
+            # Weapons page was not parseable, use cache
+            self.log.error(
+                f"RESPONDER: Ran into an error when looking up weapon information for {weapon_name}"
             )
+            self.log.error(f"RESPONDER: Exception:\n{e}")
+            self.log.info("RESPONDER: Attempting to use cache...")
+
+            # If we reach here, that definitely means something went wrong
+            # we want to update our cache if we can so we do not query it in the future
+            update = True
+            use_cache = True
+            updateable = False
+
+            raw_weapons_data, _, _ = self._query_wiki(
+                IOPWIKI_WEAPONS_PAGE,
+                WEAPONS_CACHE_KEY,
+                self._WEAPON_ENTITY,
+                use_cache=use_cache,
+                force=force,
+            )
+            weapons = self.weapons
+
+        if update:
+            self.cache.store(WEAPONS_CACHE_KEY, raw_weapons_data, updateable)
+
+        return weapons, updateable
 
-            updateable = (
-                False if not doll_data_updateable or not skill_data_updateable else True
+    def _find_weapon(self, weapon_name, weapons, updateable):
+        """
+        Internal function to find a weapon in weapons, the loaded weapons page
+        Returns a discord embed
+        """
+
+        weapon_name = SPECIAL_WEAPON_NAMES.get(weapon_name, weapon_name)
+        embed_key = (self._WEAPON_ENTITY, weapon_name)
+        embed = self.embeds.get(embed_key, weapons, updateable)
+        if embed is not None:
+            self._record_cache(EMBED_TIER, self._WEAPON_ENTITY, CACHE_HIT)
+            return embed
+
+        weapon = weapons.get_weapon(weapon_name)
+        if weapon == None:
+            raise WeaponNotFoundException(f"Weapon {weapon_name} was not found!")
+
+        self._record_cache(EMBED_TIER, self._WEAPON_ENTITY, CACHE_MISS)
+        with self.tracer.span("embed"):
+            embed = self._weapon_embed(weapon, updateable)
+        self.embeds.put(embed_key, weapons, updateable, embed)
+
+        return embed
+
+    def get_status_effect(self, status_effect_name, use_cache=False, force=False):
+        """
+        Function to fetch status effect
+        Returns a discord embed
+        """
+
+        status_effects, updateable = self._load_status_effects(
+            status_effect_name, use_cache=use_cache, force=force
+        )
+
+        return self._find_status_effect(status_effect_name, status_effects, updateable)
+
+    def get_status_effects(self, status_effect_names, use_cache=False):
+        """
+        Function to fetch several status effects at once
+        The status effects page is only loaded once for all of them
+        Returns a list of discord embeds, or the exception a status effect
+        failed with in its place
+        """
+
+        status_effects, updateable = self._load_status_effects(
+            ", ".join(status_effect_names), use_cache=use_cache
+        )
+
+        return [
+            self._batch_result(
+                self._find_status_effect,
+                status_effect_name,
+                status_effects,
+                updateable,
             )
+            for status_effect_name in status_effect_names
+        ]
 
-            doll_data, doll_skills = self._process_raw_doll_info(
-                raw_doll_data, raw_doll_skills
+    def _load_status_effects(self, status_effect_name, use_cache=False, force=False):
+        """
+        Internal function to load the status effects page and parse it if it
+        changed
+        Returns the loaded StatusEffects and whether the page is updateable
+        """
+
+        updateable = True
+        if not force and not use_cache:
+            with self.tracer.span("refresh_stale"):
+                self._refresh_stale(
+                    [(IOPWIKI_STATUS_EFFECTS_PAGE, STATUS_EFFECTS_CACHE_KEY)]
+                )
+
+        try:
+            raw_status_effects_data, update, updateable = self._query_wiki(
+                IOPWIKI_STATUS_EFFECTS_PAGE,
+                STATUS_EFFECTS_CACHE_KEY,
+                self._STATUS_EFFECT_ENTITY,
+                use_cache=use_cache,
+                force=force,
             )
-            doll = Doll(doll_data, doll_skills)
 
-            # If any response is True, we update
-            update_cache = update or any(update_list)
+            status_effects_data = get_wikitext(raw_status_effects_data)
+            with self._status_effects_lock:
+                status_effects = self.status_effects
+                if update or status_effects == None or self._status_effects_outdated:
+                    self._record_cache(
+                        MEMORY_TIER, self._STATUS_EFFECT_ENTITY, CACHE_MISS
+                    )
+                    with self._parse_phase(self._STATUS_EFFECT_ENTITY):
+                        status_effects = self.parse_pool.status_effects(
+                            status_effects_data
+                        )
+                    self.status_effects = status_effects
+                    self._status_effects_outdated = False
+                else:
+                    self._record_cache(
+                        MEMORY_TIER, self._STATUS_EFFECT_ENTITY, CACHE_HIT
+                    )
 
         except Exception as e:
             if isinstance(e, CacheNotFoundException):
                 raise
             elif force:
                 self.log.error(
-                    f"RESPONDER: Forced doll query failed! Stopping lookup..."
+                    f"RESPONDER: Forced status effect query failed! Stopping lookup..."
                 )
                 raise
+                # Weapons page was not parseable, use cache
 
-            # Doll was not parseable, use cache
             self.log.error(
-                f"RESPONDER: Ran into an error when looking up doll information for {doll_name}"
+                f"RESPONDER: Ran into an error when looking up status effect information for {status_effect_name}"
             )
             self.log.error(f"RESPONDER: Exception:\n{e}")
             self.log.info("RESPONDER: Attempting to use cache...")
 
             # If we reach here, that definitely means something went wrong
             # we want to update our cache if we can so we do not query it in the future
-            update_cache = True
+            update = True
             use_cache = True
             updateable = False
-            raw_doll_data, update, doll_file_directory, _ = self._get_doll_data(
-                doll_name, use_cache=use_cache, force=force
+
+            raw_status_effects_data, update, updateable = self._query_wiki(
+                IOPWIKI_STATUS_EFFECTS_PAGE,
+                STATUS_EFFECTS_CACHE_KEY,
+                self._STATUS_EFFECT_ENTITY,
+                use_cache=use_cache,
+                force=force,
+            )
+            status_effects = self.status_effects
+
+        if update:
+            self.cache.store(
+                STATUS_EFFECTS_CACHE_KEY, raw_status_effects_data, updateable
+            )
+
+        return status_effects, updateable
+
+    def _find_status_effect(self, status_effect_name, status_effects, updateable):
+        """
+        Internal function to find a status effect in status_effects, the
+        loaded status effects page
+        Returns a discord embed
+        """
+
+        embed_key = (self._STATUS_EFFECT_ENTITY, status_effect_name)
+        embed = self.embeds.get(embed_key, status_effects, updateable)
+        if embed is not None:
+            self._record_cache(EMBED_TIER, self._STATUS_EFFECT_ENTITY, CACHE_HIT)
+            return embed
+
+        effect = status_effects.get_status_effect(status_effect_name)
+        if effect == None:
+            raise StatusEffectNotFoundException(
+                f"Status effect {status_effect_name} was not found!"
             )
-            raw_doll_skills, update_list, skill_directories, _ = self._get_doll_skills(
-                doll_name, use_cache=use_cache, force=force
+
+        self._record_cache(EMBED_TIER, self._STATUS_EFFECT_ENTITY, CACHE_MISS)
+        with self.tracer.span("embed"):
+            embed = self._status_effect_embed(status_effect_name, effect, updateable)
+        self.embeds.put(embed_key, status_effects, updateable, embed)
+
+        return embed
+
+    def prefetch_related(self, doll_name):
+        """
+        Function to warm the signature weapon and the status effects a doll's
+        skills mention, after the doll was looked up
+        Loads the pages they are on, from the wiki when needed, and renders
+        their embeds, so looking them up next is answered right away
+        Returns the number of embeds warmed
+        """
+
+        related = self._related.get(doll_cache_key(doll_name))
+        if related is None:
+            return 0
+
+        signature_weapon, skill_text = related
+        warmed = 0
+
+        if signature_weapon:
+            weapons, updateable = self._load_weapons(signature_weapon)
+            try:
+                self._find_weapon(signature_weapon, weapons, updateable)
+                warmed += 1
+            except WeaponNotFoundException:
+                self.log.info(
+                    f"RESPONDER: Signature weapon {signature_weapon} of "
+                    f"{doll_name} is not on the weapons page"
+                )
+
+        status_effects, updateable = self._load_status_effects(
+            f"the skills of {doll_name}"
+        )
+        for status_effect_name in status_effects.mentioned_in(skill_text):
+            self._find_status_effect(status_effect_name, status_effects, updateable)
+            warmed += 1
+
+        self.log.info(f"RESPONDER: Prefetched {warmed} embeds related to {doll_name}")
+
+        return warmed
+
+    def load_cached(self):
+        """
+        Function to parse the cached weapons and status effects pages that
+        are not loaded yet, e.g., to know their names on boot
+        Never queries the wiki, pages missing from the cache are skipped
+        """
+
+        try:
+            with self._weapons_lock:
+                if self.weapons is None:
+                    raw_weapons_data = self.cache.load(WEAPONS_CACHE_KEY)
+                    with self._parse_phase(self._WEAPON_ENTITY):
+                        weapons = self.parse_pool.weapons(
+                            get_wikitext(raw_weapons_data)
+                        )
+                    self.signatures.update_weapons(weapons)
+                    self.weapons = weapons
+        except FileNotFoundError:
+            self.log.info("RESPONDER: No cached weapons page to load")
+
+        try:
+            with self._status_effects_lock:
+                if self.status_effects is None:
+                    raw_status_effects_data = self.cache.load(STATUS_EFFECTS_CACHE_KEY)
+                    with self._parse_phase(self._STATUS_EFFECT_ENTITY):
+                        self.status_effects = self.parse_pool.status_effects(
+                            get_wikitext(raw_status_effects_data)
+                        )
+        except FileNotFoundError:
+            self.log.info("RESPONDER: No cached status effects page to load")
+
+    def invalidate(self, entity, pattern):
+        """
+        Function to mark cache entries matching pattern as stale
+        Nothing is fetched, the next lookup re-downloads what it needs
+        Returns a discord embed
+        """
+
+        entity = self._INVALIDATE_ENTITIES.get(entity.lower())
+        if entity is None:
+            raise InvalidEntityException(
+                f"Entity must be one of {', '.join(self._INVALIDATE_ENTITIES)}!"
             )
 
-            doll_data, doll_skills = self._process_raw_doll_info(
-                raw_doll_data, raw_doll_skills
+        pattern = pattern.lower()
+        matched_names = []
+        stale_keys = []
+        match entity:
+            case self._DOLL_ENTITY:
+                for doll_key in self.cache.doll_keys():
+                    if fnmatch(doll_key, pattern):
+                        matched_names.append(doll_key)
+                        stale_keys += self.cache.group(doll_key)
+            case self._WEAPON_ENTITY:
+                # Every weapon lives on the weapons page
+                if self.weapons is not None:
+                    matched_names = fnmatch_filter(self.weapons.weapons, pattern)
+
+                if self.weapons is None or matched_names:
+                    stale_keys.append(WEAPONS_CACHE_KEY)
+            case self._STATUS_EFFECT_ENTITY:
+                # Every status effect lives on the status effects page
+                if self.status_effects is not None:
+                    matched_names = [
+                        name
+                        for name in self.status_effects.status_effects
+                        if fnmatch(name.lower(), pattern)
+                    ]
+
+                if self.status_effects is None or matched_names:
+                    stale_keys.append(STATUS_EFFECTS_CACHE_KEY)
+
+        marked_keys = self.cache.mark_stale(stale_keys)
+        self.log.info(
+            f"RESPONDER: Invalidated {len(marked_keys)} cache entries for {entity} {pattern}"
+        )
+
+        embed = Embed(
+            title="Cache Invalidated",
+            description=f"Lenna marked {len(marked_keys)} cache entries as stale!",
+            color=Color.orange(),
+        )
+
+        if matched_names:
+            embed.add_field(
+                name="Matched",
+                value=", ".join(matched_names[: self._INVALIDATE_LIST_LIMIT]),
+                inline=False,
             )
 
-            doll = Doll(doll_data, doll_skills)
+        return embed
 
-        if update_cache:
-            self._update(raw_doll_data, doll_file_directory, updateable)
-            for raw_doll_skill, skill_directory in zip(
-                raw_doll_skills, skill_directories
-            ):
-                self._update(raw_doll_skill, skill_directory, updateable)
+    def get_stats_embed(self):
+        """
+        Function to prepare an embed summarizing Lenna's metrics
+        Returns a discord embed
+        """
+
+        embed = Embed(
+            title="Lenna Stats",
+            description="Latencies are p50/p95/p99 over recent requests",
+            color=Color.orange(),
+        )
+
+        command_lines = []
+        for labels, histogram in sorted(
+            self.metrics.histograms(COMMAND_SECONDS).items()
+        ):
+            command = dict(labels)["command"]
+            command_lines.append(
+                f"`{command}` x{histogram[0]}: {self._format_quantiles(histogram)}"
+            )
+
+        cache_results = {}
+        for labels, count in self.metrics.counters(CACHE_REQUESTS).items():
+            labels = dict(labels)
+            results = cache_results.setdefault((labels["tier"], labels["entity"]), {})
+            results[labels["result"]] = count
+
+        cache_lines = []
+        for (tier, entity), results in sorted(cache_results.items()):
+            total = sum(results.values())
+            hits = results.get(CACHE_HIT, 0)
+            cache_lines.append(
+                f"{tier} {entity}: {hits}/{total} hits ({hits / total:.0%}), "
+                f"{results.get(CACHE_MISS, 0)} miss, {results.get(CACHE_STALE, 0)} stale"
+            )
+
+        prefetches = {
+            dict(labels)["result"]: count
+            for labels, count in self.metrics.counters(PREFETCHES).items()
+        }
+        if self.signatures.dolls():
+            cache_lines.append(
+                f"signature weapons: {len(self.signatures)}/"
+                f"{self.signatures.dolls()} dolls joined"
+            )
+
+        if prefetches:
+            cache_lines.append(
+                f"prefetch: {prefetches.get(PREFETCH_DONE, 0)} done, "
+                f"{prefetches.get(PREFETCH_FAILED, 0)} failed, "
+                f"{prefetches.get(PREFETCH_DROPPED, 0)} dropped"
+            )
+
+        wiki_lines = []
+        wiki_bytes = self.metrics.counters(WIKI_RESPONSE_BYTES)
+        wiki_latencies = self.metrics.histograms(WIKI_REQUEST_SECONDS)
+        for labels, count in sorted(self.metrics.counters(WIKI_REQUESTS).items()):
+            labels = dict(labels)
+            wiki_lines.append(f"{labels['action']} {labels['status']}: {count}")
+        for labels, histogram in sorted(wiki_latencies.items()):
+            action_bytes = wiki_bytes.get(labels, 0)
+            wiki_lines.append(
+                f"{dict(labels)['action']}: {action_bytes / 1024:.0f} KiB, "
+                f"{self._format_quantiles(histogram)}"
+            )
+
+        parse_lines = []
+        for labels, histogram in sorted(self.metrics.histograms(PARSE_SECONDS).items()):
+            parse_lines.append(
+                f"{dict(labels)['entity']}: {self._format_quantiles(histogram)}"
+            )
+
+        loop_lines = []
+        loop_lag = self.metrics.histograms(LOOP_LAG_SECONDS).get(())
+        if loop_lag is not None:
+            stalls = sum(self.metrics.counters(LOOP_STALLS).values())
+            loop_lines.append(
+                f"lag: {self._format_quantiles(loop_lag)}, {stalls} stalls"
+            )
+
+        lane_lines = []
+        for labels, histogram in sorted(
+            self.metrics.histograms(LANE_WAIT_SECONDS).items()
+        ):
+            lane = dict(labels)["lane"]
+            in_flight = self.metrics.gauge(LANE_IN_FLIGHT, lane=lane) or 0
+            lane_lines.append(
+                f"{lane}: wait {self._format_quantiles(histogram)}, {in_flight} running"
+            )
+
+        lookups = self.metrics.gauge(LOOKUPS_IN_FLIGHT)
+        if lookups is not None:
+            rejections = sum(self.metrics.counters(LOOKUP_REJECTIONS).values())
+            lane_lines.append(
+                f"lookups: {lookups} running, "
+                f"{self.metrics.gauge(LOOKUP_QUEUE_DEPTH) or 0} queued, "
+                f"{rejections} turned away"
+            )
+
+        throttled = sum(self.metrics.counters(LOOKUPS_THROTTLED).values())
+        collapsed = sum(self.metrics.counters(LOOKUPS_COLLAPSED).values())
+        if throttled or collapsed:
+            lane_lines.append(
+                f"cooldowns: {throttled} throttled, {collapsed} repeats collapsed"
+            )
+
+        for name, lines in (
+            ("Commands", command_lines),
+            ("Cache", cache_lines),
+            ("Wiki", wiki_lines),
+            ("Parsing", parse_lines),
+            ("Event Loop", loop_lines),
+            ("Lanes", lane_lines),
+        ):
+            value = self._NEWLINE_STRING.join(lines) or "No data yet"
+            embed.add_field(
+                name=name,
+                value=value[: self._EMBED_FIELD_LIMIT],
+                inline=False,
+            )
+
+        return embed
+
+    def _format_quantiles(self, histogram):
+        """
+        Internal function to format a histogram's p50/p95/p99 in milliseconds
+        """
+
+        _, _, p50, p95, p99 = histogram
+
+        return f"{p50 * 1000:.0f}/{p95 * 1000:.0f}/{p99 * 1000:.0f}ms"
+
+    def _doll_embed(self, doll, updateable, with_doll, with_keys, signature=None):
+        """
+        Internal function to build a doll embed
+        signature is the doll's joined signature weapon, when it is known
+        """
 
         embed = Embed(
             title=doll.full_name,
@@ -347,7 +1037,13 @@ class Responder:
                 inline=False,
             )
 
-            if doll.signature_weapon != None:
+            if signature is not None:
+                embed.add_field(
+                    name="Signature Weapon",
+                    value=self._signature_weapon_value(signature),
+                    inline=False,
+                )
+            elif doll.signature_weapon != None:
                 embed.add_field(
                     name="Signature Weapon",
                     value=doll.signature_weapon,
@@ -413,67 +1109,25 @@ class Responder:
 
         return embed
 
-    def get_weapon(self, weapon_name, use_cache=False, force=False):
+    def _signature_weapon_value(self, signature):
         """
-        Function to fetch weapon information
-        Returns a discord embed
+        Internal function to describe a signature weapon in a doll embed
         """
 
-        updateable = True
-        weapon_name = SPECIAL_WEAPON_NAMES.get(weapon_name, weapon_name)
-        weapons_cache_directory = f"{self._CACHE_DIRECTORY}{self._WEAPONS_CACHE_FILE}"
-        weapons_query_url = (
-            f"{IOPWIKI_API_URL}{IOPWIKI_DATA_FETCH_PARAM}{IOPWIKI_WEAPONS_PAGE}"
-        )
-        try:
-            raw_weapons_data, update, updateable = self._query_wiki(
-                weapons_query_url,
-                IOPWIKI_WEAPONS_PAGE,
-                weapons_cache_directory,
-                use_cache=use_cache,
-                force=force,
-            )
-
-            weapons_data = get_wikitext(raw_weapons_data)
-            if update or self.weapons == None:
-                self.weapons = Weapons(weapons_data)
-
-        except Exception as e:
-            if isinstance(e, CacheNotFoundException):
-                raise
-            elif force:
-                self.log.error(
-                    f"RESPONDER: Forced weapon query failed! Stopping lookup..."
-                )
-                raise
-
-            # Weapons page was not parseable, use cache
-            self.log.error(
-                f"RESPONDER: Ran into an error when looking up weapon information for {weapon_name}"
-            )
-            self.log.error(f"RESPONDER: Exception:\n{e}")
-            self.log.info("RESPONDER: Attempting to use cache...")
-
-            # If we reach here, that definitely means something went wrong
-            # we want to update our cache if we can so we do not query it in the future
-            update = True
-            use_cache = True
-            updateable = False
-
-            raw_weapons_data, _, _ = self._query_wiki(
-                weapons_query_url,
-                IOPWIKI_WEAPONS_PAGE,
-                weapons_cache_directory,
-                use_cache=use_cache,
-                force=force,
+        value = self._NEWLINE_STRING.join(
+            (
+                f"{signature.name} ({signature.grade} {signature.type})",
+                f"Skill: {signature.skill}",
+                f"Trait: {signature.trait}",
             )
+        )
 
-        if update:
-            self._update(raw_weapons_data, weapons_cache_directory, updateable)
+        return value[: self._EMBED_FIELD_LIMIT]
 
-        weapon = self.weapons.get_weapon(weapon_name)
-        if weapon == None:
-            raise WeaponNotFoundException(f"Weapon {weapon_name} was not found!")
+    def _weapon_embed(self, weapon, updateable):
+        """
+        Internal function to build a weapon embed
+        """
 
         embed = Embed(
             title=weapon.name,
@@ -504,74 +1158,11 @@ class Responder:
 
         return embed
 
-    def get_status_effect(self, status_effect_name, use_cache=False, force=False):
+    def _status_effect_embed(self, status_effect_name, effect, updateable):
         """
-        Function to fetch status effect
-        Returns a discord embed
+        Internal function to build a status effect embed
         """
 
-        updateable = True
-        status_effects_cache_directory = (
-            f"{self._CACHE_DIRECTORY}{self._STATUS_EFFECTS_CACHE_FILE}"
-        )
-        status_effects_query_url = (
-            f"{IOPWIKI_API_URL}{IOPWIKI_DATA_FETCH_PARAM}{IOPWIKI_STATUS_EFFECTS_PAGE}"
-        )
-
-        try:
-            raw_status_effects_data, update, updateable = self._query_wiki(
-                status_effects_query_url,
-                IOPWIKI_WEAPONS_PAGE,
-                status_effects_cache_directory,
-                use_cache=use_cache,
-                force=force,
-            )
-
-            status_effects_data = get_wikitext(raw_status_effects_data)
-            if update or self.status_effects == None:
-                self.status_effects = StatusEffects(status_effects_data)
-
-        except Exception as e:
-            if isinstance(e, CacheNotFoundException):
-                raise
-            elif force:
-                self.log.error(
-                    f"RESPONDER: Forced status effect query failed! Stopping lookup..."
-                )
-                raise
-                # Weapons page was not parseable, use cache
-
-            self.log.error(
-                f"RESPONDER: Ran into an error when looking up status effect information for {status_effect_name}"
-            )
-            self.log.error(f"RESPONDER: Exception:\n{e}")
-            self.log.info("RESPONDER: Attempting to use cache...")
-
-            # If we reach here, that definitely means something went wrong
-            # we want to update our cache if we can so we do not query it in the future
-            update = True
-            use_cache = True
-            updateable = False
-
-            raw_status_effects_data, update, updateable = self._query_wiki(
-                status_effects_query_url,
-                IOPWIKI_WEAPONS_PAGE,
-                status_effects_cache_directory,
-                use_cache=use_cache,
-                force=force,
-            )
-
-        if update:
-            self._update(
-                raw_status_effects_data, status_effects_cache_directory, updateable
-            )
-
-        effect = self.status_effects.get_status_effect(status_effect_name)
-        if effect == None:
-            raise StatusEffectNotFoundException(
-                f"Status effect {status_effect_name} was not found!"
-            )
-
         embed = Embed(
             title=status_effect_name,
             description=effect,
@@ -589,6 +1180,185 @@ class Responder:
 
         return embed
 
+    def _remember_related(self, doll_name, doll):
+        """
+        Internal function to remember what a doll's users likely ask about next,
+        and to join the doll to its signature weapon
+        """
+
+        doll_key = doll_cache_key(doll_name)
+        signature_weapon = (doll.signature_weapon or "").strip().lower()
+        skill_text = self._NEWLINE_STRING.join(
+            text
+            for skill in doll.skills
+            for text in (skill.name, skill.desc, *(skill.extra_effects or ()))
+        )
+
+        self._related[doll_key] = (signature_weapon, skill_text)
+        self.signatures.update_doll(
+            doll_key,
+            SPECIAL_WEAPON_NAMES.get(signature_weapon, signature_weapon) or None,
+        )
+
+    def _load_doll(self, doll_name, use_cache=False, force=False):
+        """
+        Internal function to load the doll page and skill pages of a doll
+        Returns ((doll data, doll skills) to parse, (doll key, raw doll data,
+        skill keys, raw doll skills) to cache, whether to update the cache,
+        whether the pages are updateable)
+        """
+
+        raw_doll_data, update, doll_key, doll_data_updateable = self._get_doll_data(
+            doll_name, use_cache=use_cache, force=force
+        )
+        raw_doll_skills, update_list, skill_keys, skill_data_updateable = (
+            self._get_doll_skills(doll_name, use_cache=use_cache, force=force)
+        )
+
+        updateable = (
+            False if not doll_data_updateable or not skill_data_updateable else True
+        )
+
+        doll_data, doll_skills = self._process_raw_doll_info(
+            raw_doll_data, raw_doll_skills
+        )
+
+        # If any response is True, we update
+        update_cache = update or any(update_list)
+
+        return (
+            (doll_data, doll_skills),
+            (doll_key, raw_doll_data, skill_keys, raw_doll_skills),
+            update_cache,
+            updateable,
+        )
+
+    def _finish_doll(self, doll_name, doll, loaded, with_doll, with_keys):
+        """
+        Internal function to cache the pages of a parsed doll and build its
+        embed
+        loaded is what _load_doll returned for the doll
+        """
+
+        _, raw_pages, update_cache, updateable = loaded
+        doll_key, raw_doll_data, skill_keys, raw_doll_skills = raw_pages
+
+        self._remember_related(doll_name, doll)
+
+        if update_cache:
+            with self.tracer.span("cache_write"):
+                self.cache.store(doll_key, raw_doll_data, updateable)
+                for raw_doll_skill, skill_key in zip(raw_doll_skills, skill_keys):
+                    self.cache.store(skill_key, raw_doll_skill, updateable)
+
+        with self.tracer.span("embed"):
+            return self._doll_embed(
+                doll,
+                updateable,
+                with_doll,
+                with_keys,
+                signature=self.signatures.get(doll_cache_key(doll_name)),
+            )
+
+    def _doll_pages(self, doll_name):
+        """
+        Internal function to list a doll's (page title, cache key) pairs
+        """
+
+        pages = [(doll_page_title(doll_name), doll_cache_key(doll_name))]
+        for i in range(SKILL_START_RANGE, SKILL_END_RANGE):
+            pages.append(
+                (skill_page_title(doll_name, i), skill_cache_key(doll_name, i))
+            )
+
+        return pages
+
+    def _refresh_stale(self, pages):
+        """
+        Internal function to re-download the stale entries among
+        (page title, cache key) pairs in one batched request
+        On failure, the stale entries are left to the normal lookup path
+        """
+
+        self._fetch_pages(
+            [
+                (page_title, cache_key)
+                for page_title, cache_key in pages
+                if self.cache.is_stale(cache_key)
+            ]
+        )
+
+    def _fetch_pages(self, pages):
+        """
+        Internal function to download (page title, cache key) pairs in one
+        batched request and cache them
+        On failure, the pages are left to the normal lookup path
+        Returns the downloaded payloads by page title, None for missing pages
+        """
+
+        if not pages:
+            return {}
+
+        try:
+            payloads = self.wiki.fetch_pages([page_title for page_title, _ in pages])
+        except Exception as e:
+            self.log.error(f"RESPONDER: Failed to fetch {len(pages)} pages")
+            self.log.error(f"RESPONDER: Exception:\n{e}")
+            return {}
+
+        for page_title, cache_key in pages:
+            payload = payloads.get(page_title)
+            if payload is None:
+                continue
+
+            self.cache.store(cache_key, payload, True)
+
+            # Shared indexes are rebuilt from the refreshed page on this lookup,
+            # lookups still holding the old ones finish with them
+            if cache_key == WEAPONS_CACHE_KEY:
+                with self._weapons_lock:
+                    self._weapons_outdated = True
+            elif cache_key == STATUS_EFFECTS_CACHE_KEY:
+                with self._status_effects_lock:
+                    self._status_effects_outdated = True
+
+        return payloads
+
+    def _needs_fetch(self, cache_key):
+        """
+        Internal function to check whether a lookup of an entry would query
+        the wiki, because it is missing, stale or fetched over a day ago
+        """
+
+        if self.cache.is_stale(cache_key):
+            return True
+
+        try:
+            cache = self.cache.load(cache_key)
+        except FileNotFoundError:
+            return True
+
+        if not cache[self._UPDATEABLE_STRING]:
+            return False
+
+        fetch_time = datetime.strptime(cache[self._FETCHED_STRING], self._DATE_FORMAT)
+        days_since = datetime.now(timezone.utc) - fetch_time.replace(
+            tzinfo=timezone.utc
+        )
+
+        return days_since.days >= 1
+
+    def _batch_result(self, lookup, *args, **kwargs):
+        """
+        Internal function to run one lookup of a batch, returning the
+        exception it failed with instead of raising it
+        """
+
+        try:
+            return lookup(*args, **kwargs)
+        except Exception as e:
+            return e
+
     def _load_media(self):
         """
         Internal function to load the media dictionary
@@ -620,22 +1390,20 @@ class Responder:
         Returns:
         raw_doll_data: data of raw doll data in JSON format
         update: whether or not the doll data cache should be updated
-        doll_file_directory: location of where the doll cache should be located
+        doll_key: cache key the doll data should be stored under
         updateable: whether or not the skill data should be updated
         """
 
-        doll_file_directory = f"{self._CACHE_DIRECTORY}{doll_name.lower()}.json"
-
-        doll_name = SPECIAL_DOLL_NAMES.get(doll_name, doll_name)
-        query_url = f"{IOPWIKI_API_URL}{IOPWIKI_DATA_FETCH_PARAM}{doll_name}"
+        doll_key = doll_cache_key(doll_name)
+        doll_page = doll_page_title(doll_name)
 
         raw_doll_data, update, updateable = self._query_wiki(
-            query_url, doll_name, doll_file_directory, use_cache=use_cache, force=force
+            doll_page, doll_key, self._DOLL_ENTITY, use_cache=use_cache, force=force
         )
         if raw_doll_data == None:
-            raise DollNotFoundException(f"Doll {doll_name} was not found!")
+            raise DollNotFoundException(f"Doll {doll_page} was not found!")
 
-        return raw_doll_data, update, doll_file_directory, updateable
+        return raw_doll_data, update, doll_key, updateable
 
     def _get_doll_skills(self, doll_name, use_cache=False, force=False):
         """
@@ -644,28 +1412,22 @@ class Responder:
         Returns:
         skill_list: list of doll raw doll skills in JSON format
         update_list: list of whether or not the respective skills should be updated
-        skill_directories: location of where the skill_data cache should be located
+        skill_keys: cache keys the skill data should be stored under
         updateable: whether or not the skill data should be updated
         """
 
         raw_skill_list = []
         update_list = []
-        skill_directories = []
-        query_doll_name = SPECIAL_DOLL_NAMES.get(doll_name, doll_name)
+        skill_keys = []
         updateable = True
-        for i in range(self._SKILL_START_RANGE, self._SKILL_END_RANGE):
-            skill_index = "" if i == 1 else i
-
-            skill_page = f"{query_doll_name}/skill{skill_index}data"
-            skill_query_url = f"{IOPWIKI_API_URL}{IOPWIKI_DATA_FETCH_PARAM}{skill_page}"
-            skill_file_directory = (
-                f"{self._CACHE_DIRECTORY}{doll_name.lower()}_skill{skill_index}.json"
-            )
+        for i in range(SKILL_START_RANGE, SKILL_END_RANGE):
+            skill_page = skill_page_title(doll_name, i)
+            skill_key = skill_cache_key(doll_name, i)
 
             raw_skill_data, update, json_updateable = self._query_wiki(
-                skill_query_url,
                 skill_page,
-                skill_file_directory,
+                skill_key,
+                self._DOLL_SKILL_ENTITY,
                 use_cache=use_cache,
                 force=force,
             )
@@ -676,142 +1438,111 @@ class Responder:
 
             raw_skill_list.append(raw_skill_data)
             update_list.append(update)
-            skill_directories.append(skill_file_directory)
+            skill_keys.append(skill_key)
 
-        return raw_skill_list, update_list, skill_directories, updateable
+        return raw_skill_list, update_list, skill_keys, updateable
 
     def _get_headers(self):
         """
         Prepares the query headers
         """
 
-        headers_file_dir = f"{self._DATA_DIRECTORY}/{self._HEADERS_FILE}"
-
-        with open(headers_file_dir, "r") as headers_file:
-            return dict(json.load(headers_file))
+        return load_headers(f"{self._DATA_DIRECTORY}/{self._HEADERS_FILE}")
 
-    def _query_page_last_edit(self, page_title):
-        """
-        Internal function to query the wiki for page information
-        Will not work as intended if page_title contains multiple titles
-
-        Returns the last edit ("touched" field) of the page
-        """
-
-        query_url = f"{IOPWIKI_API_URL}{IOPWIKI_INFO_FETCH_PARAM}{page_title}"
-        query_json = self._query(query_url)
-
-        pages = query_json[self._QUERY_STRING][self._PAGES_STRING]
-        page_id = None
-
-        # We use for each here, but we only expect 1 page to be returned
-        for page in pages:
-            page_id = page
-
-        return datetime.strptime(
-            pages[page_id][self._TOUCHED_STRING], self._DATE_FORMAT
-        )
-
-    def _query_wiki(
-        self, query_url, page_title, cache_directory, use_cache=False, force=False
-    ):
+    def _query_wiki(self, page_title, cache_key, entity, use_cache=False, force=False):
         """
         Internal function to query the wiki and return the wikitext
         """
 
+        # Cache result of this lookup, for metrics
+        result = CACHE_BYPASS
         if not force:
             try:
-                cache = None
-                with open(cache_directory, "r", encoding="utf8") as cache_file:
-                    cache = json.load(cache_file)
-                    updateable = cache[self._UPDATEABLE_STRING]
-                    fetch_time = datetime.strptime(
-                        cache[self._FETCHED_STRING], self._DATE_FORMAT
-                    )
-                    days_since = datetime.now(timezone.utc) - fetch_time.replace(
-                        tzinfo=timezone.utc
-                    )
+                with self.tracer.span("cache_read", page=page_title):
+                    cache = self.cache.load(cache_key)
+                updateable = cache[self._UPDATEABLE_STRING]
+                fetch_time = datetime.strptime(
+                    cache[self._FETCHED_STRING], self._DATE_FORMAT
+                )
+                days_since = datetime.now(timezone.utc) - fetch_time.replace(
+                    tzinfo=timezone.utc
+                )
 
-                    if not updateable or use_cache:
-                        self.log.warning(
-                            f"RESPONDER: Force use of cache for {page_title}!"
+                if not updateable or use_cache:
+                    self.log.warning(f"RESPONDER: Force use of cache for {page_title}!")
+                    self._record_cache(DISK_TIER, entity, CACHE_HIT)
+                    return cache, False if not updateable else True, updateable
+                elif self.cache.is_stale(cache_key):
+                    self.log.info(f"RESPONDER: Cache for {page_title} is stale!")
+                    result = CACHE_STALE
+                elif days_since.days >= 1:
+                    with self.tracer.span("wiki_info", page=page_title):
+                        page_info = self.wiki.page_info(page_title)
+                    cached_revid = cache.get(PARSE_STRING, {}).get(REVID_STRING)
+                    result = CACHE_STALE
+
+                    # Prefer the revision ID, fall back to the touched time for older entries
+                    if cached_revid is not None:
+                        unchanged = cached_revid == page_info.get(
+                            self._LAST_REVID_STRING
                         )
-                        return cache, False if not updateable else True, updateable
-                    elif days_since.days >= 1:
-                        last_edit = self._query_page_last_edit(page_title)
-
-                        if fetch_time > last_edit:
-                            return cache, False, updateable
                     else:
+                        last_edit = datetime.strptime(
+                            page_info[self._TOUCHED_STRING], self._DATE_FORMAT
+                        )
+                        unchanged = fetch_time > last_edit
+
+                    if unchanged:
+                        # Checked, so it is good for another day
                         self.log.info(
-                            f"RESPONDER: Data fetched less than a day ago, using cache."
+                            f"RESPONDER: {page_title} is unchanged, renewing cache."
                         )
+                        with self.tracer.span("cache_write"):
+                            self.cache.store(cache_key, cache, updateable)
+                        self._record_cache(DISK_TIER, entity, CACHE_HIT)
                         return cache, False, updateable
+                else:
+                    self.log.info(
+                        "RESPONDER: Data fetched less than a day ago, using cache.",
+                        extra=SAMPLED,
+                    )
+                    self._record_cache(DISK_TIER, entity, CACHE_HIT)
+                    return cache, False, updateable
 
             except FileNotFoundError:
                 self.log.info(f"RESPONDER: Unable to find cache for {page_title}!")
+                result = CACHE_MISS
 
                 if use_cache:
                     self.log.error(
                         f"RESPONDER: use_cache is True, but there is no cache!"
                     )
+                    self._record_cache(DISK_TIER, entity, result)
                     raise CacheNotFoundException(
-                        f"Cache lookup of {cache_directory} not found!"
+                        f"Cache lookup of {self.cache.path(cache_key)} not found!"
                     )
 
                 self.log.info("RESPONDER: Allowed to query!")
 
-        response_json = self._query(query_url)
+        self._record_cache(DISK_TIER, entity, result)
+        with self.tracer.span("wiki_parse", page=page_title):
+            response_json = self.wiki.parse_page(page_title)
 
         return response_json, True, True
 
-    def _query(self, query_url):
+    @contextmanager
+    def _parse_phase(self, entity):
         """
-        Internal function to send a query
+        Internal function to time a parse, both as a metric and a trace span
         """
 
-        self.log.info(f"RESPONDER: Querying {query_url}")
+        with self.tracer.span("parse", entity=entity):
+            with self.metrics.timer(PARSE_SECONDS, entity=entity):
+                yield
 
-        req = requests.Request("GET", query_url)
-        prepared_req = self.session.prepare_request(req)
-
-        response = self.session.send(prepared_req)
-        content = json.loads(response.content)
-
-        reason = None
-        if response.status_code != self._GOOD_RESPONSE_CODE:
-            reason = response.reason
-        elif self._ERR_STRING in content:
-            reason = content[self._ERR_STRING]["info"]
-
-        if reason != None:
-            self.log.error(f"RESPONDER: Failed to query {query_url}")
-            self.log.error(f"Reason: {reason}")
-
-            raise QueryFailedException(reason)
-
-        return content
-
-    def _write(self, payload, filename):
-        """
-        Internal function to write payload into a page
-
-        Expects a JSON payload
-        """
-
-        with open(filename, "w", encoding="utf8") as f:
-            json.dump(payload, f, ensure_ascii=False, indent=4)
-
-    def _update(self, file_content, file_directory, updateable):
+    def _record_cache(self, tier, entity, result):
         """
-        Internal function to update the local cache
+        Internal function to count a cache hit, miss, stale entry or bypass
         """
 
-        self.log.info(f"RESPONDER: Updating {file_directory}.")
-
-        file_content[self._FETCHED_STRING] = datetime.now(timezone.utc).strftime(
-            self._DATE_FORMAT
-        )
-        file_content[self._UPDATEABLE_STRING] = updateable
-
-        self._write(file_content, file_directory)
+        self.metrics.inc(CACHE_REQUESTS, tier=tier, entity=entity, result=result)
@@ -0,0 +1,207 @@
+"""
+CommandScheduler class
+
+Runs Lenna's commands in lanes, each with its own concurrency limit, so cheap
+commands never queue behind slow ones. Instant commands like !echo run on the
+event loop, lookups answered from the cache and lookups that have to query
+the wiki each run in their own thread pool. A burst of cold !doll lookups
+fills the network lane and leaves the other two alone
+
+The lane limits are also the cap on lookups running at once. Lookups waiting
+for a slot sit in a bounded queue per lane, once a lane's queue is full its
+new lookups are turned away right away instead of piling up, and cold lookups
+queued on the network lane never hold up the cache lane
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import os
+import time
+
+from metrics import (
+    LANE_IN_FLIGHT,
+    LANE_WAIT_SECONDS,
+    LOOKUP_QUEUE_DEPTH,
+    LOOKUP_REJECTIONS,
+    LOOKUPS_IN_FLIGHT,
+    Metrics,
+)
+from profiler import current_profiler
+
+# Lanes
+LANE_INSTANT = "instant"
+LANE_CACHE = "cache"
+LANE_NETWORK = "network"
+
+# Commands running at once per lane, e.g., LENNA_NETWORK_LANE_LIMIT=4
+LANE_LIMIT_ENV = "LENNA_{lane}_LANE_LIMIT"
+DEFAULT_LANE_LIMITS = {
+    LANE_INSTANT: 64,
+    LANE_CACHE: 8,
+    LANE_NETWORK: 4,
+}
+
+# Lanes that run off the event loop, in their own threads, every command in
+# them is a lookup
+THREADED_LANES = (LANE_CACHE, LANE_NETWORK)
+
+# Admission, lookups of each lane waiting for a slot
+LOOKUP_QUEUE_SIZE_ENV = "LENNA_LOOKUP_QUEUE_SIZE"
+DEFAULT_LOOKUP_QUEUE_SIZE = 32
+
+
+class BusyException(Exception):
+    """
+    Exception for when a lookup is turned away because the queue is full
+    """
+
+    def __init__(self, message):
+        self.message = f"BusyException: {message}"
+        super().__init__(self.message)
+
+
+class CommandScheduler:
+    """
+    CommandScheduler class definition
+    """
+
+    def __init__(self, log, metrics=None, limits=None, queue_size=None):
+        self.log = log
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.queue_size = (
+            queue_size
+            if queue_size is not None
+            else int(os.getenv(LOOKUP_QUEUE_SIZE_ENV, DEFAULT_LOOKUP_QUEUE_SIZE))
+        )
+
+        self.limits = {}
+        for lane, default_limit in DEFAULT_LANE_LIMITS.items():
+            limit = (limits or {}).get(lane)
+            if limit is None:
+                limit = int(
+                    os.getenv(LANE_LIMIT_ENV.format(lane=lane.upper()), default_limit)
+                )
+            self.limits[lane] = limit
+
+        self._semaphores = {
+            lane: asyncio.Semaphore(limit) for lane, limit in self.limits.items()
+        }
+        self._in_flight = {lane: 0 for lane in self.limits}
+
+        self._lookups = 0
+        self._queued = {lane: 0 for lane in THREADED_LANES}
+        self._executors = {
+            lane: ThreadPoolExecutor(
+                max_workers=self.limits[lane], thread_name_prefix=f"lenna-{lane}"
+            )
+            for lane in THREADED_LANES
+        }
+
+    def close(self):
+        for executor in self._executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    @asynccontextmanager
+    async def slot(self, lane):
+        """
+        Waits for a free slot in lane and holds it for the enclosed block
+        """
+
+        start_time = time.perf_counter()
+        async with self._semaphores[lane]:
+            self.metrics.observe(
+                LANE_WAIT_SECONDS, time.perf_counter() - start_time, lane=lane
+            )
+
+            self._in_flight[lane] += 1
+            self.metrics.set_gauge(LANE_IN_FLIGHT, self._in_flight[lane], lane=lane)
+            try:
+                yield
+            finally:
+                self._in_flight[lane] -= 1
+                self.metrics.set_gauge(LANE_IN_FLIGHT, self._in_flight[lane], lane=lane)
+
+    @asynccontextmanager
+    async def admit(self, lane):
+        """
+        Waits for a free slot in lane and holds it for the enclosed block,
+        counting the lookup as running
+        Raises BusyException when every slot is taken and the queue of the
+        lane is full
+        """
+
+        if self._semaphores[lane].locked() and self._queued[lane] >= self.queue_size:
+            self.metrics.inc(LOOKUP_REJECTIONS, lane=lane)
+            self.log.warning(
+                f"SCHEDULER: Turned away a {lane} lookup, "
+                f"{self._queued[lane]} queued"
+            )
+            raise BusyException(f"{self._queued[lane]} lookups are already queued!")
+
+        self._set_queued(lane, self._queued[lane] + 1)
+        queued = True
+        try:
+            async with self.slot(lane):
+                self._set_queued(lane, self._queued[lane] - 1)
+                queued = False
+
+                self._lookups += 1
+                self.metrics.set_gauge(LOOKUPS_IN_FLIGHT, self._lookups)
+                try:
+                    yield
+                finally:
+                    self._lookups -= 1
+                    self.metrics.set_gauge(LOOKUPS_IN_FLIGHT, self._lookups)
+        finally:
+            # Cancelled or failed while still waiting for a slot
+            if queued:
+                self._set_queued(lane, self._queued[lane] - 1)
+
+    def busy(self):
+        """
+        Checks whether lookups are waiting for a place or a threaded lane, to
+        hold off background work
+        Safe to call from any thread
+        """
+
+        return any(self._queued.values()) or any(
+            self._semaphores[lane].locked() for lane in THREADED_LANES
+        )
+
+    async def run(self, lane, func, *args, **kwargs):
+        """
+        Runs func in lane once it has a free slot
+        Threaded lanes run func in their pool, with the caller's context so
+        trace spans keep nesting and profiling follows it, after admitting it
+        as a lookup; other lanes call it on the event loop
+        """
+
+        executor = self._executors.get(lane)
+        if executor is None:
+            async with self.slot(lane):
+                return func(*args, **kwargs)
+
+        async with self.admit(lane):
+            context = contextvars.copy_context()
+            func = partial(context.run, func, *args, **kwargs)
+
+            profiler = current_profiler()
+            if profiler is None:
+                return await asyncio.get_running_loop().run_in_executor(executor, func)
+
+            # A profiled command is profiled in the lane thread it runs in
+            with profiler.paused():
+                return await asyncio.get_running_loop().run_in_executor(
+                    executor, partial(profiler.run, func)
+                )
+
+    def _set_queued(self, lane, queued):
+        """
+        Internal function to track the lookups of a lane waiting for a slot
+        """
+
+        self._queued[lane] = queued
+        self.metrics.set_gauge(LOOKUP_QUEUE_DEPTH, sum(self._queued.values()))
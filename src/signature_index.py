@@ -0,0 +1,157 @@
+"""
+SignatureIndex class
+
+Precomputed join of dolls to their signature weapons, so a doll embed can
+show the weapon's grade, skill and trait without looking the weapon up. Dolls
+are joined as they are parsed and weapons as the weapons page is, and each
+side only rejoins what it touched: a doll its own weapon, a weapons page edit
+the weapons in the tables that were re-parsed
+"""
+
+import threading
+
+
+class SignatureWeapon:
+    """
+    Internal representation of a signature weapon as shown in a doll embed
+    The fields are simplified when it is joined, never on a lookup
+    """
+
+    __slots__ = ("name", "type", "grade", "skill", "trait")
+
+    def __init__(self, weapon):
+        self.name = weapon.name
+        self.type = weapon.type
+        self.grade = weapon.grade
+        self.skill = weapon.skill
+        self.trait = weapon.trait
+
+    def __str__(self):
+        return f"SignatureWeapon(Name: {self.name}, Type: {self.type}, Grade: {self.grade}, Skill: {self.skill}, Trait: {self.trait})"
+
+
+class SignatureIndex:
+    """
+    SignatureIndex class definition
+
+    Lookup threads update both sides, so updates take the lock, while reads
+    are single dictionary lookups and do not
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+        # The Weapons the dolls were last joined against
+        self._weapons = None
+
+        # Doll key to its signature weapon key, and back
+        self._doll_weapons = {}
+        self._weapon_dolls = {}
+
+        # Doll key to its joined SignatureWeapon
+        self._joined = {}
+
+    def __len__(self):
+        return len(self._joined)
+
+    def get(self, doll_key):
+        """
+        Returns the joined signature weapon of a doll, or None when the doll
+        has none, it is not on the loaded weapons page or no page is loaded
+        """
+
+        return self._joined.get(doll_key)
+
+    def dolls(self):
+        """
+        Returns how many dolls with a signature weapon are known
+        """
+
+        return len(self._doll_weapons)
+
+    def update_doll(self, doll_key, weapon_key):
+        """
+        Joins a doll that was just parsed to its signature weapon
+        weapon_key is the weapons page key of the weapon, None when it has none
+        """
+
+        with self._lock:
+            # The weapons side keeps the join of an unchanged doll up to date
+            previous_key = self._doll_weapons.get(doll_key)
+            if previous_key == weapon_key:
+                return
+
+            if previous_key is not None:
+                dolls = self._weapon_dolls[previous_key]
+                dolls.discard(doll_key)
+                if not dolls:
+                    del self._weapon_dolls[previous_key]
+
+            if weapon_key is None:
+                self._doll_weapons.pop(doll_key, None)
+                self._joined.pop(doll_key, None)
+                return
+
+            self._doll_weapons[doll_key] = weapon_key
+            self._weapon_dolls.setdefault(weapon_key, set()).add(doll_key)
+            self._join(weapon_key, self._signature(weapon_key))
+
+    def update_weapons(self, weapons, previous=None):
+        """
+        Rejoins the dolls after the weapons page was parsed
+        When weapons was built on top of previous, the one the dolls are
+        joined against, only the weapons in its re-parsed tables are rejoined
+        """
+
+        with self._lock:
+            if weapons is self._weapons:
+                return
+
+            if previous is not None and previous is self._weapons:
+                # Tables that were re-parsed, or that are gone from the page
+                changed_types = set(weapons.reparsed_tables)
+                changed_types.update(previous.tables.keys() - weapons.tables.keys())
+                changed_tables = [
+                    table
+                    for weapon_type in changed_types
+                    for table in (
+                        previous.tables.get(weapon_type, {}),
+                        weapons.tables.get(weapon_type, {}),
+                    )
+                ]
+                weapon_keys = [
+                    weapon_key
+                    for weapon_key in self._weapon_dolls
+                    if any(weapon_key in table for table in changed_tables)
+                ]
+            else:
+                weapon_keys = list(self._weapon_dolls)
+
+            self._weapons = weapons
+            for weapon_key in weapon_keys:
+                self._join(weapon_key, self._signature(weapon_key))
+
+    def _signature(self, weapon_key):
+        """
+        Internal function to build the signature weapon of a weapon key from
+        the loaded weapons page, called with the lock held
+        """
+
+        if self._weapons is None:
+            return None
+
+        weapon = self._weapons.get_weapon(weapon_key)
+
+        return SignatureWeapon(weapon) if weapon is not None else None
+
+    def _join(self, weapon_key, signature):
+        """
+        Internal function to point every doll of a weapon key at signature,
+        called with the lock held
+        """
+
+        for doll_key in self._weapon_dolls.get(weapon_key, ()):
+            if signature is not None:
+                self._joined[doll_key] = signature
+            else:
+                self._joined.pop(doll_key, None)
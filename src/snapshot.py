@@ -0,0 +1,233 @@
+"""
+Cache snapshots
+
+Packs data/cache/ into a single versioned, checksummed archive and loads it
+back, so a fresh host can serve everything from local data right after boot
+instead of re-learning the whole dataset from IOPWIKI
+
+Usage (from src/, like main.py):
+    python snapshot.py export lenna_cache.tar.gz
+    python snapshot.py import lenna_cache.tar.gz
+"""
+
+import argparse
+from datetime import datetime, timezone
+import hashlib
+import io
+import json
+import logging
+import os
+import tarfile
+
+from cache import (
+    Cache,
+    DATE_FORMAT,
+    FETCHED_STRING,
+    PARSE_STRING,
+    REVID_STRING,
+)
+
+LOGFILE = "lenna_snapshot.log"
+
+SNAPSHOT_FORMAT = "lenna-cache-snapshot"
+SNAPSHOT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+ENTRIES_DIRECTORY = "cache/"
+
+
+class SnapshotException(Exception):
+    """
+    Exception for when a snapshot is unreadable or fails verification
+    """
+
+    def __init__(self, message):
+        self.message = f"SnapshotException: {message}"
+        super().__init__(self.message)
+
+
+def _checksum(data):
+    """
+    Internal function to checksum a single entry
+    """
+
+    return hashlib.sha256(data).hexdigest()
+
+
+def _manifest_checksum(entries):
+    """
+    Internal function to checksum the manifest entries as a whole
+    """
+
+    digest = hashlib.sha256()
+    for key in sorted(entries):
+        digest.update(f"{key}:{entries[key]['sha256']}\n".encode("utf8"))
+
+    return digest.hexdigest()
+
+
+def export_snapshot(cache, archive_path):
+    """
+    Writes every cache entry, with its revision ID and checksum, into
+    a gzipped tar archive
+    Returns the manifest of the written snapshot
+    """
+
+    entries = {}
+    with tarfile.open(archive_path, "w:gz") as archive:
+        for key in cache.keys():
+            with open(cache.path(key), "rb") as cache_file:
+                data = cache_file.read()
+
+            # Corrupt entries are left out of the snapshot rather than shipped
+            try:
+                payload = json.loads(data)
+            except json.JSONDecodeError:
+                payload = None
+
+            if not isinstance(payload, dict):
+                cache.log.warning(f"SNAPSHOT: Skipping unreadable entry {key}")
+                continue
+
+            entries[key] = {
+                "sha256": _checksum(data),
+                "size": len(data),
+                "revid": payload.get(PARSE_STRING, {}).get(REVID_STRING),
+                "fetched": payload.get(FETCHED_STRING),
+            }
+
+            entry_info = tarfile.TarInfo(f"{ENTRIES_DIRECTORY}{key}.json")
+            entry_info.size = len(data)
+            archive.addfile(entry_info, io.BytesIO(data))
+
+        manifest = {
+            "format": SNAPSHOT_FORMAT,
+            "version": SNAPSHOT_VERSION,
+            "created": datetime.now(timezone.utc).strftime(DATE_FORMAT),
+            "checksum": _manifest_checksum(entries),
+            "entries": entries,
+        }
+        manifest_data = json.dumps(manifest, indent=4).encode("utf8")
+
+        manifest_info = tarfile.TarInfo(MANIFEST_FILE)
+        manifest_info.size = len(manifest_data)
+        archive.addfile(manifest_info, io.BytesIO(manifest_data))
+
+    cache.log.info(f"SNAPSHOT: Exported {len(entries)} entries to {archive_path}")
+
+    return manifest
+
+
+def read_manifest(archive):
+    """
+    Reads and validates the manifest of an open snapshot archive
+    """
+
+    try:
+        manifest_file = archive.extractfile(MANIFEST_FILE)
+    except KeyError:
+        raise SnapshotException("Snapshot has no manifest!")
+
+    manifest = json.load(manifest_file)
+
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        raise SnapshotException("File is not a Lenna cache snapshot!")
+
+    if manifest.get("version") != SNAPSHOT_VERSION:
+        raise SnapshotException(
+            f"Snapshot version {manifest.get('version')} is not supported, "
+            f"expected version {SNAPSHOT_VERSION}!"
+        )
+
+    if manifest.get("checksum") != _manifest_checksum(manifest["entries"]):
+        raise SnapshotException("Snapshot manifest checksum does not match!")
+
+    return manifest
+
+
+def _entry_data(archive, key):
+    """
+    Internal function to read the data of an entry from an open snapshot
+    archive
+    """
+
+    try:
+        return archive.extractfile(f"{ENTRIES_DIRECTORY}{key}.json").read()
+    except KeyError:
+        raise SnapshotException(f"Entry {key} is missing from the snapshot!")
+
+
+def verify_snapshot(archive, manifest):
+    """
+    Verifies every entry of an open snapshot archive against its manifest
+    Raises SnapshotException on the first invalid or corrupt entry
+    """
+
+    for key, entry in manifest["entries"].items():
+        # Keys are file names, never paths
+        if os.path.basename(key) != key:
+            raise SnapshotException(f"Invalid cache key {key} in snapshot!")
+
+        if _checksum(_entry_data(archive, key)) != entry["sha256"]:
+            raise SnapshotException(f"Checksum of {key} does not match!")
+
+
+def import_snapshot(cache, archive_path, overwrite=False):
+    """
+    Verifies a snapshot and loads its entries into the cache
+    Nothing is written unless every entry checks out, so a corrupt snapshot
+    never leaves the cache half-imported
+    Existing entries are kept unless overwrite is set
+
+    Returns the number of entries written
+    """
+
+    written = 0
+    with tarfile.open(archive_path, "r:gz") as archive:
+        manifest = read_manifest(archive)
+        verify_snapshot(archive, manifest)
+
+        for key in manifest["entries"]:
+            if not overwrite and os.path.exists(cache.path(key)):
+                continue
+
+            cache.store_raw(key, _entry_data(archive, key))
+            written += 1
+
+    cache.flush()
+    cache.log.info(f"SNAPSHOT: Imported {written} entries from {archive_path}")
+
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exports or imports Lenna's cache")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Pack the cache")
+    export_parser.add_argument("archive", help="Snapshot file to write")
+
+    import_parser = subparsers.add_parser("import", help="Load a snapshot")
+    import_parser.add_argument("archive", help="Snapshot file to read")
+    import_parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="Replace cache entries that already exist",
+    )
+    args = parser.parse_args()
+
+    log = logging.getLogger(__name__)
+    logging.basicConfig(filename=LOGFILE, encoding="utf-8")
+    log.setLevel(logging.INFO)
+
+    cache = Cache(log)
+
+    if args.command == "export":
+        manifest = export_snapshot(cache, args.archive)
+        print(f"Exported {len(manifest['entries'])} entries to {args.archive}")
+    else:
+        written = import_snapshot(cache, args.archive, overwrite=args.overwrite)
+        print(f"Imported {written} entries from {args.archive}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,8 @@ StatusEffects class
 a dictionary representation of a status effect's name and its effects
 """
 
+import re
+
 import wikitextparser as wtp
 
 from parse_utils import (
@@ -24,6 +26,10 @@ class StatusEffects:
     def __init__(self, status_effects_json):
         self.status_effects = self._parse_status_effects_wikitext(status_effects_json)
 
+        # Built on the first mentioned_in call, with the names by lowercase
+        self._mention_pattern = None
+        self._mention_names = None
+
     def get_status_effect(self, status_effect_name):
         """
         Gets the effect given the status effect name
@@ -31,6 +37,31 @@ class StatusEffects:
 
         return self.status_effects.get(status_effect_name, None)
 
+    def mentioned_in(self, text):
+        """
+        Finds the status effects a text, like a skill description, mentions
+        Matches whole words regardless of case, longer names first, so
+        "Acid Corrosion II" is not also found as "Acid Corrosion"
+        Returns the set of status effect names
+        """
+
+        if not self.status_effects:
+            return set()
+
+        if self._mention_pattern is None:
+            names = sorted(self.status_effects, key=len, reverse=True)
+            self._mention_pattern = re.compile(
+                r"\b(?:" + "|".join(re.escape(name) for name in names) + r")\b",
+                re.IGNORECASE,
+            )
+            self._mention_names = {name.lower(): name for name in self.status_effects}
+
+        # Mentions keep the text's case, map them back to the names
+        return {
+            self._mention_names[mention.group(0).lower()]
+            for mention in self._mention_pattern.finditer(text)
+        }
+
     def _parse_status_effects_wikitext(self, status_effects_json):
         """
         Maps status effect name to its effect
@@ -0,0 +1,293 @@
+"""
+Throttle class
+
+Cooldowns and duplicate collapsing for Lenna's lookups. Every lookup takes a
+use from sliding-window cooldown buckets of its user, channel and guild, and
+force lookups also from stricter force buckets. A lookup asked again in the
+same channel while the first one is running, or shortly after it was
+answered, is collapsed into a reply pointing at the earlier answer
+"""
+
+import asyncio
+from collections import deque
+import os
+import time
+
+import discord
+
+from metrics import (
+    LOOKUPS_COLLAPSED,
+    LOOKUPS_THROTTLED,
+    Metrics,
+)
+
+# Cooldown scopes
+SCOPE_USER = "user"
+SCOPE_CHANNEL = "channel"
+SCOPE_GUILD = "guild"
+
+# Cooldowns as (uses, per seconds), set like LENNA_COOLDOWN_USER=5/10 or
+# LENNA_FORCE_COOLDOWN_GUILD=5/60, an empty value turns a bucket off
+COOLDOWN_ENV = "LENNA_COOLDOWN_{scope}"
+FORCE_COOLDOWN_ENV = "LENNA_FORCE_COOLDOWN_{scope}"
+DEFAULT_COOLDOWNS = {
+    SCOPE_USER: (5, 10.0),
+    SCOPE_CHANNEL: (20, 10.0),
+    SCOPE_GUILD: (60, 10.0),
+}
+DEFAULT_FORCE_COOLDOWNS = {
+    SCOPE_USER: (2, 60.0),
+    SCOPE_GUILD: (5, 60.0),
+}
+COOLDOWN_SEPARATOR = "/"
+
+# Repeats of a lookup within this many seconds are collapsed
+COLLAPSE_SECONDS_ENV = "LENNA_COLLAPSE_SECONDS"
+DEFAULT_COLLAPSE_SECONDS = 15.0
+
+# Seconds between two sweeps of expired buckets and answers
+SWEEP_INTERVAL = 60.0
+
+
+def parse_cooldown(value):
+    """
+    Parses a cooldown such as "5/10" into (uses, per seconds)
+    Returns None for an empty value
+    """
+
+    if not value:
+        return None
+
+    uses, _, seconds = value.partition(COOLDOWN_SEPARATOR)
+
+    return int(uses), float(seconds)
+
+
+def _cooldowns(defaults, env):
+    """
+    Internal function to read cooldowns from the environment
+    """
+
+    cooldowns = {}
+    for scope, default_cooldown in defaults.items():
+        value = os.getenv(env.format(scope=scope.upper()))
+        cooldown = parse_cooldown(value) if value is not None else default_cooldown
+        if cooldown is not None:
+            cooldowns[scope] = cooldown
+
+    return cooldowns
+
+
+class Throttle:
+    """
+    Throttle class definition
+
+    Only used from the event loop, so it takes no locks
+    """
+
+    def __init__(
+        self,
+        log,
+        metrics=None,
+        cooldowns=None,
+        force_cooldowns=None,
+        collapse_seconds=None,
+    ):
+        self.log = log
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.cooldowns = (
+            cooldowns
+            if cooldowns is not None
+            else _cooldowns(DEFAULT_COOLDOWNS, COOLDOWN_ENV)
+        )
+        self.force_cooldowns = (
+            force_cooldowns
+            if force_cooldowns is not None
+            else _cooldowns(DEFAULT_FORCE_COOLDOWNS, FORCE_COOLDOWN_ENV)
+        )
+        self.collapse_seconds = (
+            collapse_seconds
+            if collapse_seconds is not None
+            else float(os.getenv(COLLAPSE_SECONDS_ENV, DEFAULT_COLLAPSE_SECONDS))
+        )
+
+        # Bucket key to the times of its uses within the window
+        self._buckets = {}
+        # User to when their cooldown warning expires
+        self._warned = {}
+        # Lookup key to (start time, future of the message that answered it)
+        self._answers = {}
+        self._last_sweep_time = time.monotonic()
+
+    def acquire(self, ctx, force=False):
+        """
+        Takes a use from every bucket the command counts against
+        Returns None when it may run, or the seconds until it may when one
+        of the buckets is used up, in which case no use is taken
+        """
+
+        now = time.monotonic()
+        self._sweep(now)
+
+        buckets = self._bucket_keys(ctx, self.cooldowns, force=False)
+        if force:
+            buckets += self._bucket_keys(ctx, self.force_cooldowns, force=True)
+
+        # The used up bucket that frees up last decides how long to wait
+        retry_after = None
+        throttled_scope = None
+        for key, (uses, seconds) in buckets:
+            bucket = self._buckets.setdefault(key, deque())
+            while bucket and now - bucket[0] >= seconds:
+                bucket.popleft()
+
+            if len(bucket) >= uses:
+                bucket_retry_after = bucket[0] + seconds - now
+                if retry_after is None or bucket_retry_after > retry_after:
+                    retry_after = bucket_retry_after
+                    throttled_scope = key[1]
+
+        if retry_after is not None:
+            self.metrics.inc(LOOKUPS_THROTTLED, scope=throttled_scope)
+            self.log.info(
+                f"THROTTLE: {self._user(ctx)} is on {throttled_scope} cooldown "
+                f"for {retry_after:.1f}s"
+            )
+            return retry_after
+
+        for key, _ in buckets:
+            self._buckets[key].append(now)
+
+        return None
+
+    def should_warn(self, ctx, retry_after):
+        """
+        Checks whether a user on cooldown should be told so
+        Each user is only warned once per cooldown, further commands are dropped
+        """
+
+        now = time.monotonic()
+        user_id = self._scope_id(ctx, SCOPE_USER)
+        if self._warned.get(user_id, 0.0) > now:
+            return False
+
+        self._warned[user_id] = now + retry_after
+
+        return True
+
+    def earlier(self, key):
+        """
+        Returns the future of the earlier answer to the same lookup, or None
+        when it was not asked within the collapse window
+        """
+
+        answer = self._answers.get(key)
+        if answer is None:
+            return None
+
+        start_time, future = answer
+        if time.monotonic() - start_time >= self.collapse_seconds:
+            del self._answers[key]
+            return None
+
+        self.metrics.inc(LOOKUPS_COLLAPSED, command=key[1])
+
+        return future
+
+    def remember(self, key):
+        """
+        Starts remembering the answer to a lookup
+        Returns the future to resolve with the message that answered it
+        """
+
+        future = asyncio.get_running_loop().create_future()
+        self._answers[key] = (time.monotonic(), future)
+
+        return future
+
+    def lookup_key(self, ctx, command, args, per_user=False):
+        """
+        Returns the key repeats of a lookup in the same channel share, or
+        only the repeats by the same user when per_user is set
+        """
+
+        return (
+            self._scope_id(ctx, SCOPE_CHANNEL),
+            command,
+            " ".join(str(arg) for arg in args).lower(),
+            self._scope_id(ctx, SCOPE_USER) if per_user else None,
+        )
+
+    def _bucket_keys(self, ctx, cooldowns, force):
+        """
+        Internal function to list the (bucket key, cooldown) pairs of a command
+        Scopes a command has no ID for, like the guild of a DM, are left out
+        """
+
+        bucket_keys = []
+        for scope, cooldown in cooldowns.items():
+            scope_id = self._scope_id(ctx, scope)
+            if scope_id is None:
+                continue
+
+            bucket_keys.append(((force, scope, scope_id), cooldown))
+
+        return bucket_keys
+
+    def _scope_id(self, ctx, scope):
+        """
+        Internal function to get the ID of the user, channel or guild of ctx,
+        a command context or a slash command interaction
+        """
+
+        if scope == SCOPE_USER:
+            return self._user(ctx).id
+        elif scope == SCOPE_CHANNEL:
+            return ctx.channel.id
+
+        guild = getattr(ctx, "guild", None)
+
+        return guild.id if guild is not None else None
+
+    def _user(self, ctx):
+        """
+        Internal function to get the user of a command or of a slash command
+        interaction, which calls them author and user
+        """
+
+        return ctx.user if isinstance(ctx, discord.Interaction) else ctx.author
+
+    def _sweep(self, now):
+        """
+        Internal function to forget empty buckets, expired warnings and
+        answers past the collapse window
+        """
+
+        if now - self._last_sweep_time < SWEEP_INTERVAL:
+            return
+
+        self._last_sweep_time = now
+
+        longest_cooldown = max(
+            (
+                seconds
+                for _, seconds in (
+                    *self.cooldowns.values(),
+                    *self.force_cooldowns.values(),
+                )
+            ),
+            default=0.0,
+        )
+        self._buckets = {
+            key: bucket
+            for key, bucket in self._buckets.items()
+            if bucket and now - bucket[-1] < longest_cooldown
+        }
+        self._warned = {
+            user_id: until for user_id, until in self._warned.items() if until > now
+        }
+        self._answers = {
+            key: (start_time, future)
+            for key, (start_time, future) in self._answers.items()
+            if now - start_time < self.collapse_seconds
+        }
@@ -0,0 +1,112 @@
+"""
+Tracer class
+
+Lightweight tracing spans for Lenna's lookups
+Each command is a root span, phases of the lookup (cache reads, wiki queries,
+parsing, embed construction) are nested spans under it. Commands slower than
+the threshold have their whole span tree written to the log
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+import os
+import time
+
+SLOW_REQUEST_MS_ENV = "LENNA_SLOW_REQUEST_MS"
+DEFAULT_SLOW_REQUEST_MS = 2000
+
+# The span currently open in this task or thread
+_current_span = ContextVar("lenna_current_span", default=None)
+
+
+class Span:
+    """
+    A single timed phase of a request
+    """
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        self.children = []
+        self.start_time = time.perf_counter()
+        self.end_time = None
+
+    def finish(self):
+        self.end_time = time.perf_counter()
+
+    @property
+    def duration_ms(self):
+        end_time = self.end_time if self.end_time is not None else time.perf_counter()
+
+        return (end_time - self.start_time) * 1000
+
+    def render(self, depth=0):
+        """
+        Renders the span and its children as an indented tree
+        """
+
+        attributes = "".join(
+            f" {name}={value}" for name, value in self.attributes.items()
+        )
+        lines = [f"{'  ' * depth}{self.name}{attributes} {self.duration_ms:.1f}ms"]
+        for child in self.children:
+            lines += child.render(depth + 1)
+
+        return lines
+
+
+class Tracer:
+    """
+    Tracer class definition
+    """
+
+    def __init__(self, log, slow_request_ms=None):
+        self.log = log
+
+        if slow_request_ms is None:
+            slow_request_ms = float(
+                os.getenv(SLOW_REQUEST_MS_ENV, DEFAULT_SLOW_REQUEST_MS)
+            )
+        self.slow_request_ms = slow_request_ms
+
+    @contextmanager
+    def trace(self, name, **attributes):
+        """
+        Opens a root span for a request
+        Logs the span tree if the request took longer than slow_request_ms
+        """
+
+        root = Span(name, attributes)
+        token = _current_span.set(root)
+        try:
+            yield root
+        finally:
+            root.finish()
+            _current_span.reset(token)
+
+            if root.duration_ms >= self.slow_request_ms:
+                span_tree = "\n".join(root.render())
+                self.log.warning(
+                    f"TRACE: Slow request {name} took {root.duration_ms:.1f}ms\n{span_tree}"
+                )
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """
+        Opens a span nested under the current one
+        Does nothing when there is no request being traced
+        """
+
+        parent = _current_span.get()
+        if parent is None:
+            yield None
+            return
+
+        span = Span(name, attributes)
+        parent.children.append(span)
+        token = _current_span.set(span)
+        try:
+            yield span
+        finally:
+            span.finish()
+            _current_span.reset(token)
@@ -5,20 +5,156 @@ Class that basically serves as the bot
 It watches channel for prompts and responds as needed
 """
 
+import asyncio
+from contextlib import asynccontextmanager, nullcontext
+import math
+import os
 import random
 import re
+import time
 from textwrap import dedent
 
 from functools import partial, wraps
 import discord
+from discord import app_commands
 from discord.ext import commands
 
+from cache import (
+    STATUS_EFFECTS_CACHE_KEY,
+    WEAPONS_CACHE_KEY,
+    doll_cache_key,
+)
+from loop_monitor import LoopMonitor
+from metrics import (
+    AUTOCOMPLETE_SECONDS,
+    COMMAND_SECONDS,
+    DEFAULT_METRICS_PORT,
+    METRICS_PORT_ENV,
+    Metrics,
+    MetricsServer,
+)
+from name_index import (
+    DOLL_NAMES,
+    STATUS_EFFECT_NAMES,
+    WEAPON_NAMES,
+    NameIndex,
+)
+from prefetch import Prefetcher
+from profiler import CommandProfiler
 from responder import Responder
+from scheduler import (
+    LANE_CACHE,
+    LANE_INSTANT,
+    LANE_NETWORK,
+    BusyException,
+    CommandScheduler,
+)
+from throttle import Throttle
+from tracing import Tracer
 
 LENNA_BINGO_VIDEO = "lenna_bingo_video"
 LEVA_BINGO_VIDEO = "leva_bingo_video"
 JUST_PULL_GIF = "silver_wolf_pull_gif"
 ADMIN_ROLES_FILE = "../data/admin.txt"
+EMBED_FIELD_LIMIT = 1024
+
+# Lookups run under cooldowns and repeats of them are collapsed,
+# force lookups get stricter quotas
+LOOKUP_COMMANDS = (
+    "doll",
+    "mdoll",
+    "fdoll",
+    "keys",
+    "fkeys",
+    "weapon",
+    "mweapon",
+    "fweapon",
+    "define",
+    "dolls",
+    "weapons",
+    "effects",
+)
+FORCE_COMMANDS = ("fdoll", "fkeys", "fweapon")
+
+# An empty value turns off the privileged message content intent prefix
+# commands need in servers, leaving the slash commands
+PREFIX_COMMANDS_ENV = "LENNA_PREFIX_COMMANDS"
+DEFAULT_PREFIX_COMMANDS = "1"
+
+# Interactions have to be acknowledged within 3 seconds, lookups the cache
+# can answer that take longer than this are deferred
+DEFER_AFTER_SECONDS = 1.0
+
+# Batch lookups take comma separated names, one embed each, and Discord
+# takes at most 10 embeds of at most 6000 characters together per message
+BATCH_SEPARATOR = ","
+MAX_BATCH_NAMES = 10
+EMBEDS_PER_MESSAGE = 10
+MESSAGE_EMBED_LIMIT = 6000
+
+
+def fix_name(name):
+    """
+    Fixes the name to properly capitalize them
+    Returns the fixed name
+
+    E.g., "MoSIN-naGANt" -> "Mosin-Nagant"
+
+    thank you @jiggles8675!
+    """
+
+    return re.sub(r"[A-Za-z]+([A-Za-z]+)?", lambda i: i.group(0).capitalize(), name)
+
+
+def split_names(args):
+    """
+    Splits the arguments of a batch lookup into the names to look up
+    Repeated names are only looked up once
+
+    E.g., ["makiatto,", "qiongjiu,", "MAKIATTO"] -> ["makiatto", "qiongjiu"]
+    """
+
+    names = {}
+    for name in " ".join(args).split(BATCH_SEPARATOR):
+        name = name.strip()
+        if name:
+            names.setdefault(name.lower(), name)
+
+    return list(names.values())
+
+
+def embed_batches(embeds):
+    """
+    Groups embeds into as few messages as Discord allows
+    Returns a list of lists of embeds, one per message
+    """
+
+    batches = []
+    batch_size = 0
+    for embed in embeds:
+        if (
+            not batches
+            or len(batches[-1]) >= EMBEDS_PER_MESSAGE
+            or batch_size + len(embed) > MESSAGE_EMBED_LIMIT
+        ):
+            batches.append([])
+            batch_size = 0
+
+        batches[-1].append(embed)
+        batch_size += len(embed)
+
+    return batches
+
+
+def capitalize_roman_numerals(string):
+    """
+    Fixes the string to capitalize roman numerals
+
+    Adapted from chatgpt because @aguren really hates regex (sorry)
+    """
+
+    roman_numeral_regex = r"\b[MCDXLIVmcdxliv]+\b"
+    return re.sub(roman_numeral_regex, lambda i: i.group(0).upper(), string)
 
 
 class Watcher:
@@ -29,7 +165,7 @@ class Watcher:
     # Doll lookup variable
     _INCLUDE_KEYS_STRING = "with_keys"
 
-    def __init__(self, log, token, cmd_prefix):
+    def __init__(self, log, token, cmd_prefix, cache=None, wiki=None):
         self.admin_roles = []
         with open(ADMIN_ROLES_FILE, "r") as admin_file:
             admin_text = admin_file.read().split("\n")
@@ -43,19 +179,42 @@ class Watcher:
         self.log = log
         self.token = token
         self.cmd_prefix = cmd_prefix
-        self.responder = Responder(self.log, cmd_prefix)
+        self.metrics = Metrics()
+        self.metrics_server = None
+        self.tracer = Tracer(self.log)
+        self.loop_monitor = LoopMonitor(self.log, self.metrics)
+        self.profiler = CommandProfiler(self.log)
+        self.scheduler = CommandScheduler(self.log, metrics=self.metrics)
+        self.throttle = Throttle(self.log, metrics=self.metrics)
+        self.names = NameIndex()
+        self.prefetcher = Prefetcher(
+            self.log, metrics=self.metrics, busy=self.scheduler.busy
+        )
+        self.responder = Responder(
+            self.log,
+            cmd_prefix,
+            metrics=self.metrics,
+            tracer=self.tracer,
+            cache=cache,
+            wiki=wiki,
+        )
 
         self.intents = discord.Intents.default()
-        self.intents.message_content = True
+        self.intents.message_content = bool(
+            os.getenv(PREFIX_COMMANDS_ENV, DEFAULT_PREFIX_COMMANDS)
+        )
         self.bot = commands.Bot(command_prefix=cmd_prefix, intents=self.intents)
         self.bot.remove_command("help")  # removes default help command
 
         self.bot.event(self._on_ready)
-
-        self._add_command("help", Watcher.help)
-        self._add_command("bingo", Watcher.bingo)
-        self._add_command("just_pull", Watcher.just_pull)
-        self._add_command("echo", Watcher.echo)
+        self._ready = False
+
+        # Commands given a lane run in it whole, lookups pick their lane
+        # once they know whether the cache can answer them
+        self._add_command("help", Watcher.help, lane=LANE_INSTANT)
+        self._add_command("bingo", Watcher.bingo, lane=LANE_INSTANT)
+        self._add_command("just_pull", Watcher.just_pull, lane=LANE_INSTANT)
+        self._add_command("echo", Watcher.echo, lane=LANE_INSTANT)
         self._add_command("doll", Watcher.doll)
         self._add_command("mdoll", Watcher.mdoll)
         self._add_command("fdoll", Watcher.fdoll)
@@ -65,15 +224,72 @@ class Watcher:
         self._add_command("mweapon", Watcher.mweapon)
         self._add_command("fweapon", Watcher.fweapon)
         self._add_command("define", Watcher.define)
+        self._add_command("dolls", Watcher.dolls)
+        self._add_command("weapons", Watcher.weapons)
+        self._add_command("effects", Watcher.effects)
+        self._add_command("invalidate", Watcher.invalidate, lane=LANE_INSTANT)
+        self._add_command("stats", Watcher.stats, lane=LANE_INSTANT)
+        self._add_command("profile", Watcher.profile, lane=LANE_INSTANT)
+
+        # Slash commands, their name autocompletes from the names Lenna knows
+        self._add_slash_command(
+            "doll",
+            "Looks up doll information",
+            DOLL_NAMES,
+            self._doll_cache_keys,
+            self._doll_lookup,
+        )
+        self._add_slash_command(
+            "keys",
+            "Looks up a doll's neural keys",
+            DOLL_NAMES,
+            self._doll_cache_keys,
+            self._doll_lookup,
+            with_doll=False,
+            with_keys=True,
+        )
+        self._add_slash_command(
+            "weapon",
+            "Looks up weapon information",
+            WEAPON_NAMES,
+            lambda _: [WEAPONS_CACHE_KEY],
+            self._weapon_lookup,
+        )
+        self._add_slash_command(
+            "define",
+            "Defines a status effect",
+            STATUS_EFFECT_NAMES,
+            lambda _: [STATUS_EFFECTS_CACHE_KEY],
+            self._status_effect_lookup,
+        )
 
     async def _on_ready(self):
         self.log.info(f"WATCHER: Lenna logged in as user: {self.bot.user}")
 
+        # on_ready fires again after reconnects, the monitor only starts once
+        self.loop_monitor.start()
+
+        # Slash commands are synced and names loaded on the first one only
+        if self._ready:
+            return
+
+        self._ready = True
+        await self._sync_slash_commands()
+        await self._load_names()
+
     def run(self):
         """
         Runs the bot inside Watcher
         """
 
+        # An empty port disables the metrics endpoint
+        metrics_port = os.getenv(METRICS_PORT_ENV, str(DEFAULT_METRICS_PORT))
+        if metrics_port:
+            self.metrics_server = MetricsServer(
+                self.log, self.metrics, int(metrics_port)
+            )
+            self.metrics_server.start()
+
         self.bot.run(self.token)
 
     def close(self):
@@ -82,8 +298,14 @@ class Watcher:
         """
 
         self.log.info("WATCHER: Shutting down")
+        self.loop_monitor.stop()
+        self.prefetcher.close()
+        self.scheduler.close()
         self.responder.close()
 
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+
     async def help(self, ctx, *args):
         """
         Help function to show what commands LennaBot can handle
@@ -131,18 +353,25 @@ class Watcher:
         Looks up doll information
         """
 
-        embed = self._doll_lookup(doll_name, force=False)
+        embed = await self._lookup(
+            self._doll_cache_keys(doll_name), self._doll_lookup, doll_name
+        )
 
-        await ctx.send(embed=embed)
+        return await ctx.send(embed=embed)
 
     async def mdoll(self, ctx, doll_name):
         """
         For debugging, forces cache lookup
         """
 
-        embed = self._doll_lookup(doll_name, force=False, use_cache=True)
+        embed = await self._lookup(
+            self._doll_cache_keys(doll_name),
+            self._doll_lookup,
+            doll_name,
+            use_cache=True,
+        )
 
-        await ctx.send(embed=embed)
+        return await ctx.send(embed=embed)
 
     async def fdoll(self, ctx, doll_name):
         """
@@ -150,36 +379,50 @@ class Watcher:
         """
 
         if self.allowed(ctx):
-            embed = self._doll_lookup(doll_name, force=True)
+            embed = await self._lookup(
+                self._doll_cache_keys(doll_name),
+                self._doll_lookup,
+                doll_name,
+                force=True,
+            )
         else:
             embed = self.create_unallowed_embed()
 
-        await ctx.send(embed=embed)
+        return await ctx.send(embed=embed)
 
     async def keys(self, ctx, doll_name):
         """
         Looks up doll information and returns only the keys
         """
 
-        embed = self._doll_lookup(
-            doll_name, with_doll=False, with_keys=True, force=False
+        embed = await self._lookup(
+            self._doll_cache_keys(doll_name),
+            self._doll_lookup,
+            doll_name,
+            with_doll=False,
+            with_keys=True,
         )
 
-        await ctx.send(embed=embed)
+        return await ctx.send(embed=embed)
 
     async def fkeys(self, ctx, doll_name):
         """
-        Looks up doll information and returns only the keys
+        Looks up doll information and returns only the keys, forces query to wiki
         """
 
         if self.allowed(ctx):
-            embed = self._doll_lookup(
-                doll_name, with_doll=False, with_keys=True, force=False
+            embed = await self._lookup(
+                self._doll_cache_keys(doll_name),
+                self._doll_lookup,
+                doll_name,
+                with_doll=False,
+                with_keys=True,
+                force=True,
             )
         else:
             embed = self.create_unallowed_embed()
 
-        await ctx.send(embed=embed)
+        return await ctx.send(embed=embed)
 
     async def weapon(self, ctx, *args):
         """
@@ -187,9 +430,11 @@ class Watcher:
         """
 
         weapon_name = " ".join(args)
-        embed = self._weapon_lookup(weapon_name)
+        embed = await self._lookup(
+            [WEAPONS_CACHE_KEY], self._weapon_lookup, weapon_name
+        )
 
-        await ctx.send(embed=embed)
+        return await ctx.send(embed=embed)
 
     async def mweapon(self, ctx, *args):
         """
@@ -197,9 +442,11 @@ class Watcher:
         """
 
         weapon_name = " ".join(args)
-        embed = self._weapon_lookup(weapon_name, use_cache=True)
+        embed = await self._lookup(
+            [WEAPONS_CACHE_KEY], self._weapon_lookup, weapon_name, use_cache=True
+        )
 
-        await ctx.send(embed=embed)
+        return await ctx.send(embed=embed)
 
     async def fweapon(self, ctx, *args):
         """
@@ -208,11 +455,17 @@ class Watcher:
 
         if self.allowed(ctx):
             weapon_name = " ".join(args)
-            embed = self._weapon_lookup(weapon_name, force=True, use_cache=True)
+            embed = await self._lookup(
+                [WEAPONS_CACHE_KEY],
+                self._weapon_lookup,
+                weapon_name,
+                force=True,
+                use_cache=True,
+            )
         else:
             embed = self.create_unallowed_embed()
 
-        await ctx.send(embed=embed)
+        return await ctx.send(embed=embed)
 
     async def define(self, ctx, *args):
         """
@@ -220,7 +473,83 @@ class Watcher:
         """
 
         status_effect_name = " ".join(args)
-        embed = self._status_effect_lookup(status_effect_name)
+        embed = await self._lookup(
+            [STATUS_EFFECTS_CACHE_KEY], self._status_effect_lookup, status_effect_name
+        )
+
+        return await ctx.send(embed=embed)
+
+    async def dolls(self, ctx, *args):
+        """
+        Looks up several dolls at once, e.g., a whole team
+        """
+
+        doll_names = split_names(args)
+        cache_keys = [
+            cache_key
+            for doll_name in doll_names
+            for cache_key in self._doll_cache_keys(doll_name)
+        ]
+        embeds = await self._lookup(cache_keys, self._dolls_lookup, doll_names)
+
+        return await self._send_embeds(ctx, embeds)
+
+    async def weapons(self, ctx, *args):
+        """
+        Looks up several weapons at once
+        """
+
+        embeds = await self._lookup(
+            [WEAPONS_CACHE_KEY], self._weapons_lookup, split_names(args)
+        )
+
+        return await self._send_embeds(ctx, embeds)
+
+    async def effects(self, ctx, *args):
+        """
+        Defines several status effects at once
+        """
+
+        embeds = await self._lookup(
+            [STATUS_EFFECTS_CACHE_KEY], self._status_effects_lookup, split_names(args)
+        )
+
+        return await self._send_embeds(ctx, embeds)
+
+    async def invalidate(self, ctx, entity, *args):
+        """
+        Marks cached entries as stale without querying the wiki
+        """
+
+        if self.allowed(ctx):
+            pattern = " ".join(args).strip() or "*"
+            embed = self._invalidate(entity, pattern)
+        else:
+            embed = self.create_unallowed_embed()
+
+        await ctx.send(embed=embed)
+
+    async def stats(self, ctx):
+        """
+        Shows command latencies, cache hit ratios and wiki usage
+        """
+
+        if self.allowed(ctx):
+            embed = self.responder.get_stats_embed()
+        else:
+            embed = self.create_unallowed_embed()
+
+        await ctx.send(embed=embed)
+
+    async def profile(self, ctx, count="1"):
+        """
+        Profiles the next few commands and posts the hot spots
+        """
+
+        if self.allowed(ctx):
+            embed = self._profile(ctx, count)
+        else:
+            embed = self.create_unallowed_embed()
 
         await ctx.send(embed=embed)
 
@@ -242,7 +571,7 @@ class Watcher:
         Creates an embed to show that command is not allowed by user privilege
         """
 
-        unallowed_msg = f"""
+        unallowed_msg = """
             Sorry, Shikikan, but looks like you do not have enough clearance!
             If you think this is an error, please ping @aguren!!!
         """
@@ -255,13 +584,394 @@ class Watcher:
 
         return embed
 
-    def _add_command(self, name, func):
+    def create_busy_embed(self):
+        """
+        Creates an embed to show that Lenna has too many lookups to take another
+        """
+
+        busy_msg = """
+            Eh!? So many Shikikans are asking Lenna things at once!
+            Lenna can't keep up right now, please try again in a little bit ~
+        """
+
+        embed = discord.Embed(
+            title="Lenna Is Busy",
+            description=dedent(busy_msg),
+            color=discord.Color.red(),
+        )
+
+        return embed
+
+    def create_batch_failure_embed(self, count):
+        """
+        Creates an embed to show that a batch lookup asked for too many or no names
+        """
+
+        batch_failure_msg = f"""
+            Eh!? Lenna can look up 1 to {MAX_BATCH_NAMES} names at once, but Shikikan asked for {count}!
+            Separate the names with commas, like `!dolls makiatto, qiongjiu` ~
+        """
+
+        embed = discord.Embed(
+            title="Batch Lookup Failure",
+            description=dedent(batch_failure_msg),
+            color=discord.Color.red(),
+        )
+
+        return embed
+
+    def create_cooldown_embed(self, retry_after):
+        """
+        Creates an embed to show that the user has to wait before looking up more
+        """
+
+        cooldown_msg = f"""
+            Eh!? That's a lot of questions, Shikikan!
+            Let Lenna catch her breath, you can ask again in {math.ceil(retry_after)} seconds ~
+        """
+
+        embed = discord.Embed(
+            title="Slow Down",
+            description=dedent(cooldown_msg),
+            color=discord.Color.red(),
+        )
+
+        return embed
+
+    def create_collapsed_embed(self, message):
+        """
+        Creates an embed pointing at Lenna's earlier answer to the same lookup
+        """
+
+        collapsed_msg = f"""
+            Shikikan, Lenna just answered that one!
+            [Take a look here]({message.jump_url}) ~
+        """
+
+        embed = discord.Embed(
+            title="Already Answered",
+            description=dedent(collapsed_msg),
+            color=discord.Color.orange(),
+        )
+
+        return embed
+
+    def _add_command(self, name, func, lane=None):
         """
         Helper function to add the command to the bot
         taken from https://stackoverflow.com/questions/75674926/how-do-i-add-commands-to-a-class-discord-py
         """
 
-        self.bot.command(name=name)(wraps(func)(partial(func, self)))
+        self.bot.command(name=name)(
+            wraps(func)(partial(self._run_command, name, func, lane))
+        )
+
+    def _add_slash_command(
+        self, command, description, kind, cache_keys, lookup, **kwargs
+    ):
+        """
+        Helper function to add the slash command version of a lookup
+        cache_keys(name) lists the cache entries the lookup reads, its name
+        argument autocompletes from the names of kind Lenna knows
+        """
+
+        @app_commands.describe(name="Name to look up, pick one as you type")
+        async def callback(interaction: discord.Interaction, name: str):
+            await self._run_slash_command(
+                command, interaction, name, cache_keys(name), lookup, **kwargs
+            )
+
+        async def autocomplete(interaction: discord.Interaction, current: str):
+            return self._autocomplete(kind, current)
+
+        slash_command = app_commands.Command(
+            name=command, description=description, callback=callback
+        )
+        slash_command.autocomplete("name")(autocomplete)
+
+        self.bot.tree.add_command(slash_command)
+
+    async def _run_command(self, name, func, lane, ctx, *args, **kwargs):
+        """
+        Internal function that runs a command
+        """
+
+        async with self._command(name, ctx.author, args):
+            if name in LOOKUP_COMMANDS:
+                await self._run_lookup_command(
+                    name,
+                    ctx,
+                    args,
+                    partial(func, self, ctx, *args, **kwargs),
+                    partial(self._notify_context, ctx),
+                )
+            else:
+                slot = self.scheduler.slot(lane) if lane else nullcontext()
+                async with slot:
+                    await func(self, ctx, *args, **kwargs)
+
+    async def _run_slash_command(
+        self, name, interaction, query, cache_keys, lookup, **kwargs
+    ):
+        """
+        Internal function that runs a slash command lookup
+        """
+
+        async with self._command(f"/{name}", interaction.user, [query]):
+            await self._run_lookup_command(
+                name,
+                interaction,
+                [query],
+                partial(
+                    self._answer_interaction,
+                    interaction,
+                    cache_keys,
+                    lookup,
+                    query,
+                    **kwargs,
+                ),
+                partial(self._notify_interaction, interaction),
+            )
+
+    @asynccontextmanager
+    async def _command(self, name, user, args):
+        """
+        Internal function that wraps a command and records its latency
+        Each command is traced, slow ones are written to the log
+        """
+
+        start_time = time.perf_counter()
+        try:
+            with self.tracer.trace(
+                name, user=user, args=" ".join(str(arg) for arg in args)
+            ):
+                with self.profiler.profile():
+                    yield
+        finally:
+            self.metrics.observe(
+                COMMAND_SECONDS, time.perf_counter() - start_time, command=name
+            )
+
+            if self.profiler.finished:
+                await self._post_profile()
+
+    async def _run_lookup_command(self, name, ctx, args, answer, notify):
+        """
+        Internal function that runs a lookup command under the cooldowns
+        A repeat of a lookup in the same channel is answered with a reply to
+        the earlier answer instead of being looked up again
+
+        answer() looks it up and returns the message it was answered with,
+        notify(embed, reference) tells the user about cooldowns and repeats
+        """
+
+        # Only force lookups that will run take force uses, so users who may
+        # not run them cannot use up the quotas of those who may
+        force = name in FORCE_COMMANDS
+        retry_after = self.throttle.acquire(ctx, force=force and self.allowed(ctx))
+        if retry_after is not None:
+            # Slash commands fail unless they are answered, they are always told
+            warn = self.throttle.should_warn(ctx, retry_after)
+            if warn or isinstance(ctx, discord.Interaction):
+                await notify(self.create_cooldown_embed(retry_after))
+            return
+
+        # Whether a force lookup runs depends on who asked, so only their own
+        # repeats are collapsed
+        key = self.throttle.lookup_key(ctx, name, args, per_user=force)
+        earlier = self.throttle.earlier(key)
+        if earlier is not None:
+            # Shielded, so a cancelled repeat does not cancel the earlier answer
+            message = await asyncio.shield(earlier)
+            if message is not None:
+                await notify(self.create_collapsed_embed(message), reference=message)
+                return
+
+        future = self.throttle.remember(key)
+        message = None
+        try:
+            message = await answer()
+        finally:
+            # Repeats of a failed lookup look it up again themselves
+            future.set_result(message)
+
+    async def _notify_context(self, ctx, embed, reference=None):
+        """
+        Internal function to tell a prefix command's user something, as a
+        reply to reference when given
+        """
+
+        await ctx.send(embed=embed, reference=reference, mention_author=False)
+
+    async def _notify_interaction(self, interaction, embed, reference=None):
+        """
+        Internal function to tell a slash command's user something, only they
+        see it
+        """
+
+        await self._respond(interaction, embed, ephemeral=True)
+
+    async def _answer_interaction(
+        self, interaction, cache_keys, lookup, *args, **kwargs
+    ):
+        """
+        Internal function to answer a slash command with a lookup
+        Lookups that have to query the wiki defer right away, and lookups the
+        cache can answer once they take longer than DEFER_AFTER_SECONDS, so
+        the interaction never times out; the answer then follows up
+        Returns the message it was answered with
+        """
+
+        if self._lookup_lane(cache_keys, **kwargs) == LANE_NETWORK:
+            await interaction.response.defer(thinking=True)
+
+        lookup_task = asyncio.ensure_future(
+            self._lookup(cache_keys, lookup, *args, **kwargs)
+        )
+        if not interaction.response.is_done():
+            done, _ = await asyncio.wait([lookup_task], timeout=DEFER_AFTER_SECONDS)
+            if not done:
+                await interaction.response.defer(thinking=True)
+
+        return await self._respond(interaction, await lookup_task)
+
+    async def _respond(self, interaction, embed, ephemeral=False):
+        """
+        Internal function to answer an interaction, or to follow up on it
+        once it was deferred
+        Returns the message sent
+        """
+
+        if interaction.response.is_done():
+            return await interaction.followup.send(
+                embed=embed, ephemeral=ephemeral, wait=True
+            )
+
+        response = await interaction.response.send_message(
+            embed=embed, ephemeral=ephemeral
+        )
+
+        return response.resource
+
+    def _autocomplete(self, kind, current):
+        """
+        Internal function to autocomplete a name from the name index
+        Never touches the cache or the wiki, so it answers in microseconds
+        """
+
+        start_time = time.perf_counter()
+        names = self.names.complete(kind, current)
+        self.metrics.observe(
+            AUTOCOMPLETE_SECONDS, time.perf_counter() - start_time, kind=kind
+        )
+
+        return [app_commands.Choice(name=name, value=name) for name in names]
+
+    async def _sync_slash_commands(self):
+        """
+        Internal function to register the slash commands with Discord
+        """
+
+        try:
+            synced = await self.bot.tree.sync()
+            self.log.info(f"WATCHER: Synced {len(synced)} slash commands")
+        except discord.HTTPException as e:
+            self.log.error("WATCHER: Failed to sync slash commands")
+            self.log.error(f"WATCHER: Exception:\n{e}")
+
+    async def _load_names(self):
+        """
+        Internal function to fill the name index from the cache
+        """
+
+        try:
+            await self.scheduler.run(LANE_CACHE, self._index_cached_names)
+        except Exception as e:
+            self.log.error("WATCHER: Failed to load the names to autocomplete")
+            self.log.error(f"WATCHER: Exception:\n{e}")
+
+    def _index_cached_names(self):
+        """
+        Internal function to index every doll in the cache and the weapons and
+        status effects of the cached pages, without querying the wiki
+        """
+
+        self.names.replace(
+            DOLL_NAMES,
+            (fix_name(doll_key) for doll_key in self.responder.cache.doll_keys()),
+        )
+        self.responder.load_cached()
+        self._index_loaded_names()
+
+        self.log.info(
+            f"WATCHER: Indexed {self.names.size(DOLL_NAMES)} dolls, "
+            f"{self.names.size(WEAPON_NAMES)} weapons and "
+            f"{self.names.size(STATUS_EFFECT_NAMES)} status effects"
+        )
+
+    def _index_loaded_names(self):
+        """
+        Internal function to index the names of the weapons and status effects
+        the responder has loaded, skipped when they were not re-parsed
+        """
+
+        weapons = self.responder.weapons
+        if weapons is not None:
+            self.names.replace(
+                WEAPON_NAMES,
+                (weapon.name for weapon in weapons.weapons.values()),
+                source=weapons,
+            )
+
+        status_effects = self.responder.status_effects
+        if status_effects is not None:
+            self.names.replace(
+                STATUS_EFFECT_NAMES,
+                status_effects.status_effects,
+                source=status_effects,
+            )
+
+    async def _send_embeds(self, ctx, embeds):
+        """
+        Internal function to send embeds in as few messages as Discord allows
+        Returns the first message sent
+        """
+
+        # A lookup that was turned away answers with a single busy embed
+        if isinstance(embeds, discord.Embed):
+            embeds = [embeds]
+
+        first_message = None
+        for batch in embed_batches(embeds):
+            message = await ctx.send(embeds=batch)
+            if first_message is None:
+                first_message = message
+
+        return first_message
+
+    async def _post_profile(self):
+        """
+        Internal function to post the profile summary where it was requested
+        """
+
+        channel = self.profiler.channel
+        summary = self.profiler.summary()
+
+        embed = discord.Embed(
+            title="Profile Summary",
+            description="Time per function and memory allocated while profiling",
+            color=discord.Color.orange(),
+        )
+        for section, lines in summary.items():
+            value = "\n".join(lines) or "Nothing recorded"
+            embed.add_field(
+                name=section,
+                value=value[:EMBED_FIELD_LIMIT],
+                inline=False,
+            )
+
+        if channel is not None:
+            await channel.send(embed=embed)
 
     def help_embed(self, command_name=None):
         """
@@ -270,6 +980,44 @@ class Watcher:
 
         return self.responder.get_help_embed(command_name=command_name)
 
+    async def _lookup(self, cache_keys, lookup, *args, force=False, **kwargs):
+        """
+        Internal function to run a lookup off the event loop
+        It runs in the cache lane when every entry it needs is cached and
+        fresh, in the network lane otherwise, also when an entry is due for
+        its revision check
+        When too many lookups are queued, answers with a busy embed instead
+        """
+
+        lane = self._lookup_lane(cache_keys, force=force, **kwargs)
+
+        try:
+            return await self.scheduler.run(lane, lookup, *args, force=force, **kwargs)
+        except BusyException as e:
+            self.log.warning(f"WATCHER: {e.message}")
+
+            return self.create_busy_embed()
+
+    def _lookup_lane(self, cache_keys, force=False, use_cache=False, **kwargs):
+        """
+        Internal function to pick the lane of a lookup from the cache entries
+        it reads
+        """
+
+        # Force lookups query the wiki even when told to use the cache
+        cached = not force and (
+            use_cache or all(self.responder.cache.is_fresh(key) for key in cache_keys)
+        )
+
+        return LANE_CACHE if cached else LANE_NETWORK
+
+    def _doll_cache_keys(self, doll_name):
+        """
+        Internal function to list the cache entries a doll lookup reads
+        """
+
+        return self.responder.cache.group(doll_cache_key(doll_name))
+
     def _doll_lookup(
         self, doll_name, with_doll=True, with_keys=False, force=False, use_cache=False
     ):
@@ -279,7 +1027,7 @@ class Watcher:
 
         embed = None
         try:
-            fixed_doll_name = self._fix_name(doll_name)
+            fixed_doll_name = fix_name(doll_name)
             embed = self.responder.get_doll(
                 fixed_doll_name,
                 with_doll=with_doll,
@@ -287,24 +1035,16 @@ class Watcher:
                 force=force,
                 use_cache=use_cache,
             )
+            self._found_doll(fixed_doll_name)
 
-            self.log.info(f"WATCHER: Doll Embed Fields: {str(embed.fields)}")
+            self.log.debug("WATCHER: Doll Embed Fields: %s", embed.fields)
         except Exception as e:
             self.log.error(
                 f"WATCHER: Received an error when looking up doll information for {doll_name}"
             )
             self.log.error(f"WATCHER: Exception:\n{e}")
 
-            lookup_failure_message = f"""
-                Eh!? Lenna doesn't know {doll_name}, are you sure you typed their name correctly, Shikikan?
-                If you think this is a mistake, please talk to @aguren ~
-            """
-
-            embed = discord.Embed(
-                title="Doll Lookup Failure",
-                description=dedent(lookup_failure_message),
-                color=discord.Color.red(),
-            )
+            embed = self._doll_failure_embed(doll_name)
 
         return embed
 
@@ -321,24 +1061,16 @@ class Watcher:
                 force=force,
                 use_cache=use_cache,
             )
+            self._index_loaded_names()
 
-            self.log.info(f"WATCHER: Weapon Embed Fields: {str(embed.fields)}")
+            self.log.debug("WATCHER: Weapon Embed Fields: %s", embed.fields)
         except Exception as e:
             self.log.error(
                 f"WATCHER: Received an error when looking up weapon information for {weapon_name}"
             )
             self.log.error(f"WATCHER: Exception:\n{e}")
 
-            lookup_failure_message = f"""
-                Eh!? Lenna doesn't know {weapon_name}, are you sure you typed the weapon name correctly, Shikikan?
-                If you think this is a mistake, please talk to @aguren ~
-            """
-
-            embed = discord.Embed(
-                title="Weapon Lookup Failure",
-                description=dedent(lookup_failure_message),
-                color=discord.Color.red(),
-            )
+            embed = self._weapon_failure_embed(weapon_name)
 
         return embed
 
@@ -349,8 +1081,8 @@ class Watcher:
 
         embed = None
         try:
-            fixed_status_effect_name = self._fix_name(status_effect_name)
-            fixed_status_effect_name = self._capitalize_roman_numerals(
+            fixed_status_effect_name = fix_name(status_effect_name)
+            fixed_status_effect_name = capitalize_roman_numerals(
                 fixed_status_effect_name
             )
 
@@ -359,45 +1091,228 @@ class Watcher:
                 force=force,
                 use_cache=use_cache,
             )
+            self._index_loaded_names()
 
-            self.log.info(f"WATCHER: Status Effect Embed Fields: {str(embed.fields)}")
+            self.log.debug("WATCHER: Status Effect Embed Fields: %s", embed.fields)
         except Exception as e:
             self.log.error(
                 f"WATCHER: Received an error when looking up status effect information for {status_effect_name}"
             )
             self.log.error(f"WATCHER: Exception:\n{e}")
 
-            lookup_failure_message = f"""
-                Eh!? Lenna doesn't know {status_effect_name}, are you sure you typed the status effect name correctly, Shikikan?
-                If you think this is a mistake, please talk to @aguren ~
-            """
+            embed = self._status_effect_failure_embed(status_effect_name)
 
-            embed = discord.Embed(
-                title="Status Effect Lookup Failure",
-                description=dedent(lookup_failure_message),
-                color=discord.Color.red(),
-            )
+        return embed
+
+    def _dolls_lookup(self, doll_names, force=False, use_cache=False):
+        """
+        Internal function to look up several dolls, their missing pages are
+        downloaded together
+        """
+
+        return self._batch_lookup(
+            doll_names,
+            fix_name,
+            partial(self.responder.get_dolls, use_cache=use_cache),
+            self._doll_failure_embed,
+            "doll",
+            found=self._found_doll,
+        )
+
+    def _found_doll(self, doll_name):
+        """
+        Internal function to remember a doll that was found and warm what is
+        likely asked about it next
+        """
+
+        self.names.add(DOLL_NAMES, doll_name)
+        self._prefetch_related(doll_name)
+
+    def _prefetch_related(self, doll_name):
+        """
+        Internal function to warm a doll's signature weapon and status
+        effects in the background
+        """
+
+        self.prefetcher.submit(
+            doll_cache_key(doll_name), self.responder.prefetch_related, doll_name
+        )
+
+    def _weapons_lookup(self, weapon_names, force=False, use_cache=False):
+        """
+        Internal function to look up several weapons
+        """
+
+        embeds = self._batch_lookup(
+            weapon_names,
+            str.lower,
+            partial(self.responder.get_weapons, use_cache=use_cache),
+            self._weapon_failure_embed,
+            "weapon",
+        )
+        self._index_loaded_names()
+
+        return embeds
+
+    def _status_effects_lookup(self, status_effect_names, force=False, use_cache=False):
+        """
+        Internal function to look up several status effects
+        """
+
+        embeds = self._batch_lookup(
+            status_effect_names,
+            lambda name: capitalize_roman_numerals(fix_name(name)),
+            partial(self.responder.get_status_effects, use_cache=use_cache),
+            self._status_effect_failure_embed,
+            "status effect",
+        )
+        self._index_loaded_names()
+
+        return embeds
+
+    def _batch_lookup(self, names, fix, get_many, failure_embed, entity, found=None):
+        """
+        Internal function to look up several names with one responder call
+        Each name that failed gets its own failure embed, found(fixed name)
+        is called for every name that was found
+        """
+
+        if not 0 < len(names) <= MAX_BATCH_NAMES:
+            return [self.create_batch_failure_embed(len(names))]
+
+        fixed_names = [fix(name) for name in names]
+        try:
+            results = get_many(fixed_names)
+        except Exception as e:
+            # The shared page could not be loaded, every name failed
+            results = [e] * len(names)
+
+        embeds = []
+        for name, fixed_name, result in zip(names, fixed_names, results):
+            if isinstance(result, Exception):
+                self.log.error(
+                    f"WATCHER: Received an error when looking up {entity} information for {name}"
+                )
+                self.log.error(f"WATCHER: Exception:\n{result}")
+
+                embeds.append(failure_embed(name))
+            else:
+                if found is not None:
+                    found(fixed_name)
+
+                embeds.append(result)
+
+        return embeds
+
+    def _doll_failure_embed(self, doll_name):
+        """
+        Internal function to create the embed for a doll Lenna does not know
+        """
+
+        lookup_failure_message = f"""
+            Eh!? Lenna doesn't know {doll_name}, are you sure you typed their name correctly, Shikikan?
+            If you think this is a mistake, please talk to @aguren ~
+        """
+
+        embed = discord.Embed(
+            title="Doll Lookup Failure",
+            description=dedent(lookup_failure_message),
+            color=discord.Color.red(),
+        )
 
         return embed
 
-    def _fix_name(self, name):
+    def _weapon_failure_embed(self, weapon_name):
+        """
+        Internal function to create the embed for a weapon Lenna does not know
+        """
+
+        lookup_failure_message = f"""
+            Eh!? Lenna doesn't know {weapon_name}, are you sure you typed the weapon name correctly, Shikikan?
+            If you think this is a mistake, please talk to @aguren ~
         """
-        Fixes the name to properly capitalize them
-        Returns the fixed name
 
-        E.g., "MoSIN-naGANt" -> "Mosin-Nagant"
+        embed = discord.Embed(
+            title="Weapon Lookup Failure",
+            description=dedent(lookup_failure_message),
+            color=discord.Color.red(),
+        )
+
+        return embed
 
-        thank you @jiggles8675!
+    def _status_effect_failure_embed(self, status_effect_name):
+        """
+        Internal function to create the embed for a status effect Lenna does not know
         """
 
-        return re.sub(r"[A-Za-z]+([A-Za-z]+)?", lambda i: i.group(0).capitalize(), name)
+        lookup_failure_message = f"""
+            Eh!? Lenna doesn't know {status_effect_name}, are you sure you typed the status effect name correctly, Shikikan?
+            If you think this is a mistake, please talk to @aguren ~
+        """
 
-    def _capitalize_roman_numerals(self, string):
+        embed = discord.Embed(
+            title="Status Effect Lookup Failure",
+            description=dedent(lookup_failure_message),
+            color=discord.Color.red(),
+        )
+
+        return embed
+
+    def _profile(self, ctx, count):
         """
-        Fixes the string to capitalize roman numerals
+        Internal function to arm the profiler
+        """
+
+        embed = None
+        try:
+            count = int(count)
+            self.profiler.arm(count, ctx.channel)
+
+            embed = discord.Embed(
+                title="Profiling",
+                description=f"Lenna will profile the next {count} commands, Shikikan!",
+                color=discord.Color.orange(),
+            )
+        except ValueError as e:
+            self.log.error(f"WATCHER: Could not profile {count} commands")
+            self.log.error(f"WATCHER: Exception:\n{e}")
 
-        Adapted from chatgpt because @aguren really hates regex (sorry)
+            profile_failure_message = f"""
+                Eh!? Lenna can't profile {count} commands, Shikikan!
+                Try a number between 1 and {CommandProfiler.MAX_COMMANDS} ~
+            """
+
+            embed = discord.Embed(
+                title="Profile Failure",
+                description=dedent(profile_failure_message),
+                color=discord.Color.red(),
+            )
+
+        return embed
+
+    def _invalidate(self, entity, pattern):
+        """
+        Internal function to invalidate cache entries
         """
 
-        roman_numeral_regex = r"\b[MCDXLIVmcdxliv]+\b"
-        return re.sub(roman_numeral_regex, lambda i: i.group(0).upper(), string)
+        embed = None
+        try:
+            embed = self.responder.invalidate(entity, pattern)
+        except Exception as e:
+            self.log.error(
+                f"WATCHER: Received an error when invalidating {entity} {pattern}"
+            )
+            self.log.error(f"WATCHER: Exception:\n{e}")
+
+            invalidate_failure_message = f"""
+                Eh!? Lenna doesn't know how to forget {entity} {pattern}, Shikikan!
+                Try one of: doll, weapon, effect ~
+            """
+
+            embed = discord.Embed(
+                title="Invalidate Failure",
+                description=dedent(invalidate_failure_message),
+                color=discord.Color.red(),
+            )
+
+        return embed
@@ -2,32 +2,87 @@
 Weapons class
 
 a collection of the singular, Weapon class
+The index is built per weapons table, each with a content hash, so a page
+edit only re-parses the tables it touched. Building it is a single table scan,
+weapon fields are only simplified once a weapon is looked at
 """
 
 from enum import Enum
+import hashlib
+import re
 
 import wikitextparser as wtp
 
 from parse_utils import (
     cleanup_string,
+    intern_string,
     simplify,
     table_data_to_dict,
 )
 
+# A weapons table, from its "{|" line to its "|}" line
+WEAPONS_TABLE_PATTERN = re.compile(r"^\{\|.*?^\|\}", re.MULTILINE | re.DOTALL)
+
 
 class Weapon:
     """
     Internal representation of a weapon
+    The text fields keep their raw wikitext and are simplified on first access
     """
 
+    # Indexes of the text fields
+    _GRADE_INDEX = 0
+    _DESCRIPTION_INDEX = 1
+    _SKILL_INDEX = 2
+    _TRAIT_INDEX = 3
+    _IMPRINT_INDEX = 4
+
+    __slots__ = ("type", "name", "_fields", "_simplified")
+
     def __init__(self, type, name, grade, description, skill, trait, imprint_boost):
         self.type = type
         self.name = name
-        self.grade = grade
-        self.description = description
-        self.skill = skill
-        self.trait = trait
-        self.imprint_boost = imprint_boost
+
+        # Raw wikitext until simplified, one bit per simplified field
+        self._fields = [grade, description, skill, trait, imprint_boost]
+        self._simplified = 0
+
+    @property
+    def grade(self):
+        return self._field(self._GRADE_INDEX)
+
+    @property
+    def description(self):
+        return self._field(self._DESCRIPTION_INDEX)
+
+    @property
+    def skill(self):
+        return self._field(self._SKILL_INDEX)
+
+    @property
+    def trait(self):
+        return self._field(self._TRAIT_INDEX)
+
+    @property
+    def imprint_boost(self):
+        return self._field(self._IMPRINT_INDEX)
+
+    def _field(self, index):
+        """
+        Internal function to simplify a text field once and remember it
+        """
+
+        if not self._simplified & (1 << index):
+            field = simplify(self._fields[index])
+
+            # Grades repeat across weapons, they share one copy
+            if index == self._GRADE_INDEX:
+                field = intern_string(field)
+
+            self._fields[index] = field
+            self._simplified |= 1 << index
+
+        return self._fields[index]
 
     def __str__(self):
         return f"Weapon(Name: {self.name}, Type: {self.type}, Grade: {self.grade}, Desc: {self.description}, Skill: {self.skill}, Trait: {self.trait}, Imprint: {self.imprint_boost})"
@@ -55,8 +110,23 @@ class Weapons:
         SG = 5
         BLADE = 6
 
-    def __init__(self, weapons_json):
-        self.weapons = self._parse_weapons_wikitable(weapons_json)
+    def __init__(self, weapons_json, previous=None):
+        tables = split_weapons_tables(weapons_json)
+        parsed_tables = parse_weapons_tables(changed_weapons_tables(tables, previous))
+
+        self._build(tables, parsed_tables, previous)
+
+    @classmethod
+    def from_tables(cls, tables, parsed_tables, previous=None):
+        """
+        Builds Weapons from split tables and the tables parsed out of them,
+        e.g., by a worker process
+        """
+
+        weapons = cls.__new__(cls)
+        weapons._build(tables, parsed_tables, previous)
+
+        return weapons
 
     def get_weapon(self, weapon_name):
         """
@@ -65,15 +135,34 @@ class Weapons:
 
         return self.weapons.get(weapon_name, None)
 
-    def _parse_weapons_wikitable(self, weapons_tables_json):
+    def _build(self, tables, parsed_tables, previous):
         """
-        Parses weapons table into a dictionary of weapon name to Weapon object
-        returns said dictionary
+        Internal function to assemble the weapons index
+        Tables that were not re-parsed keep the Weapon objects of previous
         """
 
-        weapons_tables = wtp.parse(weapons_tables_json).tables
+        # WeaponType to the content hash and weapons of its table
+        self.table_hashes = {}
+        self.tables = {}
+        self.reparsed_tables = list(parsed_tables)
+
+        self.weapons = {}
+        for weapon_type, table_hash, _ in tables:
+            weapons_table = parsed_tables.get(weapon_type)
+            if weapons_table is None:
+                weapons_table = previous.tables[weapon_type]
+
+            self.table_hashes[weapon_type] = table_hash
+            self.tables[weapon_type] = weapons_table
+            self.weapons.update(weapons_table)
+
+    @classmethod
+    def _parse_weapons_wikitable(cls, weapon_type, weapons_table_json):
+        """
+        Parses one weapons table into a dictionary of weapon name to Weapon object
+        returns said dictionary
+        """
 
-        # First, map WeaponType enums to a dictionary of weapons of that type.
         # The wikitext nested dictionary follows the format:
         # key = name
         # value[0] = grade
@@ -85,39 +174,81 @@ class Weapons:
         # value[6] = source/unlock method
         # value[7] = release CN
         # value[8] = release GL
-        weapons_dictionaries = {}
-        weapons_type_enum_iterator = 0
-        for weapons_table in weapons_tables:
-            weapons_table_data = weapons_table.data(span=False)
-            weapons_table_data = weapons_table_data[self._WEAPON_DATA_START_INDEX :]
-            weapons_dict = table_data_to_dict(weapons_table_data)
-
-            weapons_dictionaries[self.WeaponType(weapons_type_enum_iterator)] = (
-                weapons_dict
-            )
-            weapons_type_enum_iterator += 1
+        weapons_table_data = wtp.Table(weapons_table_json).data(span=False)
+        weapons_table_data = weapons_table_data[cls._WEAPON_DATA_START_INDEX :]
+        weapons_dict = table_data_to_dict(weapons_table_data)
 
         # Maps weapon name to Weapon class
         weapons_dictionary = {}
-        for weapon_type in weapons_dictionaries.keys():
-            weapons_dict = weapons_dictionaries[weapon_type]
+        for weapon_name in weapons_dict:
+            weapon_info = weapons_dict[weapon_name]
+
+            # Prune and lowercase weapon names to make them easier to key through
+            # names that already are lowercase share one string with the key
+            cleaned_weapon_name = cleanup_string(weapon_name)
+            pruned_weapon_name = cleaned_weapon_name.lower()
+            if pruned_weapon_name == cleaned_weapon_name:
+                pruned_weapon_name = cleaned_weapon_name
+
+            # Fields are simplified when the weapon is first looked at
+            weapon = Weapon(
+                weapon_type.name,
+                cleaned_weapon_name,
+                weapon_info[cls._WEAPON_GRADE_INDEX],
+                weapon_info[cls._WEAPON_DESCRIPTION_INDEX],
+                weapon_info[cls._WEAPON_SKILL_INDEX],
+                weapon_info[cls._WEAPON_TRAIT_INDEX],
+                weapon_info[cls._WEAPON_IMPRINT_INDEX],
+            )
 
-            for weapon_name in weapons_dict:
-                weapon_info = weapons_dict[weapon_name]
+            weapons_dictionary[pruned_weapon_name] = weapon
 
-                # Prune and lowercase weapon names to make them easier to key through
-                pruned_weapon_name = cleanup_string(weapon_name).lower()
+        return weapons_dictionary
 
-                weapon = Weapon(
-                    weapon_type.name,
-                    cleanup_string(weapon_name),
-                    simplify(weapon_info[self._WEAPON_GRADE_INDEX]),
-                    simplify(weapon_info[self._WEAPON_DESCRIPTION_INDEX]),
-                    simplify(weapon_info[self._WEAPON_SKILL_INDEX]),
-                    simplify(weapon_info[self._WEAPON_TRAIT_INDEX]),
-                    simplify(weapon_info[self._WEAPON_IMPRINT_INDEX]),
-                )
 
-                weapons_dictionary[pruned_weapon_name] = weapon
+def split_weapons_tables(weapons_tables_json):
+    """
+    Splits the weapons page into its tables, in WeaponType order
+    Only finds the table boundaries, which is far cheaper than parsing the page
 
-        return weapons_dictionary
+    Returns a list of (WeaponType, content hash, table wikitext)
+    """
+
+    tables = []
+    for index, table_match in enumerate(
+        WEAPONS_TABLE_PATTERN.finditer(weapons_tables_json)
+    ):
+        table = table_match.group(0)
+        table_hash = hashlib.sha256(table.encode("utf8")).hexdigest()
+
+        tables.append((Weapons.WeaponType(index), table_hash, table))
+
+    return tables
+
+
+def changed_weapons_tables(tables, previous=None):
+    """
+    Picks the split tables whose content differs from the ones previous
+    was built from, every table when there is no previous
+    """
+
+    if previous is None:
+        return tables
+
+    return [
+        (weapon_type, table_hash, table)
+        for weapon_type, table_hash, table in tables
+        if previous.table_hashes.get(weapon_type) != table_hash
+    ]
+
+
+def parse_weapons_tables(tables):
+    """
+    Parses split tables
+    Returns a dictionary of WeaponType to its weapon name to Weapon dictionary
+    """
+
+    return {
+        weapon_type: Weapons._parse_weapons_wikitable(weapon_type, table)
+        for weapon_type, _, table in tables
+    }
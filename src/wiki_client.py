@@ -0,0 +1,361 @@
+"""
+WikiClient class
+
+Thin, rate-limited client over the IOPWIKI MediaWiki API
+Every request Lenna sends to the wiki goes through here
+"""
+
+from datetime import datetime
+import json
+import os
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+from metrics import (
+    Metrics,
+    WIKI_REQUEST_SECONDS,
+    WIKI_REQUESTS,
+    WIKI_RESPONSE_BYTES,
+)
+
+IOPWIKI_API_URL = "https://iopwiki.com/api.php"
+IOPWIKI_API_URL_ENV = "IOPWIKI_API_URL"
+IOPWIKI_DATA_FETCH_PARAM = (
+    "?action=parse&prop=wikitext|revid&format=json&redirects=1&page="
+)
+IOPWIKI_INFO_FETCH_PARAM = "?action=query&format=json&prop=info&titles="
+HEADERS_FILE = "../data/headers.json"
+
+
+class QueryFailedException(Exception):
+    """
+    Exception for when a query fails
+    """
+
+    def __init__(self, message):
+        self.message = f"QueryFailedException: {message}"
+        super().__init__(self.message)
+
+
+def load_headers(headers_file=HEADERS_FILE):
+    """
+    Loads the query headers that identify Lenna to the wiki
+    """
+
+    with open(headers_file, "r") as headers:
+        return dict(json.load(headers))
+
+
+class WikiClient:
+    """
+    WikiClient class definition
+    """
+
+    # Query variables
+    _GOOD_RESPONSE_CODE = 200
+    _TOO_MANY_REQUESTS_CODE = 429
+    _ERR_STRING = "error"
+    _TITLE_SEPARATOR = "|"
+
+    # MediaWiki caps titles per query at 50 for regular accounts
+    BATCH_SIZE = 50
+
+    # Seconds to wait between two requests to the wiki, short enough for
+    # interactive lookups, crawls fetch every page and space them further
+    MIN_REQUEST_INTERVAL = 0.1
+    CRAWL_REQUEST_INTERVAL = 1.0
+
+    # Seconds to wait for the wiki to answer
+    REQUEST_TIMEOUT = 30.0
+
+    # Seconds to back off after a 429 without a Retry-After header
+    DEFAULT_RETRY_AFTER = 10.0
+
+    # Parsing variables
+    _DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+    _TOUCHED_STRING = "touched"
+    _QUERY_STRING = "query"
+    _PAGES_STRING = "pages"
+    _CONTINUE_STRING = "continue"
+    _ACTION_STRING = "action"
+    _UNKNOWN_ACTION_STRING = "unknown"
+
+    def __init__(
+        self,
+        log,
+        headers,
+        api_url=None,
+        min_request_interval=MIN_REQUEST_INTERVAL,
+        metrics=None,
+        timeout=REQUEST_TIMEOUT,
+    ):
+        self.log = log
+        self.metrics = metrics if metrics is not None else Metrics()
+
+        # The API can be pointed elsewhere, e.g., at a local stand-in of the wiki
+        if api_url is None:
+            api_url = os.getenv(IOPWIKI_API_URL_ENV, IOPWIKI_API_URL)
+        self.api_url = api_url
+        self.min_request_interval = min_request_interval
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+
+        self._rate_lock = threading.Lock()
+        self._last_request_time = 0.0
+        self._retry_after_time = 0.0
+
+    def close(self):
+        self.session.close()
+
+    def query(self, query_url):
+        """
+        Sends a GET query to the full query_url
+        Returns the response JSON
+        """
+
+        self.log.info(f"WIKI: Querying {query_url}")
+
+        req = requests.Request("GET", query_url)
+
+        return self._send(req, query_url)
+
+    def query_params(self, params):
+        """
+        Sends a GET query to the API with the given parameters
+        Returns the response JSON
+        """
+
+        self.log.info(f"WIKI: Querying {self.api_url} with {params}")
+
+        req = requests.Request("GET", self.api_url, params=params)
+
+        return self._send(req, self.api_url)
+
+    def parse_page(self, page_title):
+        """
+        Fetches a single page through action=parse
+        """
+
+        return self.query(f"{self.api_url}{IOPWIKI_DATA_FETCH_PARAM}{page_title}")
+
+    def page_info(self, page_title):
+        """
+        Queries the wiki for page information
+        Will not work as intended if page_title contains multiple titles
+
+        Returns the page's prop=info dictionary
+        """
+
+        query_url = f"{self.api_url}{IOPWIKI_INFO_FETCH_PARAM}{page_title}"
+        query_json = self.query(query_url)
+
+        pages = query_json[self._QUERY_STRING][self._PAGES_STRING]
+        page_id = None
+
+        # We use for each here, but we only expect 1 page to be returned
+        for page in pages:
+            page_id = page
+
+        return pages[page_id]
+
+    def page_last_edit(self, page_title):
+        """
+        Returns the last edit ("touched" field) of the page
+        """
+
+        return datetime.strptime(
+            self.page_info(page_title)[self._TOUCHED_STRING], self._DATE_FORMAT
+        )
+
+    def fetch_pages(self, page_titles):
+        """
+        Fetches the wikitext of many pages, BATCH_SIZE titles per request
+
+        Returns a dictionary of requested title to a payload shaped like an
+        action=parse response, or None if the page does not exist
+        """
+
+        pages = {}
+        for batch in self._batches(page_titles):
+            pages.update(self._fetch_batch(batch))
+
+        return pages
+
+    def category_members(self, category):
+        """
+        Lists the titles of every article in a category
+        """
+
+        params = {
+            "action": "query",
+            "format": "json",
+            "formatversion": "2",
+            "list": "categorymembers",
+            "cmtitle": category,
+            "cmnamespace": "0",
+            "cmlimit": "max",
+        }
+
+        titles = []
+        while True:
+            response = self.query_params(params)
+
+            for member in response[self._QUERY_STRING]["categorymembers"]:
+                titles.append(member["title"])
+
+            if self._CONTINUE_STRING not in response:
+                break
+
+            params.update(response[self._CONTINUE_STRING])
+
+        return titles
+
+    def _batches(self, page_titles):
+        """
+        Internal function to split titles into API-sized batches
+        """
+
+        page_titles = list(page_titles)
+        for i in range(0, len(page_titles), self.BATCH_SIZE):
+            yield page_titles[i : i + self.BATCH_SIZE]
+
+    def _fetch_batch(self, page_titles):
+        """
+        Internal function to fetch the latest revision of up to BATCH_SIZE pages
+        """
+
+        params = {
+            "action": "query",
+            "format": "json",
+            "formatversion": "2",
+            "prop": "revisions",
+            "rvprop": "content|ids",
+            "rvslots": "main",
+            "redirects": "1",
+            "titles": self._TITLE_SEPARATOR.join(page_titles),
+        }
+
+        response = self.query_params(params)
+        query = response[self._QUERY_STRING]
+
+        # Follow title normalization ("GFL2_Weapons" -> "GFL2 Weapons") and redirects
+        resolved = {}
+        for mapping in query.get("normalized", []) + query.get("redirects", []):
+            resolved[mapping["from"]] = mapping["to"]
+
+        pages_by_title = {}
+        for page in query[self._PAGES_STRING]:
+            pages_by_title[page["title"]] = page
+
+        payloads = {}
+        for page_title in page_titles:
+            title = page_title
+            while title in resolved:
+                title = resolved[title]
+
+            page = pages_by_title.get(title)
+            if page is None or page.get("missing") or "revisions" not in page:
+                payloads[page_title] = None
+                continue
+
+            revision = page["revisions"][0]
+            payloads[page_title] = {
+                "parse": {
+                    "title": page["title"],
+                    "pageid": page["pageid"],
+                    "revid": revision["revid"],
+                    "wikitext": {
+                        "*": revision["slots"]["main"]["content"],
+                    },
+                }
+            }
+
+        return payloads
+
+    def _wait_for_rate_limit(self):
+        """
+        Internal function to space out requests by min_request_interval
+        Each request reserves its send time under the lock and waits for it
+        outside, so waiting requests do not hold up the ones reserving
+        """
+
+        with self._rate_lock:
+            # The wiki may have asked us to slow down
+            send_time = max(
+                time.monotonic(),
+                self._last_request_time + self.min_request_interval,
+                self._retry_after_time,
+            )
+            self._last_request_time = send_time
+
+        delay = send_time - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _back_off(self, response):
+        """
+        Internal function to hold off further requests after a 429
+        """
+
+        try:
+            retry_after = float(response.headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            retry_after = self.DEFAULT_RETRY_AFTER
+
+        self.log.warning(f"WIKI: Rate limited, backing off for {retry_after}s")
+        with self._rate_lock:
+            self._retry_after_time = time.monotonic() + retry_after
+
+    def _send(self, req, query_url):
+        """
+        Internal function to send a prepared request
+        """
+
+        self._wait_for_rate_limit()
+
+        prepared_req = self.session.prepare_request(req)
+        action = parse_qs(urlsplit(prepared_req.url).query).get(
+            self._ACTION_STRING, [self._UNKNOWN_ACTION_STRING]
+        )[0]
+
+        start_time = time.perf_counter()
+        try:
+            response = self.session.send(prepared_req, timeout=self.timeout)
+        except requests.RequestException:
+            self.metrics.inc(WIKI_REQUESTS, action=action, status="error")
+            raise
+
+        self.metrics.observe(
+            WIKI_REQUEST_SECONDS, time.perf_counter() - start_time, action=action
+        )
+        self.metrics.inc(WIKI_RESPONSE_BYTES, len(response.content), action=action)
+
+        # Error pages are not JSON, only read the body of good responses
+        content = None
+        status = "error"
+        reason = None
+        if response.status_code != self._GOOD_RESPONSE_CODE:
+            reason = f"{response.status_code} {response.reason}"
+
+            if response.status_code == self._TOO_MANY_REQUESTS_CODE:
+                status = "rate_limited"
+                self._back_off(response)
+        else:
+            content = json.loads(response.content)
+            if self._ERR_STRING in content:
+                reason = content[self._ERR_STRING]["info"]
+
+        if reason != None:
+            self.log.error(f"WIKI: Failed to query {query_url}")
+            self.log.error(f"Reason: {reason}")
+
+            self.metrics.inc(WIKI_REQUESTS, action=action, status=status)
+            raise QueryFailedException(reason)
+
+        self.metrics.inc(WIKI_REQUESTS, action=action, status="ok")
+
+        return content
@@ -0,0 +1,332 @@
+"""
+WikiServer class
+
+Local stand-in for the IOPWIKI api.php, answering the queries Lenna sends
+(action=parse, prop=info and batched prop=revisions) from recorded fixtures.
+Latency, server errors, timeouts and 429s can be injected to load-test Lenna
+against a slow or failing wiki. In record mode, pages missing from the
+fixtures are fetched from the real wiki once and recorded
+
+Usage (from src/, like main.py):
+    python wiki_server.py --port 8089 --latency-ms 300 --error-rate 0.05
+    IOPWIKI_API_URL=http://127.0.0.1:8089/api.php python main.py
+"""
+
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import random
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from cache import cache_key_for_title
+from fixtures import (
+    FIXTURES_DIRECTORY,
+    TITLE_SEPARATOR,
+    FixtureStore,
+)
+from wiki_client import (
+    IOPWIKI_API_URL,
+    WikiClient,
+    load_headers,
+)
+
+LOGFILE = "lenna_wiki_server.log"
+
+WIKI_SERVER_HOST = "127.0.0.1"
+DEFAULT_WIKI_SERVER_PORT = 8089
+API_PATH = "/api.php"
+JSON_CONTENT_TYPE = "application/json; charset=utf-8"
+TEXT_CONTENT_TYPE = "text/plain; charset=utf-8"
+
+# Faults
+FAULT_TIMEOUT = "timeout"
+FAULT_RATE_LIMIT = "rate_limit"
+FAULT_ERROR = "error"
+
+
+class WikiServer:
+    """
+    WikiServer class definition
+    """
+
+    def __init__(
+        self,
+        log,
+        store,
+        port=DEFAULT_WIKI_SERVER_PORT,
+        host=WIKI_SERVER_HOST,
+        latency_ms=0,
+        jitter_ms=0,
+        error_rate=0.0,
+        timeout_rate=0.0,
+        rate_limit_rate=0.0,
+        timeout_seconds=60.0,
+        retry_after=5,
+        upstream=None,
+        seed=None,
+    ):
+        self.log = log
+        self.store = store
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.timeout_seconds = timeout_seconds
+        self.retry_after = retry_after
+
+        # A WikiClient to the real wiki, only set in record mode
+        self.upstream = upstream
+
+        self._random = random.Random(seed)
+        self._record_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            "requests": 0,
+            FAULT_TIMEOUT: 0,
+            FAULT_RATE_LIMIT: 0,
+            FAULT_ERROR: 0,
+            "recorded": 0,
+        }
+
+        handler = self._make_handler()
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, name="lenna-wiki-server", daemon=True
+        )
+
+    @property
+    def api_url(self):
+        host, port = self.server.server_address[:2]
+
+        return f"http://{host}:{port}{API_PATH}"
+
+    def start(self):
+        self.log.info(
+            f"WIKI SERVER: Serving {len(self.store.keys())} pages on {self.api_url}"
+        )
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, params):
+        """
+        Answers one api.php query, injecting faults along the way
+        Returns a (status code, headers, body bytes) tuple, or None to drop
+        the connection without an answer
+        """
+
+        self._count("requests")
+
+        delay = self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms)
+        time.sleep(max(delay, 0) / 1000)
+
+        fault = self._pick_fault()
+        if fault is not None:
+            self._count(fault)
+            self.log.info(f"WIKI SERVER: Injecting {fault} for {params}")
+
+        if fault == FAULT_TIMEOUT:
+            time.sleep(self.timeout_seconds)
+            return None
+        elif fault == FAULT_RATE_LIMIT:
+            headers = {
+                "Content-Type": TEXT_CONTENT_TYPE,
+                "Retry-After": str(self.retry_after),
+            }
+            return 429, headers, b"Too Many Requests"
+        elif fault == FAULT_ERROR:
+            return 500, {"Content-Type": TEXT_CONTENT_TYPE}, b"Internal Server Error"
+
+        if self.upstream is not None:
+            self._record_missing(params)
+
+        status_code, body = self.store.respond(params)
+
+        headers = {"Content-Type": JSON_CONTENT_TYPE}
+
+        return status_code, headers, json.dumps(body).encode("utf8")
+
+    def _count(self, stat):
+        """
+        Internal function to count a served request, fault or recording
+        """
+
+        with self._stats_lock:
+            self.stats[stat] += 1
+
+    def _pick_fault(self):
+        """
+        Internal function to roll which fault, if any, hits a request
+        """
+
+        roll = self._random.random()
+        for fault, rate in (
+            (FAULT_TIMEOUT, self.timeout_rate),
+            (FAULT_RATE_LIMIT, self.rate_limit_rate),
+            (FAULT_ERROR, self.error_rate),
+        ):
+            if roll < rate:
+                return fault
+
+            roll -= rate
+
+        return None
+
+    def _record_missing(self, params):
+        """
+        Internal function to fetch pages the fixtures lack from the real wiki
+        """
+
+        page_titles = params.get("titles", params.get("page", "")).split(
+            TITLE_SEPARATOR
+        )
+
+        with self._record_lock:
+            missing = [
+                page_title
+                for page_title in page_titles
+                if page_title and self.store.get(page_title) is None
+            ]
+            if not missing:
+                return
+
+            for page_title, payload in self.upstream.fetch_pages(missing).items():
+                cache_key = cache_key_for_title(page_title)
+                if payload is None or cache_key is None:
+                    continue
+
+                self.log.info(f"WIKI SERVER: Recorded {page_title}")
+                self.store.record(cache_key, payload)
+                self._count("recorded")
+
+    def _make_handler(self):
+        """
+        Internal function to build a request handler bound to this server
+        """
+
+        wiki_server = self
+
+        class WikiHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlsplit(self.path)
+                if url.path != API_PATH:
+                    self.send_error(404)
+                    return
+
+                params = {
+                    name: values[0] for name, values in parse_qs(url.query).items()
+                }
+                answer = wiki_server.handle(params)
+                if answer is None:
+                    # Hang up like an overloaded server would
+                    self.close_connection = True
+                    return
+
+                status_code, headers, body = answer
+                self.send_response(status_code)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                wiki_server.log.info(f"WIKI SERVER: {format % args}")
+
+        return WikiHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serves a local stand-in of the IOPWIKI API from fixtures"
+    )
+    parser.add_argument("--port", type=int, default=DEFAULT_WIKI_SERVER_PORT)
+    parser.add_argument(
+        "--fixtures",
+        default=FIXTURES_DIRECTORY,
+        help="Directory of recorded API responses",
+    )
+    parser.add_argument(
+        "--latency-ms", type=float, default=0, help="Delay added to every answer"
+    )
+    parser.add_argument(
+        "--jitter-ms", type=float, default=0, help="Random spread of the delay"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="Share of 500 answers"
+    )
+    parser.add_argument(
+        "--timeout-rate",
+        type=float,
+        default=0.0,
+        help="Share of requests that are never answered",
+    )
+    parser.add_argument(
+        "--timeout-seconds",
+        type=float,
+        default=60.0,
+        help="How long unanswered requests are held before hanging up",
+    )
+    parser.add_argument(
+        "--rate-limit-rate", type=float, default=0.0, help="Share of 429 answers"
+    )
+    parser.add_argument(
+        "--retry-after",
+        type=int,
+        default=5,
+        help="Retry-After seconds sent with 429 answers",
+    )
+    parser.add_argument(
+        "--record",
+        action="store_true",
+        help="Fetch pages missing from the fixtures from IOPWIKI and record them",
+    )
+    parser.add_argument("--seed", type=int, help="Seed for reproducible faults")
+    args = parser.parse_args()
+
+    log = logging.getLogger(__name__)
+    logging.basicConfig(filename=LOGFILE, encoding="utf-8")
+    log.setLevel(logging.INFO)
+
+    upstream = None
+    if args.record:
+        upstream = WikiClient(log, load_headers(), api_url=IOPWIKI_API_URL)
+
+    wiki_server = WikiServer(
+        log,
+        FixtureStore(args.fixtures),
+        port=args.port,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        timeout_rate=args.timeout_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        timeout_seconds=args.timeout_seconds,
+        retry_after=args.retry_after,
+        upstream=upstream,
+        seed=args.seed,
+    )
+
+    print(f"Serving {len(wiki_server.store.keys())} pages on {wiki_server.api_url}")
+    print(f"Point Lenna at it with IOPWIKI_API_URL={wiki_server.api_url}")
+    try:
+        wiki_server.start()
+        wiki_server.thread.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        wiki_server.close()
+        if upstream is not None:
+            upstream.close()
+
+        print(f"Served {wiki_server.stats}")
+
+
+if __name__ == "__main__":
+    main()